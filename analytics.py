@@ -0,0 +1,173 @@
+#---Spending Reports (monthly / weekly / category / account / trend)---
+# A user's daily rollup buckets (see rollups.py) are loaded once into a pandas DataFrame;
+# currency conversion and every group-by below are vectorized. Each "row" is one
+# (day, account, category) bucket, so cost follows the number of buckets, not transactions.
+import itertools
+import numpy as np
+import pandas as pd
+
+import rate_history
+
+# MySQL's day number for 1970-01-01, to turn TO_DAYS() into numpy datetime64[D]
+TO_DAYS_EPOCH = 719528
+
+def daily_buckets_query(user_id, account_id=None):
+    """(sql, params) for the rollup_daily read in load_transactions()."""
+    query = """
+    SELECT TO_DAYS(r.bucket), CAST(ROUND(r.total * 100) AS SIGNED), r.account_id, r.category_id
+    FROM rollup_daily r
+    WHERE r.user_id = %s
+    """
+    params = [user_id]
+    if account_id is not None:
+        query += " AND r.account_id = %s"
+        params.append(account_id)
+    return query, tuple(params)
+
+def load_transactions(conn, user_id, account_id=None):
+    """
+    One query for all of the user's daily buckets. Only integers come over the wire
+    (day number, cents, ids): building arrays from those is ~10x cheaper than from
+    date/Decimal/str objects. Names, currencies and types are joined on from the small lookup tables.
+    Returns (df, accounts, categories) where the lookups are DataFrames indexed by id.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT account_id, account_name, currency FROM accounts WHERE user_id = %s", (user_id,))
+    accounts = pd.DataFrame.from_records(cursor.fetchall(), columns=['account_id', 'account_name', 'currency'], index='account_id')
+    accounts['currency'] = accounts['currency'].fillna('TRY')
+    cursor.execute("SELECT category_id, name, type FROM categories WHERE user_id = %s", (user_id,))
+    categories = pd.DataFrame.from_records(cursor.fetchall(), columns=['category_id', 'category_name', 'type'], index='category_id')
+
+    cursor.execute(*daily_buckets_query(user_id, account_id))
+    result = cursor.fetchall()
+    rows = np.fromiter(itertools.chain.from_iterable(result), dtype=np.int64, count=4 * len(result)).reshape(-1, 4)
+    cursor.close()
+
+    df = pd.DataFrame({
+        'day': rows[:, 0] - TO_DAYS_EPOCH,  # days since 1970-01-01
+        'amount': rows[:, 1] / 100.0,
+        'account_id': rows[:, 2],
+        'category_id': rows[:, 3],
+    })
+    return df, accounts, categories
+
+def convert(df, accounts, categories, rates_dict, history=None, currency=None):
+    """
+    Adds 'value' (amount in the user's currency), 'signed' (+income / -expense),
+    'income' and 'expense'. With a rate history (see rate_history.py) and the user's
+    currency, each bucket is converted at the rate of its own day; days the history
+    doesn't cover fall back to rates_dict (fx.RateMatrix.rates_for(user currency)):
+    amount / rate, unknown currencies unchanged. Rates are looked up once per account.
+    """
+    rate_by_account = accounts['currency'].map(rates_dict).fillna(1.0).replace(0, 1.0)
+    rate = df['account_id'].map(rate_by_account).fillna(1.0).to_numpy(dtype=float)
+    is_income = df['category_id'].map(categories['type'] == 'Income').fillna(False).to_numpy(dtype=bool)
+    amount = df['amount'].to_numpy()
+    value = amount / rate
+    if history is not None and currency is not None and len(history) and not df.empty:
+        # One vectorized lookup per account currency, not per row
+        row_currency = df['account_id'].map(accounts['currency']).to_numpy()
+        days = df['day'].to_numpy()
+        for source in pd.unique(row_currency):
+            rows = row_currency == source
+            factors = history.factors(days[rows], source, currency)
+            value[rows] = np.where(np.isnan(factors), value[rows], amount[rows] * factors)
+    return df.assign(
+        value=value,
+        signed=np.where(is_income, value, -value),
+        income=np.where(is_income, value, 0.0),
+        expense=np.where(is_income, 0.0, value),
+        is_income=is_income,
+    )
+
+def _records(frame):
+    """DataFrame -> JSON-friendly list of dicts with dates as ISO strings and amounts rounded."""
+    frame = frame.copy()
+    for column in frame.columns:
+        if pd.api.types.is_datetime64_any_dtype(frame[column]):
+            frame[column] = frame[column].dt.strftime('%Y-%m-%d')
+        elif pd.api.types.is_float_dtype(frame[column]):
+            frame[column] = frame[column].round(2)
+    return frame.to_dict(orient='records')
+
+def _by_period(df, period_index, period_start):
+    """
+    Sums income/expense per integer period index with np.bincount (no sorting, no hashing).
+    period_start maps an index back to the first day of that period (as days since epoch).
+    Periods without any transactions still show up, as zeros.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=['income', 'expense', 'net'], index=pd.DatetimeIndex([], name='period'))
+    first = period_index.min()
+    offset = period_index - first
+    income = np.bincount(offset, weights=df['income'].to_numpy())
+    expense = np.bincount(offset, weights=df['expense'].to_numpy())
+    starts = period_start(np.arange(first, first + len(income)))
+    index = pd.DatetimeIndex(starts.astype('datetime64[D]').astype('datetime64[ns]'), name='period')
+    return pd.DataFrame({'income': income, 'expense': expense, 'net': income - expense}, index=index)
+
+def _months(days):
+    """Days since epoch -> months since epoch (1970-01 is 0)."""
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+def monthly(df):
+    return _by_period(df, _months(df['day'].to_numpy()),
+                      lambda months: months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64))
+
+def weekly(df):
+    # 1970-01-01 was a Thursday: shifting by 3 days makes weeks start on Monday
+    return _by_period(df, (df['day'].to_numpy() + 3) // 7, lambda weeks: weeks * 7 - 3)
+
+def monthly_report(df, accounts, categories):
+    return _records(monthly(df).reset_index())
+
+def weekly_report(df, accounts, categories):
+    return _records(weekly(df).reset_index())
+
+def category_report(df, accounts, categories):
+    totals = df.groupby('category_id')['value'].sum()
+    frame = categories.loc[totals.index, ['category_name', 'type']].assign(total=totals.to_numpy())
+    frame = frame.rename(columns={'category_name': 'category'})
+    return _records(frame.sort_values('total', ascending=False))
+
+def account_report(df, accounts, categories):
+    totals = df.groupby('account_id')[['income', 'expense', 'signed']].sum()
+    frame = totals.rename(columns={'signed': 'balance'})
+    frame.insert(0, 'account_name', accounts.loc[totals.index, 'account_name'].to_numpy())
+    return _records(frame.reset_index())
+
+def trend_report(df, accounts, categories, window=3):
+    """Monthly totals with a rolling average over the last 'window' months."""
+    totals = monthly(df)
+    totals['expense_avg'] = totals['expense'].rolling(window, min_periods=1).mean()
+    totals['net_avg'] = totals['net'].rolling(window, min_periods=1).mean()
+    return _records(totals.reset_index())
+
+def top_categories_report(df, accounts, categories, months=3, limit=5):
+    """Biggest expense categories over the last 'months' months."""
+    if df.empty:
+        return []
+    month = _months(df['day'].to_numpy())
+    recent = df[(month > month.max() - months) & ~df['is_income']]
+    totals = recent.groupby('category_id')['value'].sum().nlargest(limit)
+    grand_total = totals.sum()
+    return _records(pd.DataFrame({
+        'category': categories.loc[totals.index, 'category_name'].to_numpy(),
+        'total': totals.to_numpy(),
+        'share': (totals / grand_total).to_numpy() if grand_total else 0.0,
+    }))
+
+REPORTS = {
+    'monthly': monthly_report,
+    'weekly': weekly_report,
+    'categories': category_report,
+    'accounts': account_report,
+    'trend': trend_report,
+    'top_categories': top_categories_report,
+}
+
+def build_report(conn, user_id, name, rates_dict, account_id=None, currency=None):
+    """Pass the user's currency to convert at historical rates (rates_dict then only fills the gaps)."""
+    df, accounts, categories = load_transactions(conn, user_id, account_id)
+    history = rate_history.get_history(conn) if currency else None
+    return REPORTS[name](convert(df, accounts, categories, rates_dict, history, currency), accounts, categories)
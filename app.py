@@ -1,132 +1,118 @@
-import requests
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash 
+import datetime
+import time
+import secrets
+import functools
+import hmac
+from decimal import Decimal
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, session
+import json
+import csv
+import io
+import itertools
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from database import get_db_connection, initialize_all_tables, get_user_transactions
+import database
+import rates
+import ledger
+import importer
+import cache
+import provisioning
+import analytics
+import charts
+import fx
+import rate_history
+import profiling
+import jobs
+import budgets
+from database import get_db, get_read_db, get_pool_stats, iter_transactions, EXPORT_COLUMNS, initialize_all_tables, get_user_totals, get_transactions_page, get_accounts, get_categories
 import mysql.connector
-from urllib.parse import urlparse
 
 
 
 app=Flask(__name__)
 app.secret_key="MEN BU YERDE YA;ALMADIM" #Essential for security
+database.init_app(app) # Return pooled connections at the end of each request
+profiling.init_app(app) # Per-request timings for /metrics and slow-request dumps
+jobs.init_app(app) # Background purges after account/category deletes
 
 #---Login Manager Setup---
 login_manager=LoginManager()
 login_manager.init_app(app)
 login_manager.login_view='login'
 
+# Bearer token for /metrics, /pool_stats and /cache_stats; without one they only answer unproxied loopback requests
+METRICS_TOKEN=os.getenv("METRICS_TOKEN")
+
+# How long the user's identity and settings are trusted from the session before re-reading the users row
+USER_CACHE_TTL=float(os.getenv("USER_CACHE_TTL", "60"))
+
 class User(UserMixin):
-    def __init__(self, id, username, password_hash):
+    def __init__(self, id, username, password_hash=None, default_currency=None):
         self.id=id
         self.username=username
         self.password_hash=password_hash
+        self.default_currency=default_currency or 'TRY'
+
+def remember_user(user):
+    """Caches the user's identity and settings in the (signed) session cookie. Never the password hash."""
+    session['user_cache'] = {
+        'id': user.id,
+        'username': user.username,
+        'default_currency': user.default_currency,
+        'cached_at': time.time(),
+    }
 
 @login_manager.user_loader
 def load_user(user_id):
+    # 1. Recently loaded? Skip the DB entirely
+    cached = session.get('user_cache')
+    if cached and str(cached['id']) == str(user_id) and time.time() - cached['cached_at'] < USER_CACHE_TTL:
+        return User(cached['id'], cached['username'], default_currency=cached['default_currency'])
+
+    # 2. Otherwise one query for identity and settings together
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE user_id = %s", (user_id,))
+        cursor.execute(database.USER_BY_ID_QUERY, (user_id,))
         user_data = cursor.fetchone()
         cursor.close()
-        conn.close()
         if user_data:
-            return User(user_data['user_id'], user_data['username'], user_data['password_hash'])
+            user = User(user_data['user_id'], user_data['username'], default_currency=user_data['default_currency'])
+            remember_user(user)
+            return user
     except Exception as e:
         print(f"DB Error: {e}")
     return None     
 
 # --- CURRENCY API LOGIC ---
-def get_live_rates(base_currency):
+def get_rate_matrix():
     """
-    Fetches exchange rates from the free Frankfurter API.
-    Example URL: https://api.frankfurter.app/latest?from=TRY
-    Returns a dictionary: {'USD': 0.03, 'EUR': 0.028, ...}
+    Cross rates between all currencies (see fx.py), built from one cached rate table,
+    so most calls make no HTTP request.
     """
     try:
-        # We request rates with the user's currency as the "Base"
-        url = f"https://api.frankfurter.app/latest?from={base_currency}"
-        response = requests.get(url)
-        data = response.json()
-        
-        # The API returns rates relative to the base. 
-        # e.g. if Base is TRY, USD might be 0.029
-        rates = data.get('rates', {})
-        
-        # Add the base currency itself (1 to 1) so lookups don't fail
-        rates[base_currency] = 1.0 
-        
-        return rates
+        return fx.get_matrix()
     except Exception as e:
         print(f"API Error: {e}")
-        # Fallback if API is down: Return empty dict or hardcoded safety values
-        return {base_currency: 1.0, 'USD': 0.03, 'EUR': 0.029, 'TRY': 1.0}
+        # Fallback if API is down and nothing is cached: hardcoded safety values
+        return fx.RateMatrix('TRY', {'TRY': 1.0, 'USD': 0.03, 'EUR': 0.029})
 
-def convert_currency_with_rates(amount, from_curr, rates_dict):
-    """
-    Converts amount using a pre-fetched dictionary of rates.
-    """
-    if from_curr not in rates_dict:
-        return amount # If currency not found, keep original amount
-        
-    # Logic: Since 'rates_dict' is based on the User's Default Currency,
-    # we just need to divide by the rate? No, wait.
-    # If Base = TRY. 
-    # API says: USD = 0.029 (1 TRY = 0.029 USD).
-    # Wait, Frankfurter 'from' gives you the value of 1 Unit of Base.
-    
-    # Let's use a safer approach: Convert everything to EUR (Frankfurter default) then to Target.
-    # Actually, the simplest way with Frankfurter:
-    # If I have 100 USD and I want TRY.
-    # If I fetch rates with ?from=USD, I get TRY rate directly.
-    
-    # OPTIMIZATION: To avoid calling API for every transaction, 
-    # we will fetch ?from=USER_DEFAULT_CURRENCY.
-    # Then: 
-    # Rate for USD will be: How many USD is 1 UserCurrency.
-    # So if I have 50 USD, and Rate is 0.03 (1 TRY = 0.03 USD).
-    # Amount in TRY = 50 / 0.03
-    
-    rate = rates_dict.get(from_curr, 1.0)
-    if rate == 0: return amount
-    return round(float(amount) / rate, 2)
-
-def seed_data(user_id):
-    """Creates default Account and Categories if they don't exist."""
-    conn = get_db_connection()
-    
-    # FIX: Add buffered=True to prevent 'Unread result found' errors
-    cursor = conn.cursor(buffered=True) 
-    
-    # 1. Create a default 'Cash' account
-    cursor.execute("SELECT * FROM accounts WHERE user_id = %s", (user_id,))
-    if not cursor.fetchone():
-        cursor.execute("INSERT INTO accounts (user_id, account_name, account_type, current_balance) VALUES (%s, 'Cash', 'Cash', 0)", (user_id,))
-        cursor.execute("INSERT INTO accounts (user_id, account_name, account_type, current_balance) VALUES (%s, 'Bank', 'Bank', 0)", (user_id,))
-        conn.commit() # Commit changes immediately after inserting
-
-    # 2. Create default Categories
-    cursor.execute("SELECT * FROM categories WHERE user_id = %s", (user_id,))
-    if not cursor.fetchone():
-        defaults = [('Food', 'Expense'), ('Rent', 'Expense'), ('Salary', 'Income'), ('Fun', 'Expense'), ('Initial Balance', 'Income')]
-        for name, type in defaults:
-            cursor.execute("INSERT INTO categories (user_id, name, type) VALUES (%s, %s, %s)", (user_id, name, type))
-        conn.commit() # Commit changes immediately after inserting
-    
-    cursor.close()
-    conn.close()
+def get_live_rates(base_currency):
+    """Returns exchange rates relative to base_currency: {'USD': 0.03, 'EUR': 0.028, ...}"""
+    return get_rate_matrix().rates_for(base_currency)
 
 @app.route('/update_user_currency', methods=['POST'])
 @login_required
 def update_user_currency():
     new_currency = request.form.get('default_currency')
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("UPDATE users SET default_currency = %s WHERE user_id = %s", (new_currency, current_user.id))
     conn.commit()
-    conn.close()
+    cache.invalidate_user(current_user.id)
+    current_user.default_currency = new_currency
+    remember_user(current_user)
     flash("Default currency updated!")
     return redirect(url_for('settings'))
 
@@ -134,14 +120,15 @@ def update_user_currency():
 @login_required
 def delete_account(id):
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
-        # Delete linked transactions first (or use ON DELETE CASCADE in SQL)
-        cursor.execute("DELETE FROM transactions WHERE account_id = %s AND user_id = %s", (id, current_user.id))
-        cursor.execute("DELETE FROM accounts WHERE account_id = %s AND user_id = %s", (id, current_user.id))
+        # Hidden right away; its transactions are purged in the background (see jobs.py)
+        deleted = jobs.delete_account(cursor, current_user.id, id)
         conn.commit()
-        conn.close()
-        flash("Account deleted!")
+        if deleted:
+            jobs.notify()
+            cache.invalidate_user(current_user.id)
+            flash("Account deleted! Its transactions are being removed in the background.")
     except Exception as e:
         flash(f"Error deleting account: {e}")
     return redirect(url_for('settings'))
@@ -150,86 +137,121 @@ def delete_account(id):
 @login_required
 def delete_category(id):
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
-        # Set transactions to a default category or delete them? 
-        # For now, let's just delete the category. Note: This might break transactions linked to it if not handled.
-        # Ideally, we check if it's being used first.
-        cursor.execute("DELETE FROM transactions WHERE category_id = %s AND user_id = %s", (id, current_user.id))
-        cursor.execute("DELETE FROM categories WHERE category_id = %s AND user_id = %s", (id, current_user.id))
+        deleted = jobs.delete_category(cursor, current_user.id, id)
         conn.commit()
-        conn.close()
-        flash("Category deleted!")
+        if deleted:
+            jobs.notify()
+            cache.invalidate_user(current_user.id)
+            flash("Category deleted! Its transactions are being removed in the background.")
     except Exception as e:
         flash(f"Error deleting category: {e}")
     return redirect(url_for('settings'))
 
-@app.route('/')
-@login_required
-def home():
-    seed_data(current_user.id)
-    
-    conn = get_db_connection()
+def load_dashboard(user_id, filter_account_id):
+    """Everything the dashboard needs from the DB. Cached per user until their next write."""
+    conn = get_read_db()
     cursor = conn.cursor(dictionary=True)
     
-    # 1. Get User Settings (Default Currency)
-    cursor.execute("SELECT default_currency FROM users WHERE user_id = %s", (current_user.id,))
-    user_row = cursor.fetchone()
-    user_currency = user_row['default_currency'] if user_row and user_row['default_currency'] else 'TRY'
-    
-    # 2. Fetch Accounts & Categories
-    cursor.execute("SELECT * FROM accounts WHERE user_id = %s", (current_user.id,))
-    accounts = cursor.fetchall()
-    cursor.execute("SELECT * FROM categories WHERE user_id = %s AND name!='Initial Balance'", (current_user.id,))
-    categories = cursor.fetchall()
-    conn.close()
+    # 1. Fetch Accounts & Categories
+    accounts = get_accounts(cursor, user_id)
+    categories = get_categories(cursor, user_id)
 
-    # 3. CALL THE API ONCE HERE
-    # Get all rates relative to the user's preferred currency
-    live_rates = get_live_rates(user_currency)
+    # 2. Per-account totals (account filter is applied in SQL)
+    totals = get_user_totals(user_id, None if filter_account_id == 'all' else int(filter_account_id))
 
-    # 4. Filter Transactions (Logic from before)
-    all_transactions = get_user_transactions(current_user.id)
+    return {'accounts': accounts, 'categories': categories, 'totals': totals}
+
+@app.route('/')
+@login_required
+def home():
     filter_account_id = request.args.get('account_id')
-    
-    if filter_account_id and filter_account_id != 'all':
-        transactions = [t for t in all_transactions if str(t['account_id']) == filter_account_id]
-    else:
-        transactions = all_transactions
+    if not filter_account_id or not filter_account_id.isdigit():
         filter_account_id = 'all'
 
-    # 5. Calculate Totals using Live Rates
-    total_balance = 0
-    income = 0
-    expense = 0
-    
-    acc_currency_map = {acc['account_id']: acc['currency'] for acc in accounts}
-
-    for t in transactions:
-        # Determine transaction currency (default to TRY if account has no currency set)
-        trans_currency = acc_currency_map.get(t['account_id'], 'TRY')
-        
-        # Use our new conversion function
-        converted_amount = convert_currency_with_rates(t['amount'], trans_currency, live_rates)
-        
-        if t['category_type'] == 'Income':
-            income += converted_amount
-            total_balance += converted_amount
-        else:
-            expense += converted_amount
-            total_balance -= converted_amount
+    # 1. DB data comes from the per-user cache (write routes invalidate it)
+    try:
+        dashboard = cache.get_or_load(current_user.id, f"dashboard-{filter_account_id}",
+                                      lambda: load_dashboard(current_user.id, filter_account_id))
+    except Exception as e:
+        # Nothing was cached, so the next page view reads again
+        print(f"Dashboard Error: {e}")
+        dashboard = {'accounts': [], 'categories': [], 'totals': []}
+    user_currency = current_user.default_currency
+    accounts = dashboard['accounts']
+    categories = dashboard['categories']
+    totals = dashboard['totals']
+
+    # 2. Each month converts at its own (mid-month) historical rate; months before the
+    # stored history use today's cross rates (no API call on most requests)
+    history = rate_history.get_history(get_read_db)
+    live_matrix = get_rate_matrix()
+
+    def matrix_for(month):
+        return history.matrix_for(month + datetime.timedelta(days=14)) or live_matrix
+
+    # 3. Calculate Totals (accounts without a currency are TRY)
+    income = sum(fx.convert_dated(((bucket['income'], bucket['currency'] or 'TRY', bucket['bucket']) for bucket in totals),
+                                  user_currency, matrix_for), Decimal(0))
+    expense = sum(fx.convert_dated(((bucket['expense'], bucket['currency'] or 'TRY', bucket['bucket']) for bucket in totals),
+                                   user_currency, matrix_for), Decimal(0))
+    total_balance = income - expense
 
     return render_template('index.html', 
                            name=current_user.username,
-                           transactions=transactions,
-                           total_balance=round(total_balance, 2),
-                           income=round(income, 2),
-                           expense=round(expense, 2),
+                           total_balance=total_balance,
+                           income=income,
+                           expense=expense,
                            accounts=accounts,
                            categories=categories,
                            selected_account_id=filter_account_id,
                            currency_symbol=user_currency)
 
+@app.route('/api/reports/<name>')
+@login_required
+def api_report(name):
+    """Monthly/weekly/category/account/trend/top-category reports in the user's currency."""
+    if name not in analytics.REPORTS:
+        return jsonify({'error': f"Unknown report '{name}'", 'reports': sorted(analytics.REPORTS)}), 404
+    account_id = request.args.get('account_id', '')
+    account_id = int(account_id) if account_id.isdigit() else None
+    user_currency = current_user.default_currency
+    report = get_report_data(current_user.id, name, user_currency, account_id)
+    return jsonify({'report': name, 'currency': user_currency, 'data': report})
+
+def get_report_data(user_id, name, user_currency, account_id=None):
+    """Report data shared by the JSON API and the chart images, cached per user."""
+    def build():
+        return analytics.build_report(get_read_db(), user_id, name, get_live_rates(user_currency), account_id, user_currency)
+    return cache.get_or_load(user_id, f"report-{name}-{account_id or 'all'}-{user_currency}", build)
+
+@app.route('/charts/<chart_type>.<fmt>')
+@login_required
+def chart_image(chart_type, fmt):
+    if chart_type not in charts.CHART_TYPES or fmt not in charts.FORMATS:
+        return jsonify({'error': "Unknown chart"}), 404
+    account_id = request.args.get('account_id', '')
+    account_id = int(account_id) if account_id.isdigit() else None
+    user_currency = current_user.default_currency
+    data = get_report_data(current_user.id, chart_type, user_currency, account_id)
+
+    # 1. The ETag is the content address: if the browser has this exact chart, we're done
+    digest = charts.chart_digest(current_user.id, chart_type, fmt, user_currency, data)
+    if request.if_none_match.contains(digest):
+        return Response(status=304, headers={'ETag': f'"{digest}"', 'Cache-Control': 'private, no-cache'})
+
+    # 2. Otherwise read it from the store, rendering in the chart process pool on a miss
+    try:
+        image = charts.get_chart(digest, chart_type, data, user_currency, fmt)
+    except Exception as e:
+        print(f"Chart Error: {e}")
+        return jsonify({'error': "Chart unavailable"}), 503
+    response = Response(image, mimetype=charts.FORMATS[fmt])
+    response.set_etag(digest)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/add_transaction', methods=['POST'])
 @login_required
 def add_transaction():
@@ -240,29 +262,160 @@ def add_transaction():
     note = request.form.get('note')
     
     # 2. Insert into DB
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO transactions (user_id, account_id, category_id, amount, transaction_date, note)
-        VALUES (%s, %s, %s, %s, NOW(), %s)
-    """, (current_user.id, account_id, category_id, amount, note))
+    try:
+        ledger.add_transaction(cursor, current_user.id, account_id, category_id, amount, note)
+    except ValueError as e:
+        conn.rollback()
+        flash(str(e))
+        return redirect(url_for('home'))
     
     conn.commit()
-    conn.close()
+    cache.invalidate_user(current_user.id)
+    budgets.check_later(current_user.id) # Alerts are evaluated off the request path
     
     flash("Transaction Added!")
     return redirect(url_for('home'))
+def parse_transaction_filters(args):
+    """Reads history filters from the query string, dropping anything malformed."""
+    filters = {}
+    for key in ('account_id', 'category_id'):
+        value = args.get(key, '')
+        if value.isdigit():
+            filters[key] = int(value)
+    if args.get('type') in ('Income', 'Expense'):
+        filters['type'] = args['type']
+    for key in ('date_from', 'date_to'):
+        try:
+            filters[key] = datetime.date.fromisoformat(args.get(key, ''))
+        except ValueError:
+            pass
+    if args.get('q', '').strip():
+        filters['q'] = args['q'].strip()
+    return filters
+
+def load_transactions_page():
+    """Shared by the HTML history page and the JSON API."""
+    filters = parse_transaction_filters(request.args)
+    page = get_transactions_page(current_user.id, filters, request.args.get('cursor') or None)
+    return filters, page
+
 @app.route('/transactions')
 @login_required
 def transactions_page():
-    # 1. Fetch full transaction history for the current user
-    # We use the helper function we imported from database.py
-    transactions = get_user_transactions(current_user.id)
-    
-    # 2. Render the separate Transactions page
+    # 1. Fetch one page of history (filters and cursor come from the query string)
+    try:
+        filters, page = load_transactions_page()
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('transactions_page'))
+
+    # 2. Dropdown options for the filter bar
+    conn = get_read_db()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(database.ACCOUNT_OPTIONS_QUERY, (current_user.id,))
+    accounts = cursor.fetchall()
+    cursor.execute(database.CATEGORY_OPTIONS_QUERY, (current_user.id,))
+    categories = cursor.fetchall()
+
+    # 3. Pager links keep the current filters
+    page_args = request.args.to_dict()
+    page_args.pop('cursor', None)
+    newest_url = url_for('transactions_page', **page_args) if request.args.get('cursor') else None
+    next_url = None
+    if page['next_cursor']:
+        next_url = url_for('transactions_page', cursor=page['next_cursor'], **page_args)
+
+    # 4. Render the separate Transactions page
     return render_template('transactions.html', 
                            name=current_user.username, 
-                           transactions=transactions)
+                           transactions=page['transactions'],
+                           accounts=accounts,
+                           categories=categories,
+                           filters=filters,
+                           newest_url=newest_url,
+                           export_args={key: value for key, value in page_args.items() if key != 'format'},
+                           next_url=next_url)
+
+@app.route('/api/transactions')
+@login_required
+def api_transactions():
+    try:
+        filters, page = load_transactions_page()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    items = [{
+        'transaction_id': t['transaction_id'],
+        'transaction_date': t['transaction_date'].isoformat(),
+        'amount': str(t['amount']),
+        'note': t['note'],
+        'account_id': t['account_id'],
+        'account_name': t['account_name'],
+        'category_id': t['category_id'],
+        'category_name': t['category_name'],
+        'category_type': t['category_type'],
+    } for t in page['transactions']]
+    return jsonify({'transactions': items, 'next_cursor': page['next_cursor']})
+
+@app.route('/export')
+@login_required
+def export_transactions():
+    """
+    Streams the (filtered) history as CSV or NDJSON, chunk by chunk.
+    Uses its own pooled connection with an unbuffered cursor, so memory stays flat
+    and the first bytes go out as soon as MySQL returns the first rows.
+    The connection is checked out and the query started before the response begins.
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': "format must be 'csv' or 'ndjson'"}), 400
+    filters = parse_transaction_filters(request.args)
+    user_id = current_user.id
+
+    def start(conn):
+        # Runs the query now: a full pool or a failing DB is an error response, not a truncated file
+        chunks = iter_transactions(conn, user_id, filters)
+        return itertools.chain([next(chunks, [])], chunks)
+    try:
+        pool, conn, chunks = database.start_read(start)
+    except Exception as e:
+        print(f"Export Error: {e}")
+        return jsonify({'error': "The export could not be started. Please try again."}), 503
+
+    def generate():
+        finished = False
+        try:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if export_format == 'csv':
+                writer.writerow(EXPORT_COLUMNS)
+                yield buffer.getvalue()
+            for rows in chunks:
+                buffer.seek(0)
+                buffer.truncate()
+                for row in rows:
+                    if export_format == 'csv':
+                        writer.writerow(row)
+                    else:
+                        item = dict(zip(EXPORT_COLUMNS, row))
+                        item['transaction_date'] = item['transaction_date'].isoformat()
+                        item['amount'] = str(item['amount'])
+                        buffer.write(json.dumps(item) + "\n")
+                yield buffer.getvalue()
+            finished = True
+        finally:
+            # A client that hangs up mid-export leaves unread rows on the socket: drop that connection
+            if finished:
+                pool.release(conn)
+            else:
+                pool.discard(conn)
+
+    filename = f"transactions.{'csv' if export_format == 'csv' else 'ndjson'}"
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -270,15 +423,15 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+        cursor.execute(database.USER_BY_USERNAME_QUERY, (username,))
         user_data = cursor.fetchone()
-        conn.close()
         
         if user_data and check_password_hash(user_data['password_hash'], password):
-            user = User(user_data['user_id'], user_data['username'], user_data['password_hash'])
+            user = User(user_data['user_id'], user_data['username'], user_data['password_hash'], user_data.get('default_currency'))
             login_user(user)
+            remember_user(user)
             return redirect(url_for('home'))
         else:
             flash('Invalid username or password')
@@ -292,17 +445,17 @@ def register():
         password = request.form['password']
         hashed_password = generate_password_hash(password)
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         try:
             cursor.execute("INSERT INTO users (username, password_hash) VALUES (%s, %s)", (username, hashed_password))
+            # Default accounts and categories are created once, here, in the same DB transaction
+            provisioning.seed_user(cursor, cursor.lastrowid)
             conn.commit()
             flash('Registration successful! Please log in.')
             return redirect(url_for('login'))
         except mysql.connector.Error as err:
             flash(f"Error: {err}")
-        finally:
-            conn.close()
             
     return render_template('register.html')
 
@@ -310,15 +463,69 @@ def register():
 @app.route('/settings')
 @login_required
 def settings():
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM accounts WHERE user_id = %s", (current_user.id,))
-    accounts = cursor.fetchall()
-    cursor.execute("SELECT * FROM categories WHERE user_id = %s AND name!='Initial Balance'", (current_user.id,))
-    categories = cursor.fetchall()
-    conn.close()
+    accounts = get_accounts(cursor, current_user.id)
+    categories = get_categories(cursor, current_user.id)
+    running_jobs = jobs.get_user_jobs(cursor, current_user.id)
+    user_budgets = budgets.get_budgets(cursor, current_user.id, get_rate_matrix())
+    alerts = budgets.get_alerts(cursor, current_user.id)
     
-    return render_template('settings.html', name=current_user.username, accounts=accounts, categories=categories)
+    return render_template('settings.html', name=current_user.username, accounts=accounts, categories=categories,
+                           jobs=running_jobs, budgets=user_budgets, alerts=alerts,
+                           default_currency=current_user.default_currency or 'TRY')
+
+@app.route('/api/jobs')
+@login_required
+def api_jobs():
+    """Progress of the user's unfinished background jobs."""
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
+    return jsonify(jobs.get_user_jobs(cursor, current_user.id))
+
+@app.route('/add_budget', methods=['POST'])
+@login_required
+def add_budget():
+    try:
+        conn = get_db()
+        cursor = conn.cursor()
+        budgets.set_budget(cursor, current_user.id, request.form.get('category_id'), request.form.get('amount'),
+                           request.form.get('currency') or current_user.default_currency or 'TRY')
+        conn.commit()
+        budgets.check_later(current_user.id)
+        flash("Budget saved!")
+    except Exception as e:
+        flash(f"Error saving budget: {e}")
+    return redirect(url_for('settings'))
+
+@app.route('/delete_budget/<int:id>')
+@login_required
+def delete_budget(id):
+    conn = get_db()
+    cursor = conn.cursor()
+    if budgets.delete_budget(cursor, current_user.id, id):
+        conn.commit()
+        flash("Budget removed!")
+    return redirect(url_for('settings'))
+
+@app.route('/api/budgets', methods=['GET', 'POST'])
+@login_required
+def api_budgets():
+    """This month's budgets and spending; POST {"category_id", "amount", "currency"} sets one."""
+    conn = get_db()
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        try:
+            budgets.set_budget(conn.cursor(), current_user.id, body.get('category_id'), body.get('amount'),
+                               body.get('currency') or current_user.default_currency or 'TRY')
+        except (ValueError, ArithmeticError) as e:
+            return jsonify({'error': str(e)}), 400
+        conn.commit()
+        budgets.check_later(current_user.id)
+    cursor = conn.cursor(dictionary=True)
+    items = [dict(b, amount=str(b['amount']), spent=None if b['spent'] is None else str(b['spent']))
+             for b in budgets.get_budgets(cursor, current_user.id, get_rate_matrix())]
+    return jsonify({'budgets': items})
 
 @app.route('/add_account', methods=['POST'])
 @login_required
@@ -329,17 +536,18 @@ def add_account():
         currency = request.form.get('currency') # NEW FIELD
         balance = float(request.form.get('initial_balance', 0))
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        conn = get_db()
+        cursor = conn.cursor(dictionary=True)
+        # current_balance starts at 0: the opening transaction below adds to it through the ledger
         cursor.execute("""
             INSERT INTO accounts (user_id, account_name, account_type, current_balance, currency)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (current_user.id, name, acc_type, balance, currency))
+            VALUES (%s, %s, %s, 0, %s)
+        """, (current_user.id, name, acc_type, currency))
         new_account_id=cursor.lastrowid
 
         if balance > 0:
             # A. Find or Create the 'Initial Balance' category
-            cursor.execute("SELECT category_id FROM categories WHERE user_id = %s AND name = 'Initial Balance'", (current_user.id,))
+            cursor.execute(database.INITIAL_BALANCE_CATEGORY_QUERY, (current_user.id,))
             cat_row = cursor.fetchone()
             
             if cat_row:
@@ -350,18 +558,47 @@ def add_account():
                 category_id = cursor.lastrowid
 
             # B. Insert the Transaction
-            cursor.execute("""
-                INSERT INTO transactions (user_id, account_id, category_id, amount, transaction_date, note)
-                VALUES (%s, %s, %s, %s, NOW(), 'Opening Balance')
-            """, (current_user.id, new_account_id, category_id, balance))
+            ledger.add_transaction(cursor, current_user.id, new_account_id, category_id, balance, 'Opening Balance')
         conn.commit()
-        conn.close()
+        cache.invalidate_user(current_user.id)
         flash(f"Account '{name}' created!")
     except Exception as e:
         flash(f"Error adding account: {e}")
         
     return redirect(url_for('settings'))
 
+@app.route('/import', methods=['POST'])
+@login_required
+def import_transactions():
+    """Streams one NDJSON progress line per batch (and per rejected row) while importing."""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash("Choose a CSV or OFX file to import.")
+        return redirect(url_for('settings'))
+    account_id = request.form.get('account_id', '')
+    user_id = current_user.id
+    file_format = request.form.get('format') or importer.detect_format(upload.filename)
+    database.mark_write() # Batches commit while streaming, after this request's session is saved
+    try:
+        events = importer.import_file(get_db(), current_user.id, upload.stream, file_format,
+                                      int(account_id) if account_id.isdigit() else None)
+    except ValueError as e:
+        flash(f"Error importing file: {e}")
+        return redirect(url_for('settings'))
+
+    def generate():
+        try:
+            for event in events:
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({'error': f"Import stopped: {e}", 'done': True}) + "\n"
+        finally:
+            # Batches commit as they go, so even a failed import may have changed the dashboard
+            cache.invalidate_user(user_id)
+            budgets.check_later(user_id)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/add_category', methods=['POST'])
 @login_required
 def add_category():
@@ -369,79 +606,99 @@ def add_category():
         name = request.form.get('category_name')
         cat_type = request.form.get('category_type') # 'Income' or 'Expense'
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute("""
             INSERT INTO categories (user_id, name, type)
             VALUES (%s, %s, %s)
         """, (current_user.id, name, cat_type))
         conn.commit()
-        conn.close()
+        cache.invalidate_user(current_user.id)
         flash(f"Category '{name}' added!")
     except Exception as e:
         flash(f"Error adding category: {e}")
         
     return redirect(url_for('settings'))
 
+@app.route('/telegram/link', methods=['POST'])
+@login_required
+def telegram_link_code():
+    """One-time code the user sends to the bot as '/start CODE' (see bot.py)."""
+    try:
+        code = secrets.token_hex(4).upper()
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM telegram_link_codes WHERE user_id = %s OR expires_at < NOW()", (current_user.id,))
+        cursor.execute("""
+            INSERT INTO telegram_link_codes (code, user_id, expires_at)
+            VALUES (%s, %s, NOW() + INTERVAL 10 MINUTE)
+        """, (code, current_user.id))
+        conn.commit()
+        flash(f"Send '/start {code}' to the bot within 10 minutes.")
+    except Exception as e:
+        flash(f"Error creating link code: {e}")
+    return redirect(url_for('settings'))
+
 @app.route('/logout')
 @login_required
 def logout():
     logout_user()
+    session.pop('user_cache', None)
     return redirect(url_for('login'))
 @app.route('/init_db')
 def init_db():
-    if initialize_all_tables():
-        # You need to temporarily run the Users table creation as well, 
-        # as it was previously inside this route.
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INT AUTO_INCREMENT PRIMARY KEY,
-                username VARCHAR(50) NOT NULL UNIQUE,
-                password_hash VARCHAR(255) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        conn.commit()
-        conn.close()
-
-        return "Database Tables (Users, Accounts, Categories, Transactions) Created Successfully!"
-    return "Database Initialization Failed. Check logs."
-# app.py - Add this temporary migration route
-
-#Currency migration func:
-@app.route('/migrate_currency')
-@login_required
-def migrate_currency():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    messages = []
-
-    # 1. Try adding to USERS table
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN default_currency VARCHAR(3) DEFAULT 'TRY'")
-        conn.commit()
-        messages.append("✅ Success: Added 'default_currency' to USERS table.")
-    except mysql.connector.Error as e:
-        if e.errno == 1060: # Error 1060 means "Duplicate column name"
-            messages.append("ℹ️ Note: USERS table already had the column (Skipped).")
-        else:
-            messages.append(f"❌ Error on USERS table: {e}")
-
-    # 2. Try adding to ACCOUNTS table
-    try:
-        cursor.execute("ALTER TABLE accounts ADD COLUMN currency VARCHAR(3) DEFAULT 'TRY'")
-        conn.commit()
-        messages.append("✅ Success: Added 'currency' to ACCOUNTS table.")
-    except mysql.connector.Error as e:
-        if e.errno == 1060:
-            messages.append("ℹ️ Note: ACCOUNTS table already had the column (Skipped).")
+    applied = initialize_all_tables()
+    if applied is None:
+        return "Database Initialization Failed. Check logs."
+    if not applied:
+        return "Schema is already up to date."
+    return "Applied migrations:<br>" + "<br>".join(applied)
+
+#---Pool metrics (use these to size DB_POOL_SIZE per gunicorn worker)---
+def metrics_access_required(view):
+    """
+    The metrics endpoints show SQL, per-route timings and replica hosts, so they need
+    METRICS_TOKEN (as 'Authorization: Bearer <token>' or ?token=) when it is set, else a
+    request from the loopback address that didn't come through a proxy. Anyone else gets a 404.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if METRICS_TOKEN:
+            auth = request.headers.get('Authorization', '')
+            given = auth[len('Bearer '):] if auth.startswith('Bearer ') else request.args.get('token', '')
+            allowed = hmac.compare_digest(given.encode(), METRICS_TOKEN.encode())
         else:
-            messages.append(f"❌ Error on ACCOUNTS table: {e}")
-
-    conn.close()
-    return "<br>".join(messages)
+            allowed = request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+        if not allowed:
+            return "Not Found", 404
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/pool_stats')
+@metrics_access_required
+def pool_stats():
+    return jsonify(dict(get_pool_stats(), background=database.get_background_pool_stats(), replicas=database.get_replica_stats()))
+
+@app.route('/cache_stats')
+@metrics_access_required
+def cache_stats():
+    return jsonify(cache.get_cache_stats())
+
+@app.route('/metrics')
+@metrics_access_required
+def metrics():
+    """Prometheus scrape endpoint (numbers are per worker process)."""
+    gauges = {
+        'db_pool': get_pool_stats(),
+        'db_background': database.get_background_pool_stats(),
+        'cache': cache.get_cache_stats(),
+        'rates': rates.get_rate_stats(),
+        'budgets': budgets.get_budget_stats(),
+    }
+    for number, stats in enumerate(database.get_replica_stats().values()):
+        gauges[f"db_replica{number}"] = stats
+    body = profiling.render_metrics(gauges)
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 if __name__=='__main__':
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
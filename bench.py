@@ -0,0 +1,296 @@
+#---Benchmarks---
+# Generates N users x M accounts x K transactions (with a realistic currency mix) in a
+# SQLite stand-in for MySQL (see mysql_standin.py), swaps in a fake rate provider, and
+# replays scripted request scenarios through the Flask test client. Reports
+# p50/p95/p99 latency and queries per request, and can gate on a stored baseline.
+# Usage:
+#   python bench.py                              -> run every scenario, print a table
+#   python bench.py --users 50 --transactions 20000 --requests 500
+#   python bench.py --scenario dashboard --no-cache
+#   python bench.py --save-baseline              -> record bench_baseline.json
+#   python bench.py --check                      -> exit 1 on a regression against it
+#
+# Queries per request don't depend on the machine, so any increase fails the gate. (The
+# cache trusts version tokens until a bump, so timing can't change them; see setup().)
+# Milliseconds do, so the latency gate compares ratios instead: every scenario request is
+# paired with a cheap reference request (REFERENCE) in the same process, and each round's
+# p95 is divided by the reference's p95 from the same round. The gate takes the median
+# round, so a noisy neighbour or one slow round doesn't fail it.
+import argparse
+import datetime
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+import cache
+import database
+import ledger
+import mysql_standin
+import profiling
+import provisioning
+import rate_history
+import rates
+
+BASELINE_PATH=os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+CURRENCY_MIX = [('TRY', 0.55), ('USD', 0.25), ('EUR', 0.15), ('GBP', 0.05)]
+FAKE_RATES = {'EUR': {'TRY': 35.2, 'USD': 1.08, 'GBP': 0.85}}
+NOTES = ['groceries', 'lunch', 'coffee', 'rent', 'taxi', 'salary', 'gift', 'books', '', '']
+INSERT_BATCH = 1000
+
+
+#---Synthetic data---
+def _pick_currency(rng):
+    return rng.choices([c for c, _ in CURRENCY_MIX], weights=[w for _, w in CURRENCY_MIX])[0]
+
+def generate(conn, users, accounts_per_user, transactions_per_user, years=3, seed=42):
+    """
+    Fills an empty database and brings balances, rollups and rate history up to date.
+    Returns {user_id: {'accounts': [...], 'categories': [...]}} for the scenarios.
+    """
+    rng=random.Random(seed)
+    today=datetime.date.today()
+    first_day=today - datetime.timedelta(days=365 * years)
+    cursor=conn.cursor()
+    population={}
+    for number in range(users):
+        cursor.execute("INSERT INTO users (username, password_hash, default_currency) VALUES (%s, %s, %s)",
+                       (f"bench{number}", "not-a-real-hash", _pick_currency(rng)))
+        user_id=cursor.lastrowid
+        provisioning.seed_user(cursor, user_id)
+        for extra in range(max(accounts_per_user - len(provisioning.DEFAULT_ACCOUNTS), 0)):
+            cursor.execute("INSERT INTO accounts (user_id, account_name, account_type, current_balance) VALUES (%s, %s, %s, 0)",
+                           (user_id, f"Account {extra + 1}", 'Bank'))
+        cursor.execute("SELECT account_id FROM accounts WHERE user_id = %s", (user_id,))
+        account_ids=[row[0] for row in cursor.fetchall()]
+        for account_id in account_ids:
+            cursor.execute("UPDATE accounts SET currency = %s WHERE account_id = %s", (_pick_currency(rng), account_id))
+        cursor.execute("SELECT category_id, type FROM categories WHERE user_id = %s AND name != 'Initial Balance'", (user_id,))
+        categories=cursor.fetchall()
+        expenses=[cid for cid, kind in categories if kind == 'Expense']
+        incomes=[cid for cid, kind in categories if kind == 'Income']
+
+        rows=[]
+        for _ in range(transactions_per_user):
+            is_income=rng.random() < 0.1
+            amount=rng.lognormvariate(7.5, 0.3) if is_income else rng.lognormvariate(3.5, 1.0)
+            rows.append((user_id, rng.choice(account_ids), rng.choice(incomes if is_income else expenses),
+                         Decimal(f"{amount:.2f}"), first_day + datetime.timedelta(days=rng.randrange(365 * years + 1)),
+                         rng.choice(NOTES) or None))
+        for start in range(0, len(rows), INSERT_BATCH):
+            cursor.executemany("""
+                INSERT INTO transactions (user_id, account_id, category_id, amount, transaction_date, note)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, rows[start:start + INSERT_BATCH])
+        population[user_id]={'accounts': account_ids, 'categories': [cid for cid, _ in categories]}
+
+    ledger.rebuild(cursor)
+    provider=rates.StaticRateProvider(FAKE_RATES)
+    rate_history.store(cursor, 'EUR', provider.fetch_range('EUR', first_day, today))
+    conn.commit()
+    cursor.close()
+    return population
+
+
+#---Scenarios: each issues one request for a user and returns the response---
+def dashboard(client, user, rng):
+    return client.get('/')
+
+def dashboard_account(client, user, rng):
+    return client.get(f"/?account_id={rng.choice(user['accounts'])}")
+
+def history(client, user, rng):
+    return client.get('/transactions')
+
+def history_filtered(client, user, rng):
+    return client.get(f"/transactions?category_id={rng.choice(user['categories'])}")
+
+def add_transaction(client, user, rng):
+    return client.post('/add_transaction', data={
+        'amount': f"{rng.uniform(1, 200):.2f}",
+        'account_id': rng.choice(user['accounts']),
+        'category_id': rng.choice(user['categories']),
+        'note': 'bench',
+    })
+
+def settings(client, user, rng):
+    return client.get('/settings')
+
+def reports(client, user, rng):
+    return client.get('/api/reports/trend')
+
+def reference(client, user, rng):
+    # Login, one indexed query and a small JSON response: the fixed cost every request pays
+    return client.get('/api/jobs')
+
+SCENARIOS = {
+    'dashboard': dashboard,
+    'dashboard_account': dashboard_account,
+    'history': history,
+    'history_filtered': history_filtered,
+    'add_transaction': add_transaction,
+    'settings': settings,
+    'reports': reports,
+}
+
+
+#---Runner---
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank=max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def _login(app, user_id):
+    client=app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id']=str(user_id)
+        session['_fresh']=True
+    return client
+
+def _summary(times):
+    times=sorted(times)
+    return {'p50_ms': round(percentile(times, 0.50), 3), 'p95_ms': round(percentile(times, 0.95), 3),
+            'p99_ms': round(percentile(times, 0.99), 3)}
+
+def run_scenario(app, population, name, requests_count, warmup=50, rounds=5, seed=7):
+    """
+    Alternates scenario and reference requests, 'rounds' rounds of requests_count / rounds
+    measured pairs each. Returns latency percentiles, queries per request and 'ratio': the
+    median over rounds of (scenario p95 / reference p95).
+    """
+    rng=random.Random(seed)
+    clients={user_id: _login(app, user_id) for user_id in population}
+    user_ids=list(population)
+    queries=[]
+
+    def count_queries(profile, total, breakdown):
+        queries.append(len(profile.queries))
+
+    def timed(scenario, user_id):
+        queries.clear()
+        start=time.perf_counter()
+        response=scenario(clients[user_id], population[user_id], rng)
+        elapsed=(time.perf_counter() - start) * 1000
+        if response.status_code >= 400:
+            raise RuntimeError(f"{scenario.__name__}: HTTP {response.status_code}")
+        return elapsed, sum(queries)
+
+    profiling.add_listener(count_queries)
+    try:
+        for _ in range(warmup):
+            user_id=rng.choice(user_ids)
+            timed(SCENARIOS[name], user_id)
+            timed(reference, user_id)
+        per_round=max(requests_count // rounds, 1)
+        times, counts, ratios=[], [], []
+        for _ in range(rounds):
+            gc.collect()
+            round_times, reference_times=[], []
+            for _ in range(per_round):
+                user_id=rng.choice(user_ids)
+                elapsed, count=timed(SCENARIOS[name], user_id)
+                round_times.append(elapsed)
+                counts.append(count)
+                reference_times.append(timed(reference, user_id)[0])
+            times += round_times
+            ratios.append(percentile(sorted(round_times), 0.95) / percentile(sorted(reference_times), 0.95))
+    finally:
+        profiling.remove_listener(count_queries)
+
+    stats=_summary(times)
+    stats['queries']=round(sum(counts) / len(counts), 2)
+    stats['ratio']=round(sorted(ratios)[len(ratios) // 2], 3)
+    return stats
+
+def setup(args):
+    """Builds the stand-in database and points the app at it. Returns (app, population)."""
+    path=os.path.join(tempfile.mkdtemp(prefix="expense_bench_"), "bench.db")
+    mysql_standin.create_schema(path)
+    database.set_pool(database.ConnectionPool(mysql_standin.connection_factory(path)))
+    rates.set_provider(rates.StaticRateProvider(FAKE_RATES))
+    if args.no_cache:
+        cache.set_backend(cache.LRUBackend(max_entries=0))
+    else:
+        # One process: every bump goes through this backend, so trusting version tokens until
+        # then is exact, and queries per request don't depend on timing (CACHE_VERSION_TTL would)
+        cache.set_backend(cache.LRUBackend(version_ttl=float('inf')))
+
+    conn=database.get_pool().acquire()
+    start=time.perf_counter()
+    population=generate(conn, args.users, args.accounts, args.transactions // args.users)
+    database.get_pool().release(conn)
+    print(f"Generated {args.users} users, {args.accounts} accounts each, {args.transactions} transactions "
+          f"in {time.perf_counter() - start:.1f}s ({path})")
+
+    from app import app
+    return app, population
+
+def check(results, baseline, tolerance):
+    """Returns a list of regressions (empty means the gate passes)."""
+    problems=[]
+    same_data=baseline.get('config') == results['config']
+    if not same_data:
+        print("Baseline was recorded with a different data size: comparing queries per request only.")
+    for name, current in results['scenarios'].items():
+        expected=baseline['scenarios'].get(name)
+        if expected is None:
+            continue
+        if current['queries'] > expected['queries'] + 0.01:
+            problems.append(f"{name}: {current['queries']} queries per request (baseline {expected['queries']})")
+        if same_data and 'ratio' in expected and current['ratio'] > expected['ratio'] * (1 + tolerance):
+            problems.append(f"{name}: p95 {current['ratio']}x the reference request "
+                            f"(baseline {expected['ratio']}x, +{tolerance:.0%} allowed)")
+    return problems
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Benchmark the web app against synthetic data.")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--accounts', type=int, default=3, help="accounts per user")
+    parser.add_argument('--transactions', type=int, default=20000, help="total, spread over the users")
+    parser.add_argument('--requests', type=int, default=500, help="measured requests per scenario")
+    parser.add_argument('--rounds', type=int, default=5, help="the latency ratio is the median of these")
+    parser.add_argument('--warmup', type=int, default=50, help="unmeasured requests per scenario")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="repeatable; default all")
+    parser.add_argument('--no-cache', action='store_true', help="disable the per-user view cache")
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help="fail on regressions against the baseline")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed rise of the p95 ratio (0.25 = 25%%)")
+    args=parser.parse_args(argv)
+
+    app, population=setup(args)
+    results={
+        'config': {'users': args.users, 'accounts': args.accounts, 'transactions': args.transactions,
+                   'no_cache': args.no_cache},
+        'scenarios': {},
+    }
+    print(f"{'scenario':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}{'p95 ratio':>11}")
+    for name in args.scenario or SCENARIOS:
+        stats=run_scenario(app, population, name, args.requests, args.warmup, args.rounds)
+        results['scenarios'][name]=stats
+        print(f"{name:<20}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+              f"{stats['queries']:>10.2f}{stats['ratio']:>11.2f}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    if args.check:
+        with open(args.baseline) as f:
+            problems=check(results, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"❌ {problem}")
+        if problems:
+            return 1
+        print("✅ No regressions against the baseline.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,324 @@
+#---Telegram Bot (asyncio)---
+# One process serves every chat: Telegram calls go through one aiohttp session with
+# keep-alive connections, and the blocking MySQL work runs in a thread pool sized to the
+# connection pool, so thousands of waiting chats never hold a thread or a connection.
+#
+# Backpressure: received updates wait in a bounded queue for BOT_CONCURRENCY handlers.
+# When the queue is full, polling pauses and Telegram keeps the rest for us.
+#
+# Usage:
+#   TELEGRAM_TOKEN=123:abc python bot.py
+#   python fake_telegram.py &  TELEGRAM_API_URL=http://127.0.0.1:8081 TELEGRAM_TOKEN=test python bot.py
+#
+# Chats are linked to a user with a one-time code from the Settings page: /start CODE
+import asyncio
+import concurrent.futures
+import os
+
+import aiohttp
+
+import budgets
+import cache
+import database
+import fx
+import importer
+import ledger
+
+TELEGRAM_TOKEN=os.getenv("TELEGRAM_TOKEN")
+TELEGRAM_API_URL=os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+BOT_CONCURRENCY=int(os.getenv("BOT_CONCURRENCY", "200"))  # updates handled at the same time
+BOT_QUEUE_SIZE=int(os.getenv("BOT_QUEUE_SIZE", "1000"))  # received but not yet handled
+BOT_POLL_TIMEOUT=int(os.getenv("BOT_POLL_TIMEOUT", "30"))  # long-poll seconds
+BOT_MAX_CONNECTIONS=int(os.getenv("BOT_MAX_CONNECTIONS", "100"))  # open HTTP connections to Telegram
+BOT_ALERT_INTERVAL=float(os.getenv("BOT_ALERT_INTERVAL", "15"))  # seconds between budget alert deliveries
+
+HELP_TEXT = (
+    "Add a transaction: <amount> <category> [@account] [note]\n"
+    "  e.g. 12.50 Food @Cash lunch\n"
+    "/balance - account balances\n"
+    "/categories - your categories\n"
+    "/start CODE - link this chat (get a code on the Settings page)"
+)
+NOT_LINKED = "This chat is not linked yet. Get a code on the Settings page and send /start CODE."
+
+
+class TelegramError(Exception):
+    pass
+
+
+class TelegramClient:
+    """The few Bot API methods we use, over one shared aiohttp session."""
+    def __init__(self, token, base_url=TELEGRAM_API_URL, max_connections=BOT_MAX_CONNECTIONS):
+        self.url=f"{base_url}/bot{token}"
+        self.max_connections=max_connections
+        self.session=None
+
+    async def __aenter__(self):
+        self.session=aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def call(self, method, params, timeout=10, retries=3):
+        for attempt in range(retries):
+            async with self.session.post(f"{self.url}/{method}", json=params,
+                                         timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                data=await response.json()
+            if data.get('ok'):
+                return data['result']
+            retry_after=data.get('parameters', {}).get('retry_after')
+            if response.status != 429 or retry_after is None or attempt == retries - 1:
+                break
+            # Flood control: Telegram says exactly how long to back off
+            await asyncio.sleep(retry_after)
+        raise TelegramError(f"{method}: {data.get('description', response.status)}")
+
+    async def get_updates(self, offset, timeout=BOT_POLL_TIMEOUT):
+        params={'timeout': timeout, 'allowed_updates': ['message']}
+        if offset is not None:
+            params['offset']=offset
+        return await self.call('getUpdates', params, timeout=timeout + 10)
+
+    async def send_message(self, chat_id, text):
+        return await self.call('sendMessage', {'chat_id': chat_id, 'text': text})
+
+
+#---DB work: plain blocking functions, run in the bot's thread pool---
+def _with_connection(fn, *args):
+    pool=database.get_pool()
+    conn=pool.acquire()
+    try:
+        return fn(conn, *args)
+    finally:
+        pool.release(conn)
+
+LINKED_USER_QUERY = """
+    SELECT u.user_id, u.default_currency
+    FROM telegram_chats tc
+    JOIN users u ON u.user_id = tc.user_id
+    WHERE tc.chat_id = %s
+"""
+
+def _linked_user(cursor, chat_id):
+    cursor.execute(LINKED_USER_QUERY, (chat_id,))
+    return cursor.fetchone()
+
+def link_chat(conn, chat_id, code):
+    """Redeems a one-time code from the Settings page. Returns the user_id, or None if the code is unknown/expired."""
+    cursor=conn.cursor(dictionary=True)
+    cursor.execute("SELECT user_id FROM telegram_link_codes WHERE code = %s AND expires_at > NOW() FOR UPDATE",
+                   (code.strip().upper(),))
+    row=cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute("""
+        INSERT INTO telegram_chats (chat_id, user_id) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE user_id = VALUES(user_id), linked_at = CURRENT_TIMESTAMP
+    """, (chat_id, row['user_id']))
+    cursor.execute("DELETE FROM telegram_link_codes WHERE code = %s", (code.strip().upper(),))
+    conn.commit()
+    return row['user_id']
+
+def _key(name):
+    return name.replace(' ', '').lower()
+
+def add_entry(conn, chat_id, amount, words):
+    """'words' is the message after the amount: category name, optional @account, then the note."""
+    cursor=conn.cursor(dictionary=True)
+    user=_linked_user(cursor, chat_id)
+    if user is None:
+        return NOT_LINKED
+    categories=database.get_categories(cursor, user['user_id'])
+    accounts=database.get_accounts(cursor, user['user_id'])
+    if not accounts:
+        return "You have no accounts yet. Add one on the Settings page."
+
+    # 1. Category: the longest run of leading words naming one (so 'Eating Out' works)
+    by_name={_key(c['name']): c for c in categories}
+    category=None
+    for size in range(len(words), 0, -1):
+        category=by_name.get(_key(''.join(words[:size])))
+        if category:
+            words=words[size:]
+            break
+    if category is None:
+        names=', '.join(c['name'] for c in categories)
+        return f"Unknown category. Your categories: {names}"
+
+    # 2. Account: '@name' anywhere in the rest, else the first account
+    account=min(accounts, key=lambda a: a['account_id'])
+    for word in words:
+        if word.startswith('@'):
+            match={_key(a['account_name']): a for a in accounts}.get(_key(word[1:]))
+            if match is None:
+                return f"Unknown account '{word[1:]}'. Your accounts: {', '.join(a['account_name'] for a in accounts)}"
+            account=match
+            words=[w for w in words if w != word]
+            break
+
+    try:
+        ledger.add_transaction(cursor, user['user_id'], account['account_id'], category['category_id'],
+                               amount, ' '.join(words) or None)
+    except ValueError as e:
+        conn.rollback()  # deleted since the lookups above
+        return str(e)
+    conn.commit()
+    cache.invalidate_user(user['user_id'], conn)
+    budgets.check_later(user['user_id'])
+    return f"✅ {category['type']}: {amount} {account.get('currency') or 'TRY'} ({category['name']}) on {account['account_name']}"
+
+def load_categories(conn, chat_id):
+    cursor=conn.cursor(dictionary=True)
+    user=_linked_user(cursor, chat_id)
+    return None if user is None else database.get_categories(cursor, user['user_id'])
+
+def load_balances(conn, chat_id):
+    cursor=conn.cursor(dictionary=True)
+    user=_linked_user(cursor, chat_id)
+    if user is None:
+        return None
+    return user['default_currency'] or 'TRY', database.get_accounts(cursor, user['user_id'])
+
+def parse_entry(text):
+    """'12.50 Food @Cash lunch' -> (Decimal('12.50'), ['Food', '@Cash', 'lunch'])"""
+    words=text.split()
+    amount=importer.parse_amount(words[0])
+    if amount <= 0:
+        raise ValueError("The amount must be positive.")
+    if len(words) < 2:
+        raise ValueError("Which category?")
+    return amount, words[1:]
+
+
+#---Service---
+class Bot:
+    def __init__(self, client, concurrency=BOT_CONCURRENCY, queue_size=BOT_QUEUE_SIZE, db_threads=database.POOL_SIZE):
+        self.client=client
+        self.concurrency=concurrency
+        self.queue=asyncio.Queue(maxsize=queue_size)
+        # No more threads than pooled connections, so a DB call never waits inside a thread
+        self._db_executor=concurrent.futures.ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix='bot-db')
+        self.stats={'updates': 0, 'handled': 0, 'errors': 0, 'queue_full': 0, 'alerts_sent': 0}
+
+    async def _db(self, fn, *args):
+        """Runs fn(conn, *args) on a pooled connection without blocking the event loop."""
+        loop=asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, _with_connection, fn, *args)
+
+    async def run(self):
+        workers=[asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        workers.append(asyncio.create_task(self._deliver_alerts()))
+        try:
+            await self._poll()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._db_executor.shutdown(wait=False)
+
+    async def _poll(self):
+        offset=None
+        while True:
+            try:
+                updates=await self.client.get_updates(offset)
+            except (aiohttp.ClientError, asyncio.TimeoutError, TelegramError) as e:
+                print(f"Telegram Error: {e}")
+                await asyncio.sleep(5)
+                continue
+            for update in updates:
+                # Telegram drops updates below the next offset we send, i.e. only once they are queued
+                offset=update['update_id'] + 1
+                self.stats['updates'] += 1
+                if self.queue.full():
+                    self.stats['queue_full'] += 1
+                await self.queue.put(update)
+
+    async def _worker(self):
+        while True:
+            update=await self.queue.get()
+            try:
+                await self.handle_update(update)
+                self.stats['handled'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Bot Error: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _deliver_alerts(self, interval=BOT_ALERT_INTERVAL):
+        """Drains the budget alert queue (see budgets.py) to linked chats."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                alerts=await self._db(budgets.take_alerts)
+                sent=[]
+                for alert in alerts:
+                    try:
+                        await self.client.send_message(alert['chat_id'], alert['message'])
+                        sent.append(alert['alert_id'])
+                    except (aiohttp.ClientError, asyncio.TimeoutError, TelegramError) as e:
+                        print(f"Telegram Error: {e}")
+                if sent:
+                    await self._db(budgets.mark_sent, sent)
+                    self.stats['alerts_sent'] += len(sent)
+            except Exception as e:
+                print(f"Alert Error: {e}")
+
+    async def handle_update(self, update):
+        message=update.get('message') or {}
+        text=(message.get('text') or '').strip()
+        if not text:
+            return
+        chat_id=message['chat']['id']
+        await self.client.send_message(chat_id, await self.reply_to(chat_id, text))
+
+    async def reply_to(self, chat_id, text):
+        command, _, argument=text.partition(' ')
+        command=command.split('@')[0].lower()  # '/help@SomeBot' in group chats
+        if command == '/start':
+            if not argument.strip():
+                return HELP_TEXT
+            user_id=await self._db(link_chat, chat_id, argument)
+            return "✅ Chat linked. " + HELP_TEXT if user_id else "That code is invalid or has expired."
+        if command == '/help':
+            return HELP_TEXT
+        if command == '/balance':
+            return await self.balance(chat_id)
+        if command == '/categories':
+            categories=await self._db(load_categories, chat_id)
+            if categories is None:
+                return NOT_LINKED
+            return '\n'.join(f"{c['name']} ({c['type']})" for c in categories) or "No categories yet."
+        try:
+            amount, words=parse_entry(text)
+        except ValueError as e:
+            return f"{e}\n\n{HELP_TEXT}"
+        return await self._db(add_entry, chat_id, amount, words)
+
+    async def balance(self, chat_id):
+        found=await self._db(load_balances, chat_id)
+        if found is None:
+            return NOT_LINKED
+        user_currency, accounts=found
+        lines=[f"{a['account_name']}: {a['current_balance']} {a.get('currency') or 'TRY'}" for a in accounts]
+        try:
+            matrix=await fx.get_matrix_async()
+        except LookupError:
+            return '\n'.join(lines)
+        total=matrix.convert_total(((a['current_balance'], a.get('currency') or 'TRY') for a in accounts), user_currency)
+        lines.append(f"Total: {total:,} {user_currency}")
+        return '\n'.join(lines)
+
+
+async def main():
+    if not TELEGRAM_TOKEN:
+        raise SystemExit("Set TELEGRAM_TOKEN first.")
+    async with TelegramClient(TELEGRAM_TOKEN) as client:
+        await Bot(client).run()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,313 @@
+#---Budgets & Spending Alerts---
+# A budget caps what a user spends in one expense category per calendar month.
+#
+# budget_spent keeps a counter per (user, category, month, account currency) for budgeted
+# categories only. ledger.apply_where() updates it with the balances and rollups, so a new
+# transaction costs one primary-key upsert and nothing is ever rescanned.
+#
+# Checking a budget needs exchange rates and may create alerts, so none of it happens on the
+# write path: routes call check_later(user_id) after committing, and a thread in each process
+# evaluates the user's budgets for the current month. A threshold crossing becomes a row in
+# budget_alerts (one per budget, month and level, so it is never sent twice). The Telegram bot
+# drains that queue to linked chats (see bot.py); the Settings page lists this month's alerts.
+#
+# Usage:
+#   python budgets.py rebuild [user_id]   -> recompute the counters from the monthly rollups
+#   python budgets.py check user_id       -> evaluate one user's budgets now
+import datetime
+import os
+import sys
+import threading
+import time
+from decimal import Decimal
+
+import database
+import fx
+from rollups import MONTH_OF
+
+BUDGET_ALERT_LEVELS=tuple(sorted(int(level) for level in os.getenv("BUDGET_ALERT_LEVELS", "80,100").split(',')))  # percent of the budget
+BUDGET_CHECK_DELAY=float(os.getenv("BUDGET_CHECK_DELAY", "1"))  # seconds to collect writes before evaluating
+ALERT_BATCH=100  # alerts handed to the bot per drain
+
+
+#---Counters (called from ledger.py inside the caller's DB transaction)---
+def apply_where(cursor, where, params, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) the transactions matching 'where' to/from the spent
+    counters of budgeted categories. 'where' may only reference the transactions alias 't'.
+    """
+    cursor.execute(f"""
+        INSERT INTO budget_spent (user_id, category_id, period, currency, spent)
+        SELECT t.user_id, t.category_id, {MONTH_OF} AS p, COALESCE(a.currency, 'TRY') AS cur, %s * SUM(t.amount)
+        FROM transactions t
+        JOIN budgets b ON b.user_id = t.user_id AND b.category_id = t.category_id
+        JOIN accounts a ON a.account_id = t.account_id
+        WHERE {where}
+        GROUP BY t.user_id, t.category_id, p, cur
+        ON DUPLICATE KEY UPDATE spent = spent + VALUES(spent)
+    """, (sign,) + tuple(params))
+
+def _scope(alias, user_id, category_id):
+    where, params="", ()
+    if user_id is not None:
+        where += f" AND {alias}user_id = %s"
+        params += (user_id,)
+    if category_id is not None:
+        where += f" AND {alias}category_id = %s"
+        params += (category_id,)
+    return where, params
+
+def rebuild(cursor, user_id=None, category_id=None):
+    """
+    Recomputes the counters from rollup_monthly (all users if user_id is None), so its cost
+    follows the number of monthly buckets. Call it after the rollups are up to date.
+    """
+    where, params=_scope("", user_id, category_id)
+    cursor.execute(f"DELETE FROM budget_spent WHERE 1 = 1{where}", params)
+    where, params=_scope("r.", user_id, category_id)
+    cursor.execute(f"""
+        INSERT INTO budget_spent (user_id, category_id, period, currency, spent)
+        SELECT r.user_id, r.category_id, r.bucket, COALESCE(a.currency, 'TRY') AS cur, SUM(r.total)
+        FROM rollup_monthly r
+        JOIN budgets b ON b.user_id = r.user_id AND b.category_id = r.category_id
+        JOIN accounts a ON a.account_id = r.account_id
+        WHERE a.deleted_at IS NULL{where}
+        GROUP BY r.user_id, r.category_id, r.bucket, cur
+    """, params)
+
+def remove_category(cursor, user_id, category_id):
+    """The category is going away, and with it its budget."""
+    cursor.execute("DELETE FROM budget_spent WHERE user_id = %s AND category_id = %s", (user_id, category_id))
+    cursor.execute("DELETE FROM budgets WHERE user_id = %s AND category_id = %s", (user_id, category_id))
+
+
+#---Budgets (Settings page and API)---
+def set_budget(cursor, user_id, category_id, amount, currency):
+    """Creates or changes the monthly budget of one of the user's expense categories. Does not commit."""
+    amount=Decimal(str(amount))
+    if amount <= 0:
+        raise ValueError("The budget must be positive.")
+    cursor.execute("""
+        SELECT category_id FROM categories
+        WHERE category_id = %s AND user_id = %s AND type = 'Expense' AND deleted_at IS NULL
+    """, (category_id, user_id))
+    if cursor.fetchone() is None:
+        raise ValueError("Budgets can only be set on your expense categories.")
+    cursor.execute("""
+        INSERT INTO budgets (user_id, category_id, amount, currency) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE amount = VALUES(amount), currency = VALUES(currency)
+    """, (user_id, category_id, amount, currency))
+    # Counters exist only for budgeted categories: start this one's from the rollups
+    rebuild(cursor, user_id, category_id)
+
+def delete_budget(cursor, user_id, category_id):
+    """Returns False if the category had no budget. Does not commit."""
+    remove_category(cursor, user_id, category_id)
+    return cursor.rowcount > 0
+
+BUDGETS_QUERY = """
+    SELECT b.category_id, c.name AS category_name, b.amount, b.currency,
+           s.currency AS spent_currency, s.spent
+    FROM budgets b
+    JOIN categories c ON c.category_id = b.category_id
+    LEFT JOIN budget_spent s ON s.user_id = b.user_id AND s.category_id = b.category_id AND s.period = %s
+    WHERE b.user_id = %s AND c.deleted_at IS NULL
+    ORDER BY c.name
+"""
+
+def get_budgets(cursor, user_id, matrix=None, today=None):
+    """
+    The user's budgets with this month's spending in the budget's currency, e.g.
+    [{'category_id': 3, 'category_name': 'Food', 'amount': Decimal('500.00'), 'currency': 'TRY',
+      'spent': Decimal('412.30'), 'percent': 82}, ...]
+    'spent' is None when the spending is in other currencies and no rates are available.
+    Pass a dictionary cursor.
+    """
+    period=(today or datetime.date.today()).replace(day=1)
+    cursor.execute(BUDGETS_QUERY, (period, user_id))
+    budgets={}
+    for row in cursor.fetchall():
+        budget=budgets.setdefault(row['category_id'], {
+            'category_id': row['category_id'], 'category_name': row['category_name'],
+            'amount': row['amount'], 'currency': row['currency'], 'spending': [],
+        })
+        if row['spent']:
+            budget['spending'].append((row['spent'], row['spent_currency']))
+
+    for budget in budgets.values():
+        spending=budget.pop('spending')
+        if matrix is None and any(currency != budget['currency'] for _, currency in spending):
+            budget['spent']=budget['percent']=None
+            continue
+        spent=matrix.convert_total(spending, budget['currency']) if matrix else sum((s for s, _ in spending), Decimal(0))
+        budget['spent']=spent
+        budget['percent']=int(spent * 100 / budget['amount'])
+    return list(budgets.values())
+
+
+#---Alerts---
+def _message(budget, level):
+    if level >= 100:
+        return (f"🚨 {budget['category_name']}: {budget['spent']:,} of {budget['amount']:,} {budget['currency']} "
+                f"spent this month, over budget.")
+    return (f"⚠️ {budget['category_name']}: {budget['spent']:,} of {budget['amount']:,} {budget['currency']} "
+            f"spent this month ({budget['percent']}%).")
+
+def evaluate(conn, user_id, matrix=None, today=None):
+    """
+    Queues an alert for each budget level the user reached this month. Only the highest level
+    reached is sent; lower ones are stored as already sent, so a jump from 50% to 120% sends
+    one alert. Returns the number of new alerts.
+    """
+    today=today or datetime.date.today()
+    cursor=conn.cursor(dictionary=True)
+    rows=[]
+    for budget in get_budgets(cursor, user_id, matrix, today):
+        if budget['percent'] is None:
+            continue
+        reached=[level for level in BUDGET_ALERT_LEVELS if budget['percent'] >= level]
+        for level in reached:
+            sent_at=None if level == reached[-1] else datetime.datetime.now()
+            rows.append((user_id, budget['category_id'], today.replace(day=1), level, _message(budget, level), sent_at))
+    created=0
+    if rows:
+        cursor.executemany("""
+            INSERT IGNORE INTO budget_alerts (user_id, category_id, period, level, message, sent_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, rows)
+        created=cursor.rowcount
+        conn.commit()
+    cursor.close()
+    return created
+
+def get_alerts(cursor, user_id, today=None):
+    """This month's alerts, newest first. Pass a dictionary cursor."""
+    period=(today or datetime.date.today()).replace(day=1)
+    cursor.execute("""
+        SELECT alert_id, category_id, level, message, created_at
+        FROM budget_alerts
+        WHERE user_id = %s AND period = %s
+        ORDER BY alert_id DESC
+    """, (user_id, period))
+    return cursor.fetchall()
+
+def take_alerts(conn, limit=ALERT_BATCH):
+    """Unsent alerts of users with a linked Telegram chat, one row per chat."""
+    cursor=conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT ba.alert_id, tc.chat_id, ba.message
+        FROM budget_alerts ba
+        JOIN telegram_chats tc ON tc.user_id = ba.user_id
+        WHERE ba.sent_at IS NULL
+        ORDER BY ba.alert_id LIMIT %s
+    """, (limit,))
+    alerts=cursor.fetchall()
+    cursor.close()
+    return alerts
+
+def mark_sent(conn, alert_ids):
+    cursor=conn.cursor()
+    placeholders=', '.join(['%s'] * len(alert_ids))
+    cursor.execute(f"UPDATE budget_alerts SET sent_at = NOW() WHERE alert_id IN ({placeholders})", tuple(alert_ids))
+    conn.commit()
+    cursor.close()
+
+
+#---Per-process evaluator thread---
+class Evaluator:
+    """
+    Evaluates budgets off the write path. Users pushed within 'delay' seconds of each other
+    are collected into a set, so a burst of writes (an import, a busy bot chat) costs one
+    evaluation per user, and the thread stays out of the way of the requests that pushed them.
+    """
+    def __init__(self, delay=BUDGET_CHECK_DELAY):
+        self.delay=delay
+        self._pending=set()
+        self._lock=threading.Lock()
+        self._wake=threading.Event()
+        self.stats={'queued': 0, 'evaluated': 0, 'alerts': 0, 'errors': 0}
+        self.thread=threading.Thread(target=self._run, name='budget-evaluator', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def push(self, user_id):
+        with self._lock:
+            self._pending.add(user_id)
+            self.stats['queued'] += 1
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.delay)
+            self._wake.clear()
+            with self._lock:
+                users, self._pending=self._pending, set()
+            if not users:
+                continue
+            try:
+                matrix=fx.get_matrix()
+            except Exception as e:
+                print(f"Budget Rates Error: {e}")
+                matrix=None
+            pool=database.get_background_pool()
+            for user_id in users:
+                try:
+                    conn=pool.acquire()
+                    try:
+                        created=evaluate(conn, user_id, matrix)
+                    finally:
+                        pool.release(conn)
+                    with self._lock:
+                        self.stats['evaluated'] += 1
+                        self.stats['alerts'] += created
+                except Exception as e:
+                    with self._lock:
+                        self.stats['errors'] += 1
+                    print(f"Budget Error: {e}")
+
+_evaluator=None
+_evaluator_pid=None
+_evaluator_lock=threading.Lock()
+
+def get_evaluator():
+    """This process's evaluator thread, started after fork on first use."""
+    global _evaluator, _evaluator_pid
+    if _evaluator is None or _evaluator_pid != os.getpid():
+        with _evaluator_lock:
+            if _evaluator is None or _evaluator_pid != os.getpid():
+                _evaluator=Evaluator()
+                _evaluator.start()
+                _evaluator_pid=os.getpid()
+    return _evaluator
+
+def check_later(user_id):
+    """Queues the user's budgets for evaluation. Call after committing the write that changed them."""
+    get_evaluator().push(user_id)
+
+def get_budget_stats():
+    evaluator=_evaluator
+    if evaluator is None or _evaluator_pid != os.getpid():
+        return {'queued': 0, 'evaluated': 0, 'alerts': 0, 'errors': 0}
+    with evaluator._lock:
+        return dict(evaluator.stats)
+
+if __name__ == '__main__':
+    from database import get_db_connection
+    command=sys.argv[1] if len(sys.argv) > 1 else 'rebuild'
+    user_id=int(sys.argv[2]) if len(sys.argv) > 2 else None
+    conn=get_db_connection()
+    try:
+        if command == 'rebuild':
+            cursor=conn.cursor()
+            rebuild(cursor, user_id)
+            conn.commit()
+            print("Budget counters rebuilt.")
+        elif command == 'check' and user_id is not None:
+            print(f"Queued {evaluate(conn, user_id, fx.get_matrix())} alerts.")
+        else:
+            print("Usage: python budgets.py rebuild [user_id] | check user_id")
+            sys.exit(2)
+    finally:
+        conn.close()
@@ -0,0 +1,204 @@
+#---Per-User View Cache---
+# Cached entries are keyed by a per-user version token: every write calls invalidate_user(),
+# which moves the token on, so all of that user's old entries become unreachable at once
+# (they simply age out). The token lives where every process sees it once the write commits:
+#   - Redis backend: next to the entries, in Redis (no DB query per cached read)
+#   - in-process LRU: users.cache_version. Each worker trusts the token it last read for
+#     CACHE_VERSION_TTL seconds, so most cached reads cost no query, and a write made by
+#     another worker or the bot shows up within that time. The user's own writes show up
+#     at once: the session notes when they were made, and a token read before that is read again.
+# Each token also carries when it was bumped. A load that read from a replica within
+# DB_REPLICA_STICKY seconds of that is served but not cached: the replica may not have the
+# write yet (bot and CLI writes don't keep anyone's reads on the primary).
+#
+# Backends:
+#   - in-process LRU (default): fastest, but each gunicorn worker has its own copy,
+#     so entries also expire after CACHE_TTL seconds to bound memory.
+#   - Redis (set CACHE_URL=redis://...): shared by all workers, needs the 'redis' package.
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import has_request_context, session
+
+import database
+
+CACHE_URL=os.getenv("CACHE_URL")
+CACHE_MAX_ENTRIES=int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL=float(os.getenv("CACHE_TTL", "300"))
+CACHE_VERSION_TTL=float(os.getenv("CACHE_VERSION_TTL", "2"))  # seconds an LRU worker trusts a version token it read
+
+VERSION_QUERY="SELECT cache_version, cache_bumped_at FROM users WHERE user_id = %s"
+
+
+class LRUBackend:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, version_ttl=CACHE_VERSION_TTL):
+        self.max_entries=max_entries
+        self.ttl=ttl
+        self.version_ttl=version_ttl
+        self._data=OrderedDict()  # key -> (value, expires_at)
+        self._versions={}  # user_id -> ((token, bumped_at), read_at monotonic, read_at wall clock)
+        self._lock=threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item=self._data.get(key)
+            if item is None:
+                return None
+            if item[1] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key]=(value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    # Other workers can't see this process's memory: version tokens live in the database
+    def get_version(self, user_id, conn=None, written_at=None):
+        """
+        (token, time.time() of the last bump or 0) for the user. 'written_at' is when
+        their session last wrote, if known.
+        """
+        known=self._versions.get(user_id)
+        if (known is not None and time.monotonic() - known[1] < self.version_ttl
+                and (written_at is None or written_at < known[2])):
+            return known[0]
+        cursor=(conn or database.get_db()).cursor()
+        cursor.execute(VERSION_QUERY, (user_id,))
+        row=cursor.fetchone()
+        cursor.close()
+        version=(str(row[0]), row[1] or 0.0) if row else (None, 0.0)
+        with self._lock:
+            if len(self._versions) >= self.max_entries:
+                self._versions.clear()
+            self._versions[user_id]=(version, time.monotonic(), time.time())
+        return version
+
+    def bump_version(self, user_id, conn=None):
+        conn=conn or database.get_db()
+        cursor=conn.cursor()
+        cursor.execute("UPDATE users SET cache_version = cache_version + 1, cache_bumped_at = %s WHERE user_id = %s",
+                       (time.time(), user_id))
+        conn.commit()
+        cursor.close()
+        with self._lock:
+            self._versions.pop(user_id, None)
+
+
+class RedisBackend:
+    def __init__(self, url, ttl=CACHE_TTL):
+        import redis  # optional dependency, only needed for the shared backend
+        self.client=redis.Redis.from_url(url)
+        self.ttl=int(ttl)
+
+    def get(self, key):
+        raw=self.client.get(key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self.client.set(key, pickle.dumps(value), ex=self.ttl)
+
+    # Tokens are "<bump time>:<random>", so the bump time comes with them
+    def get_version(self, user_id, conn=None, written_at=None):
+        raw=self.client.get(f"ver:{user_id}")
+        if raw is None:
+            # A fresh random token (never 'missing') so a lost token can't resurrect old entries
+            self.client.set(f"ver:{user_id}", self._new_token(), nx=True)
+            raw=self.client.get(f"ver:{user_id}")
+        token=raw.decode()
+        bumped_at, _, _=token.partition(':')
+        try:
+            return token, float(bumped_at)
+        except ValueError:
+            return token, 0.0
+
+    def bump_version(self, user_id, conn=None):
+        self.client.set(f"ver:{user_id}", self._new_token())
+
+    def _new_token(self):
+        return f"{time.time():.3f}:{uuid.uuid4().hex}"
+
+
+def _make_backend():
+    if CACHE_URL:
+        try:
+            return RedisBackend(CACHE_URL)
+        except Exception as e:
+            print(f"Cache Error: {e} (falling back to in-process cache)")
+    return LRUBackend()
+
+_backend=_make_backend()
+_stats={'hits': 0, 'misses': 0, 'uncached': 0, 'invalidations': 0, 'errors': 0}
+_stats_lock=threading.Lock()
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def _written_at():
+    """When this session's user last invalidated their cache (maybe on another worker), or None."""
+    return session.get('cache_bumped_at') if has_request_context() else None
+
+def get_or_load(user_id, name, loader, conn=None):
+    """
+    Returns the cached value for (user, name), calling loader() on a miss. 'conn' is
+    where the version token is read (default: the request's primary connection).
+    If loader() raises, the error propagates and nothing is cached, so loaders must
+    not turn a failed read into an empty result. Loads that read from a replica right
+    after a write aren't cached either (see above).
+    """
+    try:
+        token, bumped_at=_backend.get_version(user_id, conn, _written_at())
+        key=f"{name}:{user_id}:{token}"
+        value=_backend.get(key)
+    except Exception as e:
+        print(f"Cache Error: {e}")
+        _count('errors')
+        return loader()
+    if value is not None:
+        _count('hits')
+        return value
+    _count('misses')
+    value=loader()
+    if time.time() - bumped_at < database.DB_REPLICA_STICKY and database.read_from_replica():
+        _count('uncached')
+        return value
+    try:
+        _backend.set(key, value)
+    except Exception as e:
+        print(f"Cache Error: {e}")
+        _count('errors')
+    return value
+
+def invalidate_user(user_id, conn=None):
+    """
+    Call after committing any write that changes what a user's cached views show.
+    Outside a request (e.g. the bot), pass the connection that made the write.
+    """
+    try:
+        _backend.bump_version(user_id, conn)
+        _count('invalidations')
+        if has_request_context():
+            session['cache_bumped_at']=time.time()
+    except Exception as e:
+        print(f"Cache Error: {e}")
+        _count('errors')
+
+def set_backend(backend):
+    """Swaps the backend, e.g. a fresh LRUBackend() in tests."""
+    global _backend
+    _backend=backend
+
+def get_cache_stats():
+    with _stats_lock:
+        stats=dict(_stats)
+    stats['backend']=type(_backend).__name__
+    return stats
@@ -0,0 +1,167 @@
+#---Server-side Chart Rendering (Matplotlib)---
+# Charts are rendered in a separate process pool so a slow render never blocks a web worker,
+# and Matplotlib is only imported inside those processes: web workers that never serve a
+# chart never pay for it.
+#
+# Rendered images live in a content-addressed store: the file name is a hash of
+# (user, chart type, format, the exact data being drawn). Same data -> same file -> same ETag,
+# so browsers revalidate with a 304 and nothing is re-rendered until the data changes.
+# The store is capped at CHART_CACHE_MAX_MB: a hit refreshes the file's mtime, and after a
+# render the least recently used files are deleted once it grows past the cap (see sweep()).
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+CHART_WORKERS=int(os.getenv("CHART_WORKERS", "2"))
+CHART_TIMEOUT=float(os.getenv("CHART_TIMEOUT", "20"))
+CHART_CACHE_DIR=os.getenv("CHART_CACHE_DIR", os.path.join(tempfile.gettempdir(), "expense_tracker_charts"))
+CHART_CACHE_MAX_MB=float(os.getenv("CHART_CACHE_MAX_MB", "200"))
+CHART_SWEEP_INTERVAL=float(os.getenv("CHART_SWEEP_INTERVAL", "60"))  # seconds between size checks per process
+
+CHART_TYPES = ('categories', 'trend')
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+_executor=None
+_executor_pid=None
+_executor_lock=threading.Lock()
+
+def _get_executor():
+    """One pool per web worker process, created on the first chart request."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                # 'spawn': never fork a process that already has threads and DB sockets
+                _executor=concurrent.futures.ProcessPoolExecutor(
+                    max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+                _executor_pid=os.getpid()
+    return _executor
+
+#---Runs inside the chart processes---
+def _render(chart_type, data, currency, fmt):
+    import io
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(6, 3.2), dpi=100)
+    try:
+        if chart_type == 'categories':
+            expenses = [row for row in data if row['type'] != 'Income' and row['total'] > 0]
+            # Keep the pie readable: top 6 slices, the rest as 'Other'
+            top, rest = expenses[:6], expenses[6:]
+            labels = [row['category'] for row in top] + (['Other'] if rest else [])
+            values = [row['total'] for row in top] + ([sum(row['total'] for row in rest)] if rest else [])
+            if values:
+                ax.pie(values, labels=labels, autopct='%1.0f%%', startangle=90, counterclock=False)
+                ax.axis('equal')
+            ax.set_title(f"Spending by Category ({currency})")
+        else:
+            months = data[-12:]
+            labels = [row['period'][:7] for row in months]
+            positions = range(len(months))
+            ax.bar([p - 0.2 for p in positions], [row['income'] for row in months], width=0.4, color='#10B981', label='Income')
+            ax.bar([p + 0.2 for p in positions], [row['expense'] for row in months], width=0.4, color='#EF4444', label='Expense')
+            ax.plot(list(positions), [row['expense_avg'] for row in months], color='#4F46E5', label='Expense (3-month avg)')
+            ax.set_xticks(list(positions))
+            ax.set_xticklabels(labels, rotation=45, ha='right', fontsize=8)
+            ax.legend(fontsize=8)
+            ax.set_title(f"Monthly Trend ({currency})")
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt)
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+#---Runs in the web worker---
+def chart_digest(user_id, chart_type, fmt, currency, data):
+    """Content address (and ETag) of a chart: changes exactly when what it draws changes."""
+    payload = json.dumps([user_id, chart_type, fmt, currency, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _path(digest, fmt):
+    return os.path.join(CHART_CACHE_DIR, f"{digest}.{fmt}")
+
+_last_sweep=0.0
+_sweep_lock=threading.Lock()
+
+def sweep(max_bytes=None):
+    """
+    Deletes the least recently used images (oldest mtime first) until the store is back
+    under 90% of max_bytes, if it is over. Safe to run from several workers. Returns the
+    number of files deleted.
+    """
+    if max_bytes is None:
+        max_bytes = CHART_CACHE_MAX_MB * 1024 * 1024
+    now = time.time()
+    files = []
+    try:
+        with os.scandir(CHART_CACHE_DIR) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                # Leave images that are still being written alone
+                if entry.name.endswith('.tmp') and now - stat.st_mtime < CHART_TIMEOUT:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return 0
+    total = sum(size for _, size, _ in files)
+    if total <= max_bytes:
+        return 0
+    deleted = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes * 0.9:
+            break
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass  # another worker's sweep got it first
+        total -= size
+    return deleted
+
+def _maybe_sweep():
+    global _last_sweep
+    if time.monotonic() - _last_sweep < CHART_SWEEP_INTERVAL or not _sweep_lock.acquire(blocking=False):
+        return
+    try:
+        _last_sweep = time.monotonic()
+        sweep()
+    except OSError as e:
+        print(f"Chart Sweep Error: {e}")
+    finally:
+        _sweep_lock.release()
+
+def get_chart(digest, chart_type, data, currency, fmt):
+    """Returns the image bytes, rendering them in the process pool only on a store miss."""
+    path = _path(digest, fmt)
+    try:
+        with open(path, 'rb') as f:
+            image = f.read()
+        try:
+            os.utime(path)  # recently used: last in line for the sweep
+        except OSError:
+            pass
+        return image
+    except FileNotFoundError:
+        pass
+
+    image = _get_executor().submit(_render, chart_type, data, currency, fmt).result(timeout=CHART_TIMEOUT)
+
+    os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+    # Write then rename so a concurrent reader never sees half an image
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(image)
+    os.replace(tmp_path, path)
+    _maybe_sweep()
+    return image
@@ -1,14 +1,41 @@
 #---Creating Accounts, Categories, Transaction Tables---
 import mysql.connector
+from mysql.connector.errors import PoolError
 from urllib.parse import urlparse
+from flask import g, has_request_context, session
 import os
+import queue
+import random
+import base64
+import datetime
+from migrations import run_migrations
+import profiling
+import threading
+import time
 
 DB_URL=os.getenv("DATABASE_URL")
 
-def get_db_connection():
-    if not DB_URL:
+#---Connection Pool Settings---
+# Each gunicorn worker gets its own pool, so total connections = workers * size
+POOL_SIZE=int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_TIMEOUT=float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+POOL_PING_INTERVAL=float(os.getenv("DB_POOL_PING_INTERVAL", "30"))  # ping idle connections older than this
+BACKGROUND_POOL_SIZE=int(os.getenv("DB_BACKGROUND_POOL_SIZE", "2"))  # connections for background threads (see get_background_pool)
+
+#---Read Replica Settings (see get_read_db)---
+DB_REPLICA_URLS=[url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(',') if url.strip()]
+DB_REPLICA_STICKY=float(os.getenv("DB_REPLICA_STICKY", "5"))  # seconds a user's reads stay on the primary after they write
+DB_REPLICA_GTID=os.getenv("DB_REPLICA_GTID", "0") == "1"  # within that window, allow replicas that applied the write
+DB_REPLICA_RETRY=float(os.getenv("DB_REPLICA_RETRY", "30"))  # seconds a failing replica is left alone
+
+PAGE_SIZE=int(os.getenv("TRANSACTIONS_PAGE_SIZE", "50"))
+
+def get_db_connection(db_url=None):
+    """Opens a brand-new connection (to the primary unless db_url is given). Use get_db() inside requests instead."""
+    db_url=db_url or DB_URL
+    if not db_url:
         raise ValueError("DATABASE_URL environment variable is not set.")
-    url_without_query=DB_URL.split('?')[0]
+    url_without_query=db_url.split('?')[0]
     url=urlparse(url_without_query)
 
     return mysql.connector.connect(
@@ -17,80 +44,588 @@ def get_db_connection():
         password=url.password,
         database=url.path[1:],
         port=url.port,
-        ssl_disabled=False
+        ssl_disabled=False,
+        buffered=True # Connections are shared within a request, so never leave unread rows behind
     )
 
-def initialize_all_tables():
+class ConnectionPool:
+    """
+    A small thread-safe pool of MySQL connections.
+    Connections are opened lazily up to 'size' and handed out LIFO,
+    so the most recently used (and most likely alive) one is reused first.
+    """
+    def __init__(self, creator, size=POOL_SIZE, timeout=POOL_TIMEOUT, ping_interval=POOL_PING_INTERVAL):
+        self.creator=creator
+        self.size=size
+        self.timeout=timeout
+        self.ping_interval=ping_interval
+        self._idle=queue.LifoQueue()  # holds (connection, released_at) pairs
+        self._lock=threading.Lock()
+        self._open=0
+        self.stats={
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'connections_created': 0,
+            'connections_discarded': 0,
+            'health_checks': 0,
+        }
+
+    def _create(self):
+        conn=self.creator()
+        with self._lock:
+            self.stats['connections_created'] += 1
+        return conn
+
+    def discard(self, conn):
+        """Closes a checked-out connection that must not go back to the pool."""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open -= 1
+            self.stats['connections_discarded'] += 1
+
+    def _is_healthy(self, conn, released_at):
+        # Only pay for a round trip if the connection has been idle for a while
+        if time.monotonic() - released_at < self.ping_interval:
+            return True
+        with self._lock:
+            self.stats['health_checks'] += 1
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        start=time.monotonic()
+        waited=False
+        while True:
+            try:
+                conn, released_at=self._idle.get_nowait()
+            except queue.Empty:
+                # 1. Room to grow? Open a new connection
+                with self._lock:
+                    can_open=self._open < self.size
+                    if can_open:
+                        self._open += 1
+                if can_open:
+                    try:
+                        conn=self._create()
+                    except Exception:
+                        with self._lock:
+                            self._open -= 1
+                        raise
+                    break
+
+                # 2. Pool is full: wait for someone to release
+                waited=True
+                remaining=self.timeout - (time.monotonic() - start)
+                try:
+                    conn, released_at=self._idle.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    with self._lock:
+                        self.stats['timeouts'] += 1
+                    raise PoolError(f"No database connection available after {self.timeout}s (pool size {self.size})")
+
+            if self._is_healthy(conn, released_at):
+                break
+            self.discard(conn)
+
+        waited_for=time.monotonic() - start
+        with self._lock:
+            self.stats['checkouts'] += 1
+            if waited:
+                self.stats['waits'] += 1
+                self.stats['wait_time_total'] += waited_for
+                self.stats['wait_time_max']=max(self.stats['wait_time_max'], waited_for)
+        return conn
+
+    def release(self, conn):
+        try:
+            # End any open transaction so the next request does not see a stale snapshot
+            conn.rollback()
+        except Exception:
+            self.discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def get_stats(self):
+        with self._lock:
+            stats=dict(self.stats)
+            stats['size']=self.size
+            stats['open']=self._open
+        stats['idle']=self._idle.qsize()
+        stats['in_use']=stats['open'] - stats['idle']
+        return stats
+
+_pool=None
+_pool_pid=None
+_pool_lock=threading.Lock()
+
+def get_pool():
+    """Returns this process's pool, creating it after fork if needed."""
+    global _pool, _pool_pid
+    # Sockets must not be shared across forked gunicorn workers
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool=ConnectionPool(get_db_connection)
+                _pool_pid=os.getpid()
+    return _pool
+
+def set_pool(pool):
+    """Swaps this process's pool, e.g. one over mysql_standin connections in benchmarks."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        _pool=pool
+        _pool_pid=os.getpid()
+
+def get_pool_stats():
+    return get_pool().get_stats()
+
+#---Background pool---
+# The job worker and budget evaluator threads run for as long as there is work (a purge
+# keeps its connection for every batch of every pending job), so they get a few connections
+# of their own instead of competing with requests for the request pool.
+_background_pool=None
+_background_pool_pid=None
+
+def get_background_pool():
+    """This process's pool for background threads, opening connections the same way get_pool()'s does."""
+    global _background_pool, _background_pool_pid
+    if _background_pool is None or _background_pool_pid != os.getpid():
+        creator=get_pool().creator  # outside the lock: get_pool() takes it too
+        with _pool_lock:
+            if _background_pool is None or _background_pool_pid != os.getpid():
+                _background_pool=ConnectionPool(creator, size=BACKGROUND_POOL_SIZE)
+                _background_pool_pid=os.getpid()
+    return _background_pool
+
+def get_background_pool_stats():
+    return get_background_pool().get_stats()
+
+#---Read replicas---
+# Read-only request queries (history, dashboard, reports, exports) go through get_read_db(),
+# which hands out a replica connection when DATABASE_REPLICA_URLS lists any, else the primary.
+#
+# Read-your-writes: a request that commits on the primary records the time in the user's
+# session (and with DB_REPLICA_GTID=1 the primary's executed GTID set). For DB_REPLICA_STICKY
+# seconds afterwards that user's reads stay on the primary, unless a replica has already
+# applied that GTID set. Writes made outside the web app (bot, CLI) are not tracked here;
+# cache.py won't cache replica reads made shortly after them.
+class Replica:
+    def __init__(self, name, pool):
+        self.name=name  # host:port, never the password
+        self.pool=pool
+        self.down_until=0.0
+        self.stats={'reads': 0, 'failures': 0, 'behind': 0}
+
+    def in_use(self):
+        stats=self.pool.get_stats()
+        return stats['in_use']
+
+class ReplicaSet:
+    """
+    Health-based balancing: a replica that fails to hand out a connection is skipped for
+    'retry' seconds, and among the others the one with the fewest connections checked
+    out serves the next read (ties at random). Replicas with a full pool are skipped
+    rather than waited for, so a saturated replica sends reads back to the primary.
+    """
+    def __init__(self, replicas, retry=DB_REPLICA_RETRY):
+        self.replicas=replicas
+        self.retry=retry
+        self._lock=threading.Lock()
+
+    def _candidates(self):
+        now=time.monotonic()
+        loads=[(replica.in_use(), random.random(), replica) for replica in self.replicas if replica.down_until <= now]
+        return [replica for in_use, _, replica in sorted(loads, key=lambda load: load[:2]) if in_use < replica.pool.size]
+
+    def mark_down(self, replica, error):
+        print(f"Replica Error: {replica.name}: {error}")
+        with self._lock:
+            replica.down_until=time.monotonic() + self.retry
+            replica.stats['failures'] += 1
+
+    def choose(self):
+        """The replica for the next read, without checking out a connection (None if all are down or busy)."""
+        candidates=self._candidates()
+        return candidates[0] if candidates else None
+
+    def acquire(self, gtid=None):
+        """
+        Returns (replica, connection) from the best replica that has applied 'gtid'
+        (any replica if gtid is None), or (None, None) if none can serve the read.
+        """
+        for replica in self._candidates():
+            try:
+                conn=replica.pool.acquire()
+            except Exception as e:
+                self.mark_down(replica, e)
+                continue
+            if gtid is not None and not _has_applied(conn, gtid):
+                replica.pool.release(conn)
+                with self._lock:
+                    replica.stats['behind'] += 1
+                continue
+            with self._lock:
+                replica.stats['reads'] += 1
+            return replica, conn
+        return None, None
+
+    def get_stats(self):
+        now=time.monotonic()
+        stats={}
+        for replica in self.replicas:
+            with self._lock:
+                values=dict(replica.stats)
+            values.update(replica.pool.get_stats())
+            values['down']=int(replica.down_until > now)
+            stats[replica.name]=values
+        return stats
+
+def _gtid_executed(conn):
+    cursor=conn.cursor()
+    cursor.execute("SELECT @@GLOBAL.gtid_executed")
+    row=cursor.fetchone()
+    cursor.close()
+    return row[0] if row else None
+
+def _has_applied(conn, gtid):
+    """True if the server behind conn has executed every transaction in the GTID set."""
     try:
-        conn=get_db_connection()
         cursor=conn.cursor()
-        #ACCOUNTS TABLE
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS accounts(
-                account_id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                account_name VARCHAR(100) NOT NULL,
-                account_type VARCHAR(50) NOT NULL,
-                current_balance DECIMAL(10, 2) DEFAULT 0.00,
-                FOREIGN KEY (user_id) REFERENCES  users(user_id)
-            );
-        """)
-        #CATEGORIES
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS categories (
-                category_id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                name VARCHAR(100) NOT NULL,
-                type VARCHAR(20) NOT NULL, -- e.g., 'Expense', 'Income'
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            );
-        """)
-        # 3. TRANSACTIONS Table: The main data table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transactions (
-                transaction_id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                account_id INT NOT NULL,
-                category_id INT NOT NULL,
-                amount DECIMAL(10, 2) NOT NULL,
-                transaction_date DATE NOT NULL,
-                note VARCHAR(255),
-                FOREIGN KEY (user_id) REFERENCES users(user_id),
-                FOREIGN KEY (account_id) REFERENCES accounts(account_id),
-                FOREIGN KEY (category_id) REFERENCES categories(category_id)
-            );
-        """)
-
-        conn.commit()
-        return True
-    except mysql.connector.Error as err:
-        print(f"Database Initialization Error: {err}")
+        cursor.execute("SELECT GTID_SUBSET(%s, @@GLOBAL.gtid_executed)", (gtid,))
+        row=cursor.fetchone()
+        cursor.close()
+        return bool(row and row[0])
+    except Exception:
         return False
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
-            
-def get_user_transactions(user_id):
-    """Fetches all transactions for a given user ID."""
+
+def _replica_name(db_url):
+    url=urlparse(db_url.split('?')[0])
+    return f"{url.hostname}:{url.port or 3306}"
+
+_replicas=None
+_replicas_pid=None
+
+def get_replicas():
+    """This process's ReplicaSet, or None when no replicas are configured."""
+    global _replicas, _replicas_pid
+    if not DB_REPLICA_URLS:
+        return _replicas  # None unless set_replicas() installed one
+    if _replicas is None or _replicas_pid != os.getpid():
+        with _pool_lock:
+            if _replicas is None or _replicas_pid != os.getpid():
+                _replicas=ReplicaSet([
+                    Replica(_replica_name(db_url), ConnectionPool(lambda db_url=db_url: get_db_connection(db_url)))
+                    for db_url in DB_REPLICA_URLS
+                ])
+                _replicas_pid=os.getpid()
+    return _replicas
+
+def set_replicas(replicas):
+    """Swaps this process's ReplicaSet (None turns read routing off), e.g. in benchmarks."""
+    global _replicas, _replicas_pid
+    with _pool_lock:
+        _replicas=replicas
+        _replicas_pid=os.getpid()
+
+def get_replica_stats():
+    replicas=get_replicas()
+    return replicas.get_stats() if replicas else {}
+
+def _read_your_writes():
+    """(may this request read from a replica?, GTID set the replica must have applied or None)"""
+    if g.get('db_wrote'):
+        return False, None
+    written_at=session.get('db_write_at')
+    if written_at is None or time.time() - written_at > DB_REPLICA_STICKY:
+        return True, None
+    gtid=session.get('db_gtid') if DB_REPLICA_GTID else None
+    return gtid is not None, gtid
+
+class _WriteTracker:
+    """The request's primary connection, noting commits so the user's next reads avoid stale replicas."""
+    def __init__(self, conn):
+        self.tracked=conn
+
+    def commit(self):
+        result=self.tracked.commit()
+        g.db_wrote=True
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.tracked, name)
+
+def mark_write():
+    """For writes committed after the response has started (e.g. streamed imports)."""
+    g.db_wrote=True
+
+def get_db():
+    """Returns the connection for the current request, checking one out on first use."""
+    if 'db' not in g:
+        with profiling.timed('db_connect'):
+            conn=get_pool().acquire()
+        # Times every query for /metrics and slow-request dumps (see profiling.py)
+        g.db=profiling.wrap_connection(conn)
+        if get_replicas() is not None:
+            g.db=_WriteTracker(g.db)
+    return g.db
+
+def get_read_db():
+    """
+    The connection for this request's read-only queries: a replica if one is healthy and
+    has this user's latest writes (see above), else the primary connection from get_db().
+    Never write through it.
+    """
+    if 'read_db' not in g:
+        replicas=get_replicas()
+        replica, conn=None, None
+        if replicas is not None:
+            use_replica, gtid=_read_your_writes()
+            if use_replica:
+                with profiling.timed('db_connect'):
+                    replica, conn=replicas.acquire(gtid)
+        if conn is None:
+            g.read_db=get_db()
+        else:
+            g.read_replica=replica
+            g.read_db=profiling.wrap_connection(conn)
+    return g.read_db
+
+def read_from_replica():
+    """True if this request's read-only queries went to a replica."""
+    return has_request_context() and 'read_replica' in g
+
+def start_read(start):
+    """
+    For a read streamed outside the request (exports): runs start(conn) on a connection chosen
+    like get_read_db()'s and returns (pool, conn, start's result). Run the query in start(), so
+    that a replica failing to connect or to answer is marked down and the read moves to the
+    primary before any response goes out. Give conn back to pool when done (pool.discard()
+    if it stopped halfway).
+    """
+    replicas=get_replicas()
+    if replicas is not None:
+        use_replica, gtid=_read_your_writes()
+        if use_replica:
+            replica, conn=replicas.acquire(gtid)
+            if conn is not None:
+                try:
+                    return replica.pool, conn, start(conn)
+                except Exception as e:
+                    replica.pool.discard(conn)
+                    replicas.mark_down(replica, e)
+    pool=get_pool()
+    conn=pool.acquire()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        # We join tables to get meaningful names instead of just IDs
-        query = """
-        SELECT t.*, a.account_name, c.name AS category_name, c.type AS category_type
-        FROM transactions t
-        JOIN accounts a ON t.account_id = a.account_id
-        JOIN categories c ON t.category_id = c.category_id
-        WHERE t.user_id = %s
-        ORDER BY t.transaction_date DESC;
-        """
-        cursor.execute(query, (user_id,))
-        transactions = cursor.fetchall()
-        return transactions
-    except Exception as e:
-        print(f"Error fetching transactions: {e}")
-        return []
-    finally:
-        if conn and conn.is_connected():
-            conn.close()            
+        return pool, conn, start(conn)
+    except Exception:
+        pool.discard(conn)
+        raise
+
+def _remember_write(response):
+    # Runs before the session cookie is written, while the primary connection is still checked out
+    if g.get('db_wrote'):
+        session['db_write_at']=time.time()
+        if DB_REPLICA_GTID and 'db' in g:
+            try:
+                session['db_gtid']=_gtid_executed(g.db)
+            except Exception as e:
+                print(f"GTID Error: {e}")
+                session.pop('db_gtid', None)
+    return response
+
+def close_db(e=None):
+    """Returns the request's connections to their pools (registered as a teardown handler)."""
+    read_conn=g.pop('read_db', None)
+    replica=g.pop('read_replica', None)
+    if replica is not None:
+        replica.pool.release(profiling.unwrap_connection(read_conn))
+    conn=g.pop('db', None)
+    if conn is not None:
+        if isinstance(conn, _WriteTracker):
+            conn=conn.tracked
+        get_pool().release(profiling.unwrap_connection(conn))
+
+def init_app(app):
+    app.after_request(_remember_write)
+    app.teardown_appcontext(close_db)
+
+def initialize_all_tables():
+    """Brings the schema up to the latest version (see migrations.py)."""
+    try:
+        return run_migrations(get_db())
+    except (mysql.connector.Error, RuntimeError) as err:
+        print(f"Database Initialization Error: {err}")
+        return None
+
+#---Request queries---
+# The SQL that app.py and this module run per request lives in these constants and query
+# builders, so that `python migrations.py check` EXPLAINs exactly what runs (see migrations.hot_queries()).
+ACCOUNTS_QUERY="SELECT * FROM accounts WHERE user_id = %s AND deleted_at IS NULL"
+CATEGORIES_QUERY="SELECT * FROM categories WHERE user_id = %s AND name!='Initial Balance' AND deleted_at IS NULL"
+ACCOUNT_OPTIONS_QUERY="SELECT account_id, account_name FROM accounts WHERE user_id = %s AND deleted_at IS NULL"
+CATEGORY_OPTIONS_QUERY="SELECT category_id, name FROM categories WHERE user_id = %s AND deleted_at IS NULL"
+USER_BY_ID_QUERY="SELECT user_id, username, default_currency FROM users WHERE user_id = %s"
+USER_BY_USERNAME_QUERY="SELECT * FROM users WHERE username = %s"
+INITIAL_BALANCE_CATEGORY_QUERY="SELECT category_id FROM categories WHERE user_id = %s AND name = 'Initial Balance' AND deleted_at IS NULL"
+
+def get_accounts(cursor, user_id):
+    """The user's accounts (soft-deleted ones are hidden). Pass a dictionary cursor."""
+    cursor.execute(ACCOUNTS_QUERY, (user_id,))
+    return cursor.fetchall()
+
+def get_categories(cursor, user_id):
+    """The categories a user can pick (the internal 'Initial Balance' one and soft-deleted ones are hidden). Pass a dictionary cursor."""
+    cursor.execute(CATEGORIES_QUERY, (user_id,))
+    return cursor.fetchall()
+
+def user_totals_query(user_id, account_id=None):
+    """(sql, params) for get_user_totals()."""
+    query = """
+    SELECT r.account_id, a.currency, r.bucket,
+           SUM(IF(c.type = 'Income', r.total, 0)) AS income,
+           SUM(IF(c.type = 'Income', 0, r.total)) AS expense
+    FROM rollup_monthly r
+    JOIN accounts a ON r.account_id = a.account_id
+    JOIN categories c ON r.category_id = c.category_id
+    WHERE r.user_id = %s AND a.deleted_at IS NULL AND c.deleted_at IS NULL
+    """
+    params = [user_id]
+    if account_id is not None:
+        query += " AND r.account_id = %s"
+        params.append(account_id)
+    query += " GROUP BY r.account_id, a.currency, r.bucket"
+    return query, tuple(params)
+
+def get_user_totals(user_id, account_id=None):
+    """
+    Returns income and expense per account and month, e.g.
+    [{'account_id': 1, 'currency': 'USD', 'bucket': date(2024, 5, 1), 'income': Decimal('900.00'), 'expense': Decimal('120.50')}, ...]
+    (months let the dashboard convert at historical rates). Reads the monthly rollups
+    (see rollups.py), so the cost depends on accounts x categories x months, not on the number of transactions.
+    Errors propagate: the result is cached (see cache.py), and an empty list would read as a zero balance.
+    """
+    conn = get_read_db()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(*user_totals_query(user_id, account_id))
+    return cursor.fetchall()
+
+#---Keyset pagination for transaction history---
+def encode_cursor(transaction_date, transaction_id):
+    raw=f"{transaction_date.isoformat()}|{transaction_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor_token):
+    """Returns (transaction_date, transaction_id) or raises ValueError for a malformed token."""
+    try:
+        raw=base64.urlsafe_b64decode(cursor_token.encode()).decode()
+        date_part, id_part=raw.split('|')
+        return datetime.date.fromisoformat(date_part), int(id_part)
+    except Exception:
+        raise ValueError("Invalid pagination cursor.")
+
+def _history_filters(user_id, filters):
+    """WHERE clause (after the FROM/JOINs) and params shared by history pages and exports."""
+    filters=filters or {}
+    # Rows of a soft-deleted account or category stay hidden until the purge job removes them
+    where = " WHERE t.user_id = %s AND a.deleted_at IS NULL AND c.deleted_at IS NULL"
+    params=[user_id]
+
+    if filters.get('account_id'):
+        where += " AND t.account_id = %s"
+        params.append(filters['account_id'])
+    if filters.get('category_id'):
+        where += " AND t.category_id = %s"
+        params.append(filters['category_id'])
+    if filters.get('type'):
+        where += " AND c.type = %s"
+        params.append(filters['type'])
+    if filters.get('date_from'):
+        where += " AND t.transaction_date >= %s"
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        where += " AND t.transaction_date <= %s"
+        params.append(filters['date_to'])
+    if filters.get('q'):
+        where += " AND t.note LIKE %s"
+        params.append(f"%{filters['q']}%")
+    return where, params
+
+def transactions_page_query(user_id, filters=None, cursor_token=None, limit=PAGE_SIZE):
+    """(sql, params) for get_transactions_page(); raises ValueError for a malformed cursor."""
+    where, params=_history_filters(user_id, filters)
+    query = """
+    SELECT t.*, a.account_name, c.name AS category_name, c.type AS category_type
+    FROM transactions t
+    JOIN accounts a ON t.account_id = a.account_id
+    JOIN categories c ON t.category_id = c.category_id
+    """ + where
+
+    if cursor_token:
+        last_date, last_id=decode_cursor(cursor_token)
+        query += " AND (t.transaction_date < %s OR (t.transaction_date = %s AND t.transaction_id < %s))"
+        params.extend([last_date, last_date, last_id])
+
+    # Fetch one extra row to know whether another page exists
+    query += " ORDER BY t.transaction_date DESC, t.transaction_id DESC LIMIT %s"
+    params.append(limit + 1)
+    return query, tuple(params)
+
+def get_transactions_page(user_id, filters=None, cursor_token=None, limit=PAGE_SIZE):
+    """
+    Returns one page of a user's history, newest first:
+    {'transactions': [...], 'next_cursor': 'token or None'}
+    Seeks past the last (transaction_date, transaction_id) seen instead of using OFFSET,
+    so page 1000 costs the same as page 1.
+    Supported filters: account_id, category_id, type, date_from, date_to, q (note search).
+    """
+    query, params=transactions_page_query(user_id, filters, cursor_token, limit)
+    conn = get_read_db()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    next_cursor=None
+    if len(rows) > limit:
+        rows=rows[:limit]
+        next_cursor=encode_cursor(rows[-1]['transaction_date'], rows[-1]['transaction_id'])
+    return {'transactions': rows, 'next_cursor': next_cursor}
+
+#---Streaming export---
+EXPORT_COLUMNS = ['transaction_id', 'transaction_date', 'account_name', 'currency', 'category_name', 'category_type', 'amount', 'note']
+
+def export_query(user_id, filters=None):
+    """(sql, params) for iter_transactions()."""
+    where, params=_history_filters(user_id, filters)
+    query = """
+    SELECT t.transaction_id, t.transaction_date, a.account_name, a.currency,
+           c.name AS category_name, c.type AS category_type, t.amount, t.note
+    FROM transactions t
+    JOIN accounts a ON t.account_id = a.account_id
+    JOIN categories c ON t.category_id = c.category_id
+    """ + where + " ORDER BY t.transaction_date, t.transaction_id"
+    return query, tuple(params)
+
+def iter_transactions(conn, user_id, filters=None, chunk_size=1000):
+    """
+    Yields lists of up to chunk_size rows, oldest first, straight off the wire.
+    Uses an unbuffered cursor, so only one chunk is ever held in memory.
+    The connection can't run other queries until the generator is exhausted.
+    """
+    cursor = conn.cursor(buffered=False)
+    cursor.execute(*export_query(user_id, filters))
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+    cursor.close()
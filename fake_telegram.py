@@ -0,0 +1,226 @@
+#---Local Fake Telegram Bot API---
+# Just enough of getUpdates/sendMessage to run bot.py without Telegram, for development
+# and load tests. Messages are injected over HTTP and the bot's replies are recorded.
+# Usage:
+#   python fake_telegram.py [port]      -> serve on 127.0.0.1:8081 (point TELEGRAM_API_URL here)
+#     curl -H 'Content-Type: application/json' -d '{"chat_id": 1, "text": "/help"}' http://127.0.0.1:8081/fake/send
+#     curl 'http://127.0.0.1:8081/fake/replies?chat_id=1'
+#   python fake_telegram.py load 5000   -> 5000 chats talk to an in-process bot; prints timings
+#
+# The load run uses a throwaway SQLite stand-in database (see mysql_standin.py) with one user
+# per chat. Every chat sends /help, links itself with /start CODE, adds an expense and asks
+# for /balance; the replies and what landed in the database are checked, and the run exits
+# non-zero if anything is off.
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from aiohttp import web
+
+
+class FakeTelegramAPI:
+    def __init__(self, reply_latency=0.0):
+        self.reply_latency=reply_latency  # simulated round trip for each sendMessage
+        self.updates=[]
+        self.replies=defaultdict(list)  # chat_id -> [text, ...]
+        self.reply_count=0
+        self._next_id=1
+        self._changed=asyncio.Condition()
+        self.app=web.Application()
+        self.app.add_routes([
+            web.post('/bot{token}/getUpdates', self._get_updates),
+            web.post('/bot{token}/sendMessage', self._send_message),
+            web.post('/fake/send', self._inject),
+            web.get('/fake/replies', self._replies),
+        ])
+
+    async def send(self, chat_id, text):
+        """A user in chat 'chat_id' writes 'text' to the bot."""
+        async with self._changed:
+            self.updates.append({'update_id': self._next_id,
+                                 'message': {'message_id': self._next_id, 'chat': {'id': chat_id}, 'text': text}})
+            self._next_id += 1
+            self._changed.notify_all()
+
+    async def wait_for_replies(self, count):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.reply_count >= count)
+
+    async def _get_updates(self, request):
+        params=await request.json()
+        offset=params.get('offset', 0)
+        async with self._changed:
+            # Like Telegram: an offset confirms (and drops) everything before it
+            self.updates=[u for u in self.updates if u['update_id'] >= offset]
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self.updates), params.get('timeout', 0))
+            except asyncio.TimeoutError:
+                pass
+            batch=self.updates[:100]
+        return web.json_response({'ok': True, 'result': batch})
+
+    async def _send_message(self, request):
+        params=await request.json()
+        if self.reply_latency:
+            await asyncio.sleep(self.reply_latency)
+        async with self._changed:
+            self.replies[params['chat_id']].append(params['text'])
+            self.reply_count += 1
+            self._changed.notify_all()
+        return web.json_response({'ok': True, 'result': {'message_id': self.reply_count}})
+
+    async def _inject(self, request):
+        params=await request.json()
+        await self.send(int(params['chat_id']), params['text'])
+        return web.json_response({'ok': True})
+
+    async def _replies(self, request):
+        return web.json_response(self.replies.get(int(request.query['chat_id']), []))
+
+
+async def serve(port):
+    fake=FakeTelegramAPI()
+    runner=web.AppRunner(fake.app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    print(f"Fake Telegram API on http://127.0.0.1:{port}")
+    await asyncio.Event().wait()
+
+def _setup_database(chats):
+    """A stand-in database with one user per chat (default accounts, Bank in USD) and a link code each."""
+    import database
+    import mysql_standin
+    import provisioning
+    import rates
+    path=os.path.join(tempfile.mkdtemp(prefix="expense_fake_telegram_"), "bot.db")
+    mysql_standin.create_schema(path)
+    database.set_pool(database.ConnectionPool(mysql_standin.connection_factory(path)))
+    rates.set_provider(rates.StaticRateProvider({'EUR': {'TRY': 35.2, 'USD': 1.08}}))
+
+    conn=database.get_pool().acquire()
+    cursor=conn.cursor()
+    expires=datetime.datetime.now() + datetime.timedelta(minutes=10)
+    for chat_id in range(1, chats + 1):
+        cursor.execute("INSERT INTO users (username, password_hash, default_currency) VALUES (%s, %s, 'TRY')",
+                       (f"chat{chat_id}", "not-a-real-hash"))
+        user_id=cursor.lastrowid
+        provisioning.seed_user(cursor, user_id)
+        cursor.execute("UPDATE accounts SET currency = 'USD' WHERE user_id = %s AND account_name = 'Bank'", (user_id,))
+        cursor.execute("INSERT INTO telegram_link_codes (code, user_id, expires_at) VALUES (%s, %s, %s)",
+                       (_code(chat_id), user_id, expires))
+    conn.commit()
+    database.get_pool().release(conn)
+    return path
+
+def _code(chat_id):
+    return f"C{chat_id:07d}"
+
+def _check_database(chats):
+    """What the conversation should have written. Returns a list of problems."""
+    import database
+    conn=database.get_pool().acquire()
+    cursor=conn.cursor()
+    problems=[]
+    cursor.execute("""
+        SELECT u.username, tc.chat_id FROM users u LEFT JOIN telegram_chats tc ON tc.user_id = u.user_id
+    """)
+    linked={username: chat_id for username, chat_id in cursor.fetchall()}
+    wrong=[name for name, chat_id in linked.items() if name != f"chat{chat_id}"]
+    if wrong:
+        problems.append(f"{len(wrong)} users linked to the wrong chat or none, e.g. {wrong[0]}")
+    cursor.execute("SELECT COUNT(*) FROM telegram_link_codes")
+    if cursor.fetchone()[0]:
+        problems.append("link codes were not used up")
+    cursor.execute("""
+        SELECT COUNT(*) FROM transactions t
+        JOIN accounts a ON a.account_id = t.account_id
+        JOIN categories c ON c.category_id = t.category_id
+        WHERE a.account_name = 'Cash' AND c.name = 'Food' AND t.amount = 12.5 AND t.note = 'lunch'
+    """)
+    added=cursor.fetchone()[0]
+    if added != chats:
+        problems.append(f"{added} transactions stored for {chats} chats")
+    cursor.execute("SELECT current_balance FROM accounts WHERE account_name = 'Cash'")
+    balances=[Decimal(str(row[0])) for row in cursor.fetchall()]
+    if any(balance != Decimal('-12.50') for balance in balances):
+        problems.append(f"Cash balances off: {sorted(set(balances))[:5]}")
+    database.get_pool().release(conn)
+    return problems
+
+def _check_replies(fake, chat_id, expected):
+    """Compares a chat's replies with (prefix, text that must appear) pairs, in order."""
+    replies=fake.replies.get(chat_id, [])
+    if len(replies) != len(expected):
+        return [f"chat {chat_id}: {len(replies)} replies, expected {len(expected)}: {replies}"]
+    return [f"chat {chat_id}: {reply!r} does not start with {prefix!r} or lacks {part!r}"
+            for reply, (prefix, part) in zip(replies, expected)
+            if not reply.startswith(prefix) or part not in reply]
+
+async def load(chats, reply_latency=0.05):
+    """
+    Every chat sends the same message at once, one step at a time, and each step is timed:
+    /help (no DB), /start CODE, '12.50 Food @Cash lunch', /balance. Then checks the replies
+    and the database. Returns the problems found (an empty list if all is well).
+    """
+    import bot
+    path=_setup_database(chats)
+    fake=FakeTelegramAPI(reply_latency=reply_latency)
+    runner=web.AppRunner(fake.app)
+    await runner.setup()
+    site=web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port=site._server.sockets[0].getsockname()[1]
+
+    steps=[
+        ('help', lambda chat_id: '/help'),
+        ('link', lambda chat_id: f"/start {_code(chat_id).lower()}"),
+        ('add', lambda chat_id: '12.50 Food @Cash lunch'),
+        ('balance', lambda chat_id: '/balance'),
+    ]
+    async with bot.TelegramClient('test', base_url=f"http://127.0.0.1:{port}") as client:
+        service=bot.Bot(client)
+        task=asyncio.create_task(service.run())
+        for number, (name, message) in enumerate(steps, start=1):
+            start=time.perf_counter()
+            for chat_id in range(1, chats + 1):
+                await fake.send(chat_id, message(chat_id))
+            await fake.wait_for_replies(chats * number)
+            elapsed=time.perf_counter() - start
+            print(f"{name:>8}: {chats} chats answered in {elapsed:.2f}s ({chats / elapsed:,.0f}/s)")
+        # A chat nobody linked must not reach anyone's data
+        await fake.send(chats + 1, '12.50 Food')
+        await fake.wait_for_replies(chats * len(steps) + 1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    await runner.cleanup()
+    print(f"{reply_latency * 1000:.0f} ms per reply; stats: {service.stats}; database: {path}")
+
+    problems=[]
+    for chat_id in range(1, chats + 1):
+        problems += _check_replies(fake, chat_id, [
+            ('Add a transaction', '/balance'),
+            ('✅ Chat linked.', ''),
+            ('✅ Expense: 12.50 TRY (Food) on Cash', ''),
+            ('Cash: -12.5', 'Total: '),
+        ])
+    problems += _check_replies(fake, chats + 1, [(bot.NOT_LINKED, '')])
+    problems += _check_database(chats)
+    if service.stats['errors']:
+        problems.append(f"{service.stats['errors']} updates failed")
+    return problems
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'load':
+        problems=asyncio.run(load(int(sys.argv[2]) if len(sys.argv) > 2 else 1000))
+        for problem in problems[:20]:
+            print(f"❌ {problem}")
+        if problems:
+            sys.exit(1)
+        print("✅ Replies and database as expected.")
+    else:
+        asyncio.run(serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8081))
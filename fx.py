@@ -0,0 +1,116 @@
+#---Currency Conversion Engine---
+# One rate table, fetched relative to FX_BASE, gives every cross rate:
+#   1 X = per_base[Y] / per_base[X] Y
+# so any currency converts into any other from a single cached fetch (see rates.py).
+#
+# Amounts stay Decimal end to end, like the DECIMAL columns they come from, and are
+# rounded to cents once per result. Batch calls group amounts by currency before
+# converting, so the number of multiplications follows the number of currencies.
+import os
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+import rates
+
+FX_BASE=os.getenv("FX_BASE", "EUR")  # Frankfurter publishes everything against EUR
+CENT=Decimal('0.01')
+
+
+class RateMatrix:
+    """Every cross rate between the currencies of one rate table, precomputed as Decimals."""
+    def __init__(self, base, rates_dict):
+        """rates_dict is the provider's format: units of each currency per 1 'base'."""
+        self.base=base
+        per_base={currency: Decimal(str(rate)) for currency, rate in rates_dict.items() if rate}
+        per_base[base]=Decimal(1)
+        self.currencies=sorted(per_base)
+        self._matrix={
+            source: {target: per_base[target] / per_base[source] for target in self.currencies}
+            for source in self.currencies
+        }
+
+    def rate(self, source, target):
+        """How many 'target' one 'source' buys, or None if either currency is unknown."""
+        return self._matrix.get(source, {}).get(target)
+
+    def rates_for(self, base):
+        """This table re-based on 'base', in the provider's float format (for analytics.convert)."""
+        row=self._matrix.get(base)
+        if row is None:
+            return {base: 1.0}
+        return {currency: float(rate) for currency, rate in row.items()}
+
+    def convert(self, amount, source, target):
+        """Converts one amount. Unknown currencies are left unconverted, as before."""
+        rate=self.rate(source, target)
+        amount=Decimal(amount)
+        if rate is None:
+            return amount
+        return (amount * rate).quantize(CENT, rounding=ROUND_HALF_UP)
+
+    def convert_many(self, amounts, currencies, target):
+        """Converts parallel sequences of amounts and currency codes; one rate lookup per currency."""
+        factors={}
+        converted=[]
+        for amount, currency in zip(amounts, currencies):
+            if currency not in factors:
+                factors[currency]=self.rate(currency, target)
+            rate=factors[currency]
+            amount=Decimal(amount)
+            converted.append(amount if rate is None else (amount * rate).quantize(CENT, rounding=ROUND_HALF_UP))
+        return converted
+
+    def convert_total(self, pairs, target):
+        """
+        Sum of (amount, currency) pairs in 'target'. Amounts are added up exactly per currency
+        first, then each subtotal is converted once.
+        """
+        subtotals=defaultdict(Decimal)
+        for amount, currency in pairs:
+            subtotals[currency] += Decimal(amount)
+        total=Decimal(0)
+        for currency, subtotal in subtotals.items():
+            rate=self.rate(currency, target)
+            total += subtotal if rate is None else subtotal * rate
+        return total.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def convert_dated(rows, target, matrix_for):
+    """
+    Converts (amount, currency, transaction_date) rows at each date's rates.
+    matrix_for(date) -> RateMatrix is called once per distinct date, and each
+    (date, currency) rate is looked up once. Returns the converted amounts in row order.
+    """
+    matrices={}
+    factors={}
+    converted=[]
+    for amount, currency, on_date in rows:
+        key=(on_date, currency)
+        if key not in factors:
+            if on_date not in matrices:
+                matrices[on_date]=matrix_for(on_date)
+            factors[key]=matrices[on_date].rate(currency, target)
+        rate=factors[key]
+        amount=Decimal(amount)
+        converted.append(amount if rate is None else (amount * rate).quantize(CENT, rounding=ROUND_HALF_UP))
+    return converted
+
+
+_latest=None  # (rate table, RateMatrix built from it)
+
+def matrix_from(rates_dict, base=FX_BASE):
+    """Builds the matrix for a rate table, reusing the last one while the cache returns the same table."""
+    global _latest
+    latest=_latest
+    if latest is not None and latest[0] is rates_dict:
+        return latest[1]
+    matrix=RateMatrix(base, rates_dict)
+    _latest=(rates_dict, matrix)
+    return matrix
+
+def get_matrix():
+    """Today's cross rates, from the cached FX_BASE table (usually no network call)."""
+    return matrix_from(rates.get_rates(FX_BASE))
+
+async def get_matrix_async():
+    return matrix_from(await rates.get_rates_async(FX_BASE))
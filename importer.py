@@ -0,0 +1,285 @@
+#---Bulk Transaction Import (CSV / OFX bank statements)---
+# Usage:
+#   python importer.py USER_ID statement.csv [--account ACCOUNT_ID]
+#   python importer.py USER_ID statement.ofx --account ACCOUNT_ID
+#
+# Files are read row by row and written in executemany() batches, one DB transaction
+# per batch, so memory stays flat no matter how big the file is.
+# Every row gets an import_hash; rows already imported are skipped, so re-running an
+# import is safe. Identical rows (two coffees on one day) are told apart by numbering them
+# within their run of same-date rows; apart from that count, the importer keeps one small
+# entry per distinct date, so files that aren't date ordered don't grow memory per row either.
+import argparse
+import csv
+import datetime
+import hashlib
+import io
+from decimal import Decimal, InvalidOperation
+
+import cache
+import ledger
+
+BATCH_SIZE = 1000
+
+# CSV header aliases (lower case) -> our field names
+CSV_COLUMNS = {
+    'date': 'date', 'transaction_date': 'date', 'booking date': 'date',
+    'amount': 'amount', 'value': 'amount',
+    'account': 'account', 'account_name': 'account',
+    'category': 'category', 'category_name': 'category',
+    'type': 'type',
+    'note': 'note', 'description': 'note', 'memo': 'note',
+}
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%Y%m%d')
+
+
+class RowError(ValueError):
+    pass
+
+
+def parse_date(value):
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise RowError(f"Unrecognised date '{value}'")
+
+def parse_amount(value):
+    try:
+        return Decimal(value.strip().replace(',', '.')).quantize(Decimal('0.01'))
+    except (InvalidOperation, AttributeError):
+        raise RowError(f"Invalid amount '{value}'")
+
+#---Parsers: each yields (line_number, row_dict) one at a time---
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    for line_number, raw in enumerate(reader, start=2):
+        row = {}
+        for key, value in raw.items():
+            field = CSV_COLUMNS.get((key or '').strip().lower())
+            if field:
+                row[field] = (value or '').strip()
+        yield line_number, row
+
+def read_ofx(stream):
+    """
+    Minimal streaming OFX/QFX reader: collects the tags of one <STMTTRN> block at a time.
+    Works for both SGML (unclosed tags) and XML flavoured files.
+    """
+    current = None
+    for line_number, line in enumerate(stream, start=1):
+        for chunk in line.replace('<', '\n<').replace('>', '>\n').splitlines():
+            chunk = chunk.strip()
+            if not chunk.startswith('<'):
+                # Text after an SGML tag on the previous chunk
+                if current is not None and current.get('_open') and chunk:
+                    current[current.pop('_open')] = chunk
+                continue
+            tag = chunk[1:-1].upper()
+            if tag == 'STMTTRN':
+                current = {'_line': line_number}
+            elif tag == '/STMTTRN' and current is not None:
+                current.pop('_open', None)
+                yield current.pop('_line'), {
+                    'date': current.get('DTPOSTED', '')[:8],
+                    'amount': current.get('TRNAMT', ''),
+                    'note': current.get('NAME') or current.get('MEMO', ''),
+                    'external_id': current.get('FITID', ''),
+                }
+                current = None
+            elif current is not None and not tag.startswith('/'):
+                current['_open'] = tag
+
+
+class Importer:
+    """Maps parsed rows onto one user's accounts/categories and writes them in batches."""
+    def __init__(self, conn, user_id, default_account_id=None, batch_size=BATCH_SIZE):
+        self.conn = conn
+        self.user_id = user_id
+        self.default_account_id = default_account_id
+        self.batch_size = batch_size
+        self.cursor = conn.cursor(buffered=True)
+        self.accounts = {}
+        self.categories = {}
+        self.stats = {'rows': 0, 'inserted': 0, 'duplicates': 0, 'errors': 0}
+        self._occurrences = {}  # row -> repeats so far, for the current run of same-date rows only
+        self._occurrence_date = None
+        self._runs = {}  # date -> runs of rows with that date so far (more than one if the file isn't date ordered)
+        self._uncommitted_categories = []  # keys created in the open DB transaction
+        self._load_lookups()
+
+    def _load_lookups(self):
+        # One query each; every row afterwards is a dict lookup
+        self.cursor.execute("SELECT account_id, account_name FROM accounts WHERE user_id = %s AND deleted_at IS NULL", (self.user_id,))
+        for account_id, name in self.cursor.fetchall():
+            self.accounts[name.lower()] = account_id
+        self.cursor.execute("SELECT category_id, name, type FROM categories WHERE user_id = %s AND deleted_at IS NULL", (self.user_id,))
+        for category_id, name, cat_type in self.cursor.fetchall():
+            self.categories[(name.lower(), cat_type)] = category_id
+        if self.default_account_id is not None and self.default_account_id not in self.accounts.values():
+            raise ValueError("Default account does not belong to this user.")
+
+    def _account_id(self, row):
+        name = row.get('account')
+        if name:
+            if name.lower() not in self.accounts:
+                raise RowError(f"Unknown account '{name}'")
+            return self.accounts[name.lower()]
+        if self.default_account_id is None:
+            raise RowError("No account column and no default account given")
+        return self.default_account_id
+
+    def _category_id(self, name, cat_type):
+        key = (name.lower(), cat_type)
+        if key not in self.categories:
+            # New categories are created on the fly, like the 'Initial Balance' one
+            self.cursor.execute("INSERT INTO categories (user_id, name, type) VALUES (%s, %s, %s)", (self.user_id, name, cat_type))
+            self.categories[key] = self.cursor.lastrowid
+            self._uncommitted_categories.append(key)
+        return self.categories[key]
+
+    def _commit(self):
+        self.conn.commit()
+        self._uncommitted_categories = []
+
+    def _rollback(self):
+        """Rolls back, forgetting the categories the rollback removed so later rows recreate them."""
+        self.conn.rollback()
+        for key in self._uncommitted_categories:
+            self.categories.pop(key, None)
+        self._uncommitted_categories = []
+
+    def _import_hash(self, account_id, date, amount, cat_type, note, external_id):
+        if external_id:
+            key = f"{account_id}|ofx|{external_id}"
+        else:
+            # Two identical coffees on the same day are two transactions: number the repeats.
+            # Statements are date ordered, so only the current day's counters are kept. If a
+            # date comes back after others, its new run is numbered separately (and the same
+            # way on every re-import), so its repeats aren't mistaken for the earlier run's.
+            if date != self._occurrence_date:
+                self._occurrences = {}
+                self._occurrence_date = date
+                self._runs[date] = self._runs.get(date, 0) + 1
+            base = f"{account_id}|{date}|{amount}|{cat_type}|{note}"
+            occurrence = self._occurrences.get(base, 0)
+            self._occurrences[base] = occurrence + 1
+            run = self._runs[date] - 1
+            # The first run keeps the original key, so date-ordered files hash as they always have
+            key = f"{base}|{occurrence}" if run == 0 else f"{base}|{occurrence}|run{run}"
+        return hashlib.sha1(f"{self.user_id}|{key}".encode()).hexdigest()
+
+    def normalize(self, row):
+        """Turns a parsed row into an insert tuple, raising RowError if it can't."""
+        date = parse_date(row.get('date', ''))
+        amount = parse_amount(row.get('amount', ''))
+        cat_type = row.get('type', '').capitalize()
+        if cat_type not in ('Income', 'Expense'):
+            cat_type = 'Expense' if amount < 0 else 'Income'
+        amount = abs(amount)
+        if amount == 0:
+            raise RowError("Amount is zero")
+        account_id = self._account_id(row)
+        category_name = row.get('category') or ('Imported Income' if cat_type == 'Income' else 'Imported')
+        category_id = self._category_id(category_name, cat_type)
+        note = (row.get('note') or '')[:255]
+        import_hash = self._import_hash(account_id, date, amount, cat_type, note, row.get('external_id'))
+        return (self.user_id, account_id, category_id, amount, date, note, import_hash)
+
+    def _flush(self, batch):
+        """Writes one batch in its own DB transaction, skipping rows imported before."""
+        hashes = list(dict.fromkeys(r[-1] for r in batch))
+        placeholders = ", ".join(["%s"] * len(hashes))
+        self.cursor.execute(f"SELECT import_hash FROM transactions WHERE user_id = %s AND import_hash IN ({placeholders})",
+                            (self.user_id, *hashes))
+        existing = {r[0] for r in self.cursor.fetchall()}
+        fresh = []
+        for r in batch:
+            if r[-1] not in existing:
+                existing.add(r[-1])  # also drops repeats inside the file (same OFX FITID twice)
+                fresh.append(r)
+        inserted = 0
+        try:
+            if fresh:
+                self.cursor.executemany("""
+                    INSERT IGNORE INTO transactions (user_id, account_id, category_id, amount, transaction_date, note, import_hash)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, fresh)
+                # A concurrent import of the same file may have won some of these rows, and they
+                # are already in its balances: apply only ours. This is a consistent read in the
+                # snapshot the duplicate check above opened, so it sees this transaction's inserts
+                # but no row committed since, i.e. exactly the rows INSERT IGNORE kept.
+                new_hashes = [r[-1] for r in fresh]
+                placeholders = ", ".join(["%s"] * len(new_hashes))
+                self.cursor.execute(f"SELECT transaction_id FROM transactions WHERE user_id = %s AND import_hash IN ({placeholders})",
+                                    (self.user_id, *new_hashes))
+                ids = [r[0] for r in self.cursor.fetchall()]
+                inserted = len(ids)
+                if ids:
+                    placeholders = ", ".join(["%s"] * len(ids))
+                    ledger.apply_where(self.cursor, f"t.transaction_id IN ({placeholders})", ids)
+            self._commit()
+        except Exception:
+            self._rollback()
+            raise
+        self.stats['inserted'] += inserted
+        self.stats['duplicates'] += len(batch) - inserted
+
+    def run(self, rows):
+        """
+        Consumes (line_number, row) pairs and yields a progress dict after each batch.
+        Per-row problems are counted and reported, not fatal.
+        """
+        batch = []
+        for line_number, row in rows:
+            self.stats['rows'] += 1
+            try:
+                batch.append(self.normalize(row))
+            except RowError as e:
+                self.stats['errors'] += 1
+                yield {'line': line_number, 'error': str(e)}
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+                yield dict(self.stats)
+        if batch:
+            self._flush(batch)
+        else:
+            # Categories created for rows that all turned out invalid
+            self._commit()
+        yield dict(self.stats, done=True)
+
+
+def detect_format(filename):
+    return 'ofx' if filename.lower().endswith(('.ofx', '.qfx')) else 'csv'
+
+def import_file(conn, user_id, stream, file_format, default_account_id=None):
+    """Generator of progress events for a binary file stream."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    rows = read_ofx(text) if file_format == 'ofx' else read_csv(text)
+    return Importer(conn, user_id, default_account_id).run(rows)
+
+if __name__ == '__main__':
+    from database import get_db_connection
+    parser = argparse.ArgumentParser(description="Import a CSV or OFX statement for one user.")
+    parser.add_argument('user_id', type=int)
+    parser.add_argument('path')
+    parser.add_argument('--account', type=int, help="account_id for files without an account column")
+    parser.add_argument('--format', choices=['csv', 'ofx'])
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        with open(args.path, 'rb') as f:
+            for event in import_file(conn, args.user_id, f, args.format or detect_format(args.path), args.account):
+                if 'error' in event:
+                    print(f"Line {event['line']}: {event['error']}")
+                else:
+                    print(f"{event['rows']} rows read, {event['inserted']} inserted, "
+                          f"{event['duplicates']} duplicates, {event['errors']} errors")
+    finally:
+        # The web workers' caches follow users.cache_version, so they see the import within CACHE_VERSION_TTL
+        cache.invalidate_user(args.user_id, conn)
+        conn.close()
@@ -0,0 +1,293 @@
+#---Background Jobs---
+# Slow cleanup runs outside requests, from the background_jobs table. A route does the
+# cheap part right away (delete_account() soft-deletes the account and takes it out of the
+# stored totals), enqueues a job and returns. A worker then purges the transactions
+# JOB_BATCH_SIZE at a time, one short DB transaction per batch with a pause in between,
+# so no purge holds row locks for long or hogs the database.
+#
+# Jobs are resumable: progress is committed with every batch and every step is safe to
+# repeat. A running job holds a lease that each batch renews; if its worker dies, the
+# lease runs out and the next worker to look picks the job up where it stopped.
+#
+# Each web process runs a worker thread, woken by new jobs and checking for abandoned
+# ones every JOB_POLL_INTERVAL seconds (JOB_WORKER_THREAD=0 turns it off).
+# Usage:
+#   python jobs.py work     -> run a dedicated worker instead
+#   python jobs.py status   -> list unfinished jobs
+import datetime
+import os
+import sys
+import threading
+import time
+
+import database
+import ledger
+import rollups
+
+JOB_BATCH_SIZE=int(os.getenv("JOB_BATCH_SIZE", "500"))  # transactions deleted per DB transaction
+JOB_PAUSE=float(os.getenv("JOB_PAUSE", "0.05"))  # seconds between batches
+JOB_LEASE=float(os.getenv("JOB_LEASE", "60"))  # a running job not renewed for this long is taken over
+JOB_POLL_INTERVAL=float(os.getenv("JOB_POLL_INTERVAL", "30"))  # seconds between checks for abandoned jobs
+JOB_MAX_ATTEMPTS=int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_WORKER_THREAD=os.getenv("JOB_WORKER_THREAD", "1") == "1"
+
+# kind -> (transactions column, parent table, what else goes with the parent)
+PURGES = {
+    'purge_account': ('account_id', 'accounts', rollups.remove_account),
+    'purge_category': ('category_id', 'categories', rollups.remove_category),
+}
+
+
+#---Soft deletes (called by the routes, in the route's DB transaction)---
+def _soft_delete(cursor, table, column, user_id, target_id):
+    """Marks the row deleted. Returns its name, or None if it is not the user's or already gone."""
+    name_column='account_name' if table == 'accounts' else 'name'
+    cursor.execute(f"SELECT {name_column} FROM {table} WHERE {column} = %s AND user_id = %s AND deleted_at IS NULL FOR UPDATE",
+                   (target_id, user_id))
+    row=cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute(f"UPDATE {table} SET deleted_at = NOW() WHERE {column} = %s AND user_id = %s", (target_id, user_id))
+    return row[0]
+
+def delete_account(cursor, user_id, account_id):
+    """Hides the account and its transactions now and queues the purge. Returns False if there was nothing to delete."""
+    name=_soft_delete(cursor, 'accounts', 'account_id', user_id, account_id)
+    if name is None:
+        return False
+    ledger.remove_account(cursor, user_id, account_id)
+    enqueue(cursor, 'purge_account', user_id, account_id, name)
+    return True
+
+def delete_category(cursor, user_id, category_id):
+    """Hides the category, takes its transactions out of the balances and queues the purge."""
+    name=_soft_delete(cursor, 'categories', 'category_id', user_id, category_id)
+    if name is None:
+        return False
+    ledger.remove_category(cursor, user_id, category_id)
+    enqueue(cursor, 'purge_category', user_id, category_id, name)
+    return True
+
+def enqueue(cursor, kind, user_id, target_id, label=None):
+    """Adds a job. Does not commit: the job lands with the caller's changes. Call notify() after committing."""
+    cursor.execute("INSERT INTO background_jobs (kind, user_id, target_id, label) VALUES (%s, %s, %s, %s)",
+                   (kind, user_id, target_id, label))
+    return cursor.lastrowid
+
+def get_user_jobs(cursor, user_id):
+    """The user's unfinished jobs, for progress on the Settings page. Pass a dictionary cursor."""
+    cursor.execute("""
+        SELECT job_id, kind, label, status, processed, total
+        FROM background_jobs
+        WHERE user_id = %s AND status IN ('pending', 'running')
+        ORDER BY job_id
+    """, (user_id,))
+    return cursor.fetchall()
+
+
+#---Running jobs---
+def _lease():
+    return datetime.datetime.now() + datetime.timedelta(seconds=JOB_LEASE)
+
+CLAIM_QUERY = """
+    SELECT job_id FROM background_jobs
+    WHERE status = 'pending' OR (status = 'running' AND locked_until < %s)
+    ORDER BY job_id LIMIT 1
+"""
+PURGE_BATCH_QUERY="SELECT transaction_id FROM transactions WHERE user_id = %s AND {column} = %s LIMIT %s"
+
+def claim(conn):
+    """Takes the oldest pending or abandoned job. Returns it as a dict, or None if there is nothing to do."""
+    cursor=conn.cursor(dictionary=True)
+    try:
+        while True:
+            now=datetime.datetime.now()
+            cursor.execute(CLAIM_QUERY, (now,))
+            row=cursor.fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            # Whoever's UPDATE matches first owns the job; the others look again
+            cursor.execute("""
+                UPDATE background_jobs SET status = 'running', locked_until = %s, attempts = attempts + 1
+                WHERE job_id = %s AND (status = 'pending' OR (status = 'running' AND locked_until < %s))
+            """, (_lease(), row['job_id'], now))
+            claimed=cursor.rowcount == 1
+            conn.commit()
+            if claimed:
+                cursor.execute("SELECT * FROM background_jobs WHERE job_id = %s", (row['job_id'],))
+                return cursor.fetchone()
+    finally:
+        cursor.close()
+
+def _purge_batch(cursor, job, column, batch_size):
+    cursor.execute(PURGE_BATCH_QUERY.format(column=column), (job['user_id'], job['target_id'], batch_size))
+    ids=[row[0] for row in cursor.fetchall()]
+    if ids:
+        # By primary key, so the batch locks exactly these rows
+        placeholders=', '.join(['%s'] * len(ids))
+        cursor.execute(f"DELETE FROM transactions WHERE transaction_id IN ({placeholders})", tuple(ids))
+    return len(ids)
+
+def run_purge(conn, job, batch_size=JOB_BATCH_SIZE, pause=JOB_PAUSE):
+    """Deletes the parent's transactions batch by batch, then the parent itself. Returns the rows deleted."""
+    column, table, remove_buckets=PURGES[job['kind']]
+    cursor=conn.cursor()
+    try:
+        if job['total'] is None:
+            cursor.execute(f"SELECT COUNT(*) FROM transactions WHERE user_id = %s AND {column} = %s",
+                           (job['user_id'], job['target_id']))
+            job['total']=job['processed'] + cursor.fetchone()[0]
+            cursor.execute("UPDATE background_jobs SET total = %s WHERE job_id = %s", (job['total'], job['job_id']))
+            conn.commit()
+
+        deleted=0
+        while True:
+            count=_purge_batch(cursor, job, column, batch_size)
+            if not count:
+                break
+            deleted += count
+            job['processed'] += count
+            # Progress and a fresh lease commit with the batch
+            cursor.execute("UPDATE background_jobs SET processed = %s, locked_until = %s WHERE job_id = %s",
+                           (job['processed'], _lease(), job['job_id']))
+            conn.commit()
+            time.sleep(pause)
+
+        # Buckets again, in case a write slipped in between the soft delete and the purge
+        remove_buckets(cursor, job['user_id'], job['target_id'])
+        cursor.execute(f"DELETE FROM {table} WHERE {column} = %s AND user_id = %s AND deleted_at IS NOT NULL",
+                       (job['target_id'], job['user_id']))
+        cursor.execute("""
+            UPDATE background_jobs SET status = 'done', locked_until = NULL, finished_at = NOW()
+            WHERE job_id = %s
+        """, (job['job_id'],))
+        conn.commit()
+        return deleted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def _fail(conn, job, error):
+    """Puts the job back for another try, or gives up after JOB_MAX_ATTEMPTS."""
+    status='failed' if job['attempts'] >= JOB_MAX_ATTEMPTS else 'pending'
+    cursor=conn.cursor()
+    cursor.execute("UPDATE background_jobs SET status = %s, locked_until = NULL, last_error = %s WHERE job_id = %s",
+                   (status, str(error)[:255], job['job_id']))
+    conn.commit()
+    cursor.close()
+
+def run_pending(conn, batch_size=JOB_BATCH_SIZE, pause=JOB_PAUSE):
+    """Runs jobs until none are left. Returns how many finished."""
+    finished=0
+    while True:
+        job=claim(conn)
+        if job is None:
+            return finished
+        try:
+            run_purge(conn, job, batch_size, pause)
+            finished += 1
+        except Exception as e:
+            print(f"Job Error: {job['kind']} #{job['job_id']}: {e}")
+            _fail(conn, job, e)
+            if job['attempts'] < JOB_MAX_ATTEMPTS:
+                # Leave the retry to the next poll instead of spinning on it
+                return finished
+
+
+#---Per-process worker thread---
+class Worker:
+    """Runs jobs on a connection from the background pool, which it holds only while there is work."""
+    def __init__(self, poll_interval=JOB_POLL_INTERVAL):
+        self.poll_interval=poll_interval
+        self._wake=threading.Event()
+        self._stopped=threading.Event()
+        self.thread=threading.Thread(target=self._run, name='jobs-worker', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                pool=database.get_background_pool()
+                conn=pool.acquire()
+                try:
+                    run_pending(conn)
+                finally:
+                    pool.release(conn)
+            except Exception as e:
+                print(f"Job Worker Error: {e}")
+            self._wake.wait(self.poll_interval)
+
+_worker=None
+_worker_pid=None
+_worker_lock=threading.Lock()
+
+def get_worker():
+    """This process's worker thread, started after fork on first use."""
+    global _worker, _worker_pid
+    # Threads don't survive a fork, so each gunicorn worker starts its own
+    if _worker is None or _worker_pid != os.getpid():
+        with _worker_lock:
+            if _worker is None or _worker_pid != os.getpid():
+                _worker=Worker()
+                _worker.start()
+                _worker_pid=os.getpid()
+    return _worker
+
+def notify():
+    """Wakes this process's worker after a job was committed."""
+    if JOB_WORKER_THREAD:
+        get_worker().wake()
+
+def _ensure_worker():
+    get_worker()
+
+def init_app(app):
+    if JOB_WORKER_THREAD:
+        # Picks up jobs abandoned by a crash or restart without waiting for a new one
+        app.before_request(_ensure_worker)
+
+if __name__ == '__main__':
+    from database import get_db_connection
+    command=sys.argv[1] if len(sys.argv) > 1 else 'status'
+    conn=get_db_connection()
+    try:
+        if command == 'work':
+            print("Waiting for jobs (Ctrl+C to stop).")
+            while True:
+                finished=run_pending(conn)
+                if finished:
+                    print(f"Finished {finished} jobs.")
+                time.sleep(JOB_POLL_INTERVAL)
+        elif command == 'status':
+            cursor=conn.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT job_id, kind, user_id, label, status, processed, total, attempts, last_error
+                FROM background_jobs WHERE status <> 'done' ORDER BY job_id
+            """)
+            jobs=cursor.fetchall()
+            for job in jobs:
+                print(f"#{job['job_id']} {job['kind']} '{job['label']}' (user {job['user_id']}): {job['status']}, "
+                      f"{job['processed']}/{job['total'] if job['total'] is not None else '?'} rows, "
+                      f"{job['attempts']} attempts{' - ' + job['last_error'] if job['last_error'] else ''}")
+            if not jobs:
+                print("No unfinished jobs.")
+        else:
+            print(f"Unknown command: {command}")
+            sys.exit(2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
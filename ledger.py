@@ -0,0 +1,174 @@
+#---Materialized Balances---
+# accounts.current_balance and the time-bucket rollups (see rollups.py) are kept in step
+# with the transactions table on every write, inside the caller's DB transaction, and so are
+# the spent counters of budgeted categories (see budgets.py).
+# Usage:
+#   python ledger.py verify [user_id]     -> report balances/rollups that drifted
+#   python ledger.py reconcile [user_id]  -> rebuild them from the transactions table
+#
+# None of these functions commit; the route that calls them does, so the transaction
+# and its balance update land (or roll back) together.
+import sys
+
+import budgets
+import rollups
+
+def _apply_balances(cursor, where, params, sign):
+    cursor.execute(f"""
+        UPDATE accounts a
+        JOIN (
+            SELECT t.account_id, SUM(IF(c.type = 'Income', t.amount, -t.amount)) AS delta
+            FROM transactions t
+            JOIN categories c ON c.category_id = t.category_id
+            WHERE {where}
+            GROUP BY t.account_id
+        ) d ON d.account_id = a.account_id
+        SET a.current_balance = a.current_balance + %s * d.delta
+    """, tuple(params) + (sign,))
+
+def apply_where(cursor, where, params, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) every transaction matching 'where' to/from the
+    stored balances, rollups and budget counters, a fixed number of grouped statements
+    regardless of row count. 'where' is a SQL condition on the transactions alias 't' only.
+    """
+    _apply_balances(cursor, where, params, sign)
+    rollups.apply_where(cursor, where, params, sign)
+    budgets.apply_where(cursor, where, params, sign)
+
+def apply_transaction(cursor, transaction_id, sign=1):
+    """
+    Adds a freshly inserted transaction to its account balance and rollup buckets.
+    Use sign=-1 just before deleting a single transaction.
+    """
+    apply_where(cursor, "t.transaction_id = %s", (transaction_id,), sign)
+
+# Locks both rows, so a soft delete (which locks them too, see jobs.py) can't slip in before the insert
+TARGETS_QUERY = """
+    SELECT a.account_id
+    FROM accounts a
+    JOIN categories c ON c.category_id = %s AND c.user_id = a.user_id AND c.deleted_at IS NULL
+    WHERE a.account_id = %s AND a.user_id = %s AND a.deleted_at IS NULL
+    FOR UPDATE
+"""
+
+def add_transaction(cursor, user_id, account_id, category_id, amount, note=None):
+    """
+    Inserts a transaction dated now and applies it to the balances and rollups.
+    Shared by the web routes and the Telegram bot. Returns the new transaction_id.
+    Raises ValueError if the account or category isn't the user's or is being deleted.
+    """
+    cursor.execute(TARGETS_QUERY, (category_id, account_id, user_id))
+    if not cursor.fetchall():
+        raise ValueError("That account or category doesn't exist (or was just deleted).")
+    cursor.execute("""
+        INSERT INTO transactions (user_id, account_id, category_id, amount, transaction_date, note)
+        VALUES (%s, %s, %s, %s, NOW(), %s)
+    """, (user_id, account_id, category_id, amount, note))
+    transaction_id = cursor.lastrowid
+    apply_transaction(cursor, transaction_id)
+    return transaction_id
+
+def remove_account(cursor, user_id, account_id):
+    """
+    The account and all its transactions are going away, so are its rollup buckets.
+    Call this when the account is soft-deleted; the purge job removes the rows later.
+    """
+    rollups.remove_account(cursor, user_id, account_id)
+    # Budgets span accounts: recount the user's from the remaining buckets
+    budgets.rebuild(cursor, user_id)
+
+def remove_category(cursor, user_id, category_id):
+    """
+    Subtracts every transaction of a category from the balances it touched and drops
+    its rollup buckets. Call this when the category is soft-deleted, before its
+    transactions are purged.
+    """
+    _apply_balances(cursor, "t.user_id = %s AND t.category_id = %s", (user_id, category_id), -1)
+    rollups.remove_category(cursor, user_id, category_id)
+    budgets.remove_category(cursor, user_id, category_id)
+
+#---Reconciliation---
+def _scope(user_id, alias):
+    if user_id is None:
+        return "", ()
+    return f" AND {alias}.user_id = %s", (user_id,)
+
+def verify(conn, user_id=None):
+    """Returns accounts whose stored balance, and rollup buckets whose totals, disagree with the transactions table."""
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    where, params = _scope(user_id, 'a')
+    cursor.execute(f"""
+        SELECT a.account_id, a.user_id, a.current_balance AS stored,
+               COALESCE(SUM(IF(c.type = 'Income', t.amount, -t.amount)), 0) AS computed
+        FROM accounts a
+        LEFT JOIN transactions t ON t.account_id = a.account_id AND {rollups.LIVE}
+        LEFT JOIN categories c ON c.category_id = t.category_id
+        WHERE a.deleted_at IS NULL{where}
+        GROUP BY a.account_id, a.user_id, a.current_balance
+        HAVING stored <> computed
+    """, params)
+    drifted = cursor.fetchall()
+    cursor.close()
+    return {'balances': drifted, 'buckets': rollups.verify(conn, user_id)}
+
+def rebuild_balances(cursor, user_id=None):
+    """Recomputes accounts.current_balance from scratch (all users if user_id is None)."""
+    where_t, params_t = _scope(user_id, 't')
+    where_a, params_a = _scope(user_id, 'a')
+    cursor.execute(f"""
+        UPDATE accounts a
+        LEFT JOIN (
+            SELECT t.account_id, SUM(IF(c.type = 'Income', t.amount, -t.amount)) AS balance
+            FROM transactions t
+            JOIN categories c ON c.category_id = t.category_id
+            WHERE {rollups.LIVE}{where_t}
+            GROUP BY t.account_id
+        ) d ON d.account_id = a.account_id
+        SET a.current_balance = COALESCE(d.balance, 0)
+        WHERE 1 = 1{where_a}
+    """, params_t + params_a)
+
+def rebuild(cursor, user_id=None):
+    """Recomputes stored balances, rollups and budget counters from scratch (all users if user_id is None)."""
+    rebuild_balances(cursor, user_id)
+    rollups.rebuild(cursor, user_id)
+    budgets.rebuild(cursor, user_id)
+
+def reconcile(conn, user_id=None):
+    """Rebuilds stored totals in one DB transaction and returns what had drifted beforehand."""
+    drift = verify(conn, user_id)
+    cursor = conn.cursor()
+    try:
+        rebuild(cursor, user_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return drift
+
+if __name__ == '__main__':
+    from database import get_db_connection
+    command = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+    user_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    conn = get_db_connection()
+    try:
+        if command == 'verify':
+            drift = verify(conn, user_id)
+        elif command == 'reconcile':
+            drift = reconcile(conn, user_id)
+        else:
+            print(f"Unknown command: {command}")
+            sys.exit(2)
+        for row in drift['balances']:
+            print(f"Account {row['account_id']} (user {row['user_id']}): stored {row['stored']}, computed {row['computed']}")
+        for row in drift['buckets']:
+            print(f"User {row['user_id']} account {row['account_id']} category {row['category_id']}: {row['bucket']} out of date")
+        if not drift['balances'] and not drift['buckets']:
+            print("✅ All balances match the transaction history.")
+        elif command == 'verify':
+            sys.exit(1)
+    finally:
+        conn.close()
@@ -0,0 +1,495 @@
+#---Versioned Schema Migrations---
+# Usage:
+#   python migrations.py          -> apply pending migrations
+#   python migrations.py status   -> show current schema version
+#   python migrations.py check    -> EXPLAIN the hot queries and fail on full table scans
+#
+# MySQL commits DDL implicitly, so every step below is written to be safe to re-run:
+# a migration that died halfway is simply applied again on the next run.
+import datetime
+import sys
+import mysql.connector
+
+#---Idempotent DDL helpers---
+def _table_exists(cursor, table):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = %s
+    """, (table,))
+    return cursor.fetchone() is not None
+
+def _column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+def _index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index))
+    return cursor.fetchone() is not None
+
+def add_column(cursor, table, column, definition):
+    if not _column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def add_index(cursor, table, index, columns):
+    if not _index_exists(cursor, table, index):
+        cursor.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+
+#---Migrations (append only, never edit one that has shipped)---
+def m001_base_tables(cursor):
+    """Users, accounts, categories and transactions."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) NOT NULL UNIQUE,
+            password_hash VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS accounts(
+            account_id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            account_name VARCHAR(100) NOT NULL,
+            account_type VARCHAR(50) NOT NULL,
+            current_balance DECIMAL(10, 2) DEFAULT 0.00,
+            FOREIGN KEY (user_id) REFERENCES  users(user_id)
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS categories (
+            category_id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            type VARCHAR(20) NOT NULL, -- e.g., 'Expense', 'Income'
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            transaction_id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            account_id INT NOT NULL,
+            category_id INT NOT NULL,
+            amount DECIMAL(10, 2) NOT NULL,
+            transaction_date DATE NOT NULL,
+            note VARCHAR(255),
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (account_id) REFERENCES accounts(account_id),
+            FOREIGN KEY (category_id) REFERENCES categories(category_id)
+        );
+    """)
+
+def m002_currency_columns(cursor):
+    """Replaces the old /migrate_currency route."""
+    add_column(cursor, 'users', 'default_currency', "VARCHAR(3) DEFAULT 'TRY'")
+    add_column(cursor, 'accounts', 'currency', "VARCHAR(3) DEFAULT 'TRY'")
+
+def m003_hot_path_indexes(cursor):
+    """Composite indexes for history paging, dashboard totals and settings lookups."""
+    # Keyset pagination: WHERE user_id = ? ORDER BY transaction_date DESC, transaction_id DESC
+    add_index(cursor, 'transactions', 'idx_tx_user_date_id', 'user_id, transaction_date, transaction_id')
+    # Account filter on the dashboard and history page
+    add_index(cursor, 'transactions', 'idx_tx_user_account_date', 'user_id, account_id, transaction_date')
+    # Category filter on the history page
+    add_index(cursor, 'transactions', 'idx_tx_user_category_date', 'user_id, category_id, transaction_date')
+    # 'Initial Balance' lookup and seeding checks
+    add_index(cursor, 'categories', 'idx_cat_user_name', 'user_id, name')
+
+def m004_materialized_balances(cursor):
+    """Per-account monthly totals and a maintained accounts.current_balance."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS account_monthly_totals (
+            account_id INT NOT NULL,
+            month DATE NOT NULL, -- first day of the month
+            user_id INT NOT NULL,
+            income DECIMAL(14, 2) NOT NULL DEFAULT 0.00,
+            expense DECIMAL(14, 2) NOT NULL DEFAULT 0.00,
+            PRIMARY KEY (account_id, month),
+            INDEX idx_amt_user_month (user_id, month)
+        );
+    """)
+    # A balance is a running sum, so give it more headroom than a single amount
+    cursor.execute("ALTER TABLE accounts MODIFY current_balance DECIMAL(14, 2) DEFAULT 0.00")
+    # Until now current_balance only held the opening balance: rebuild it from history.
+    # The SQL is frozen here on purpose: ledger.py follows the current schema, this runs on the old one.
+    cursor.execute("""
+        UPDATE accounts a
+        LEFT JOIN (
+            SELECT t.account_id, SUM(IF(c.type = 'Income', t.amount, -t.amount)) AS balance
+            FROM transactions t
+            JOIN categories c ON c.category_id = t.category_id
+            GROUP BY t.account_id
+        ) d ON d.account_id = a.account_id
+        SET a.current_balance = COALESCE(d.balance, 0)
+    """)
+    cursor.execute("DELETE FROM account_monthly_totals")
+    cursor.execute("""
+        INSERT INTO account_monthly_totals (user_id, account_id, month, income, expense)
+        SELECT t.user_id, t.account_id, DATE_SUB(t.transaction_date, INTERVAL DAYOFMONTH(t.transaction_date) - 1 DAY) AS month,
+               SUM(IF(c.type = 'Income', t.amount, 0)),
+               SUM(IF(c.type = 'Income', 0, t.amount))
+        FROM transactions t
+        JOIN categories c ON c.category_id = t.category_id
+        GROUP BY t.user_id, t.account_id, month
+    """)
+
+def m005_import_hash(cursor):
+    """Dedup key so re-importing a bank statement is a no-op."""
+    add_column(cursor, 'transactions', 'import_hash', "CHAR(40) NULL")
+    if not _index_exists(cursor, 'transactions', 'uq_tx_user_import_hash'):
+        cursor.execute("CREATE UNIQUE INDEX uq_tx_user_import_hash ON transactions (user_id, import_hash)")
+
+def m006_backfill_defaults(cursor):
+    """Default accounts and categories for users created before seeding moved to registration."""
+    # Frozen copy of provisioning.backfill() and its defaults as they shipped: later changes
+    # to provisioning.py must not change what this migration does on a fresh database.
+    cursor.execute("""
+        INSERT INTO accounts (user_id, account_name, account_type, current_balance)
+        SELECT u.user_id, d.name, d.kind, 0
+        FROM users u
+        CROSS JOIN (
+            SELECT 'Cash' AS name, 'Cash' AS kind UNION ALL
+            SELECT 'Bank', 'Bank'
+        ) d
+        WHERE NOT EXISTS (SELECT 1 FROM accounts a WHERE a.user_id = u.user_id)
+    """)
+    cursor.execute("""
+        INSERT INTO categories (user_id, name, type)
+        SELECT u.user_id, d.name, d.kind
+        FROM users u
+        CROSS JOIN (
+            SELECT 'Food' AS name, 'Expense' AS kind UNION ALL
+            SELECT 'Rent', 'Expense' UNION ALL
+            SELECT 'Salary', 'Income' UNION ALL
+            SELECT 'Fun', 'Expense' UNION ALL
+            SELECT 'Initial Balance', 'Income'
+        ) d
+        WHERE NOT EXISTS (SELECT 1 FROM categories c WHERE c.user_id = u.user_id)
+    """)
+
+def m007_rollups(cursor):
+    """Daily and monthly rollups per (user, account, category), replacing account_monthly_totals."""
+    for table in ('rollup_daily', 'rollup_monthly'):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id INT NOT NULL,
+                account_id INT NOT NULL,
+                category_id INT NOT NULL,
+                bucket DATE NOT NULL, -- the day, or the first day of the month
+                total DECIMAL(14, 2) NOT NULL DEFAULT 0.00,
+                tx_count INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, account_id, category_id, bucket),
+                INDEX idx_{table}_user_bucket (user_id, bucket)
+            );
+        """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name VARCHAR(50) PRIMARY KEY,
+            watermark BIGINT NOT NULL DEFAULT 0
+        );
+    """)
+    # Frozen SQL, like migration 4: rollups.rebuild() follows the current schema
+    for table, bucket in (('rollup_daily', 't.transaction_date'),
+                          ('rollup_monthly', "DATE_SUB(t.transaction_date, INTERVAL DAYOFMONTH(t.transaction_date) - 1 DAY)")):
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"""
+            INSERT INTO {table} (user_id, account_id, category_id, bucket, total, tx_count)
+            SELECT t.user_id, t.account_id, t.category_id, {bucket} AS b, SUM(t.amount), COUNT(*)
+            FROM transactions t
+            GROUP BY t.user_id, t.account_id, t.category_id, b
+        """)
+    # Everything the catch-up job would find is already in the rebuild
+    cursor.execute("""
+        INSERT INTO rollup_state (name, watermark)
+        SELECT 'transactions', COALESCE(MAX(transaction_id), 0) FROM transactions
+        ON DUPLICATE KEY UPDATE watermark = VALUES(watermark)
+    """)
+    cursor.execute("DROP TABLE IF EXISTS account_monthly_totals")
+
+def m008_telegram_links(cursor):
+    """Telegram chats linked to users, and the one-time codes that link them."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS telegram_chats (
+            chat_id BIGINT PRIMARY KEY,
+            user_id INT NOT NULL,
+            linked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_telegram_chats_user (user_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS telegram_link_codes (
+            code CHAR(8) PRIMARY KEY,
+            user_id INT NOT NULL,
+            expires_at DATETIME NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        );
+    """)
+
+def m009_exchange_rates(cursor):
+    """Daily exchange rate history (see rate_history.py)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS exchange_rates (
+            base CHAR(3) NOT NULL,
+            currency CHAR(3) NOT NULL,
+            rate_date DATE NOT NULL,
+            rate DECIMAL(18, 8) NOT NULL, -- units of 'currency' per 1 'base'
+            PRIMARY KEY (base, rate_date, currency)
+        );
+    """)
+
+def m010_background_jobs(cursor):
+    """Soft-delete columns and the background_jobs table (see jobs.py)."""
+    for table in ('accounts', 'categories'):
+        add_column(cursor, table, 'deleted_at', "DATETIME NULL")
+        add_index(cursor, table, f"idx_{table}_deleted", 'deleted_at')
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS background_jobs (
+            job_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            kind VARCHAR(50) NOT NULL,
+            user_id INT NOT NULL,
+            target_id INT NOT NULL, -- e.g. the account being purged
+            label VARCHAR(100), -- shown on the Settings page while the job runs
+            status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending, running, done, failed
+            processed INT NOT NULL DEFAULT 0,
+            total INT NULL, -- counted when the job starts
+            attempts INT NOT NULL DEFAULT 0,
+            locked_until DATETIME NULL, -- lease of the worker running it
+            last_error VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME NULL,
+            INDEX idx_jobs_status_lease (status, locked_until),
+            INDEX idx_jobs_user_status (user_id, status)
+        );
+    """)
+
+def m011_budgets(cursor):
+    """Monthly category budgets, their spent counters and the alert queue (see budgets.py)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS budgets (
+            user_id INT NOT NULL,
+            category_id INT NOT NULL,
+            amount DECIMAL(14, 2) NOT NULL, -- per calendar month
+            currency CHAR(3) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, category_id)
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS budget_spent (
+            user_id INT NOT NULL,
+            category_id INT NOT NULL,
+            period DATE NOT NULL, -- first day of the month
+            currency CHAR(3) NOT NULL, -- of the accounts the money left
+            spent DECIMAL(14, 2) NOT NULL DEFAULT 0.00,
+            PRIMARY KEY (user_id, category_id, period, currency)
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS budget_alerts (
+            alert_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            category_id INT NOT NULL,
+            period DATE NOT NULL,
+            level INT NOT NULL, -- percent of the budget
+            message VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at DATETIME NULL,
+            UNIQUE KEY uq_budget_alerts (user_id, category_id, period, level),
+            INDEX idx_budget_alerts_unsent (sent_at, alert_id)
+        );
+    """)
+
+def m012_rebuild_live_totals(cursor):
+    """Stored balances, rollups and budget counters rebuilt without soft-deleted accounts and categories."""
+    live = ("t.account_id NOT IN (SELECT account_id FROM accounts WHERE deleted_at IS NOT NULL)"
+            " AND t.category_id NOT IN (SELECT category_id FROM categories WHERE deleted_at IS NOT NULL)")
+    cursor.execute(f"""
+        UPDATE accounts a
+        LEFT JOIN (
+            SELECT t.account_id, SUM(IF(c.type = 'Income', t.amount, -t.amount)) AS balance
+            FROM transactions t
+            JOIN categories c ON c.category_id = t.category_id
+            WHERE {live}
+            GROUP BY t.account_id
+        ) d ON d.account_id = a.account_id
+        SET a.current_balance = COALESCE(d.balance, 0)
+    """)
+    for table, bucket in (('rollup_daily', 't.transaction_date'),
+                          ('rollup_monthly', "DATE_SUB(t.transaction_date, INTERVAL DAYOFMONTH(t.transaction_date) - 1 DAY)")):
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"""
+            INSERT INTO {table} (user_id, account_id, category_id, bucket, total, tx_count)
+            SELECT t.user_id, t.account_id, t.category_id, {bucket} AS b, SUM(t.amount), COUNT(*)
+            FROM transactions t
+            WHERE {live}
+            GROUP BY t.user_id, t.account_id, t.category_id, b
+        """)
+    cursor.execute("DELETE FROM budget_spent")
+    cursor.execute("""
+        INSERT INTO budget_spent (user_id, category_id, period, currency, spent)
+        SELECT r.user_id, r.category_id, r.bucket, COALESCE(a.currency, 'TRY') AS cur, SUM(r.total)
+        FROM rollup_monthly r
+        JOIN budgets b ON b.user_id = r.user_id AND b.category_id = r.category_id
+        JOIN accounts a ON a.account_id = r.account_id
+        WHERE a.deleted_at IS NULL
+        GROUP BY r.user_id, r.category_id, r.bucket, cur
+    """)
+
+def m013_cache_version(cursor):
+    """Per-user cache version, so every worker sees a write at once (see cache.py)."""
+    add_column(cursor, 'users', 'cache_version', "INT NOT NULL DEFAULT 0")
+
+def m014_cache_bumped_at(cursor):
+    """When each user's cache version last moved, so loads that may predate it on a replica aren't cached."""
+    add_column(cursor, 'users', 'cache_bumped_at', "DOUBLE NULL")
+
+MIGRATIONS = [
+    (1, m001_base_tables),
+    (2, m002_currency_columns),
+    (3, m003_hot_path_indexes),
+    (4, m004_materialized_balances),
+    (5, m005_import_hash),
+    (6, m006_backfill_defaults),
+    (7, m007_rollups),
+    (8, m008_telegram_links),
+    (9, m009_exchange_rates),
+    (10, m010_background_jobs),
+    (11, m011_budgets),
+    (12, m012_rebuild_live_totals),
+    (13, m013_cache_version),
+    (14, m014_cache_bumped_at),
+]
+
+#---Runner---
+def get_schema_version(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    row = cursor.fetchone()
+    return row[0] or 0
+
+def run_migrations(conn):
+    """Applies every pending migration in order. Returns a list of what was applied."""
+    cursor = conn.cursor(buffered=True)
+    applied = []
+    # Several gunicorn workers may call this at once: only one runs, the rest wait
+    cursor.execute("SELECT GET_LOCK('expense_tracker_migrations', 60)")
+    if cursor.fetchone()[0] != 1:
+        raise RuntimeError("Could not acquire the migration lock.")
+    try:
+        current = get_schema_version(cursor)
+        for version, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            migration(cursor)
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                           (version, migration.__doc__.strip()))
+            conn.commit()
+            applied.append(f"{version}: {migration.__doc__.strip()}")
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK('expense_tracker_migrations')")
+        cursor.close()
+    return applied
+
+#---Query plan check---
+# Representative parameters are fine here; the plan only depends on the shape of the query.
+def hot_queries():
+    """
+    (name, sql, params) for the queries requests, the bot and the background threads run,
+    built by the same constants and builder functions the runtime code calls, so the check
+    can't drift from what actually runs. Every optional filter variant that changes the
+    plan is listed. Imported here, not at the top: those modules import this one.
+    """
+    import analytics
+    import bot
+    import budgets
+    import cache
+    import database
+    import jobs
+    import ledger
+
+    day = datetime.date(2024, 1, 1)
+    page_token = database.encode_cursor(datetime.date(2100, 1, 1), 2**31 - 1)
+    queries = [
+        ("load_user", database.USER_BY_ID_QUERY, (1,)),
+        ("login", database.USER_BY_USERNAME_QUERY, ('someone',)),
+        ("cache_version", cache.VERSION_QUERY, (1,)),
+        ("accounts", database.ACCOUNTS_QUERY, (1,)),
+        ("categories", database.CATEGORIES_QUERY, (1,)),
+        ("account_options", database.ACCOUNT_OPTIONS_QUERY, (1,)),
+        ("category_options", database.CATEGORY_OPTIONS_QUERY, (1,)),
+        ("initial_balance_category", database.INITIAL_BALANCE_CATEGORY_QUERY, (1,)),
+        ("transaction_targets", ledger.TARGETS_QUERY, (1, 1, 1)),
+        ("dashboard_totals", *database.user_totals_query(1)),
+        ("dashboard_totals_account", *database.user_totals_query(1, 1)),
+        ("history_page", *database.transactions_page_query(1)),
+        ("history_next_page", *database.transactions_page_query(1, cursor_token=page_token)),
+        ("history_by_account", *database.transactions_page_query(1, {'account_id': 1})),
+        ("history_by_category", *database.transactions_page_query(1, {'category_id': 1})),
+        ("history_by_dates", *database.transactions_page_query(1, {'date_from': day, 'date_to': day})),
+        ("export", *database.export_query(1)),
+        ("export_by_account", *database.export_query(1, {'account_id': 1})),
+        ("report_buckets", *analytics.daily_buckets_query(1)),
+        ("report_buckets_account", *analytics.daily_buckets_query(1, 1)),
+        ("budget_status", budgets.BUDGETS_QUERY, (day, 1)),
+        ("telegram_chat", bot.LINKED_USER_QUERY, (1,)),
+        ("claim_job", jobs.CLAIM_QUERY, (day,)),
+    ]
+    for kind, (column, _, _) in jobs.PURGES.items():
+        queries.append((kind, jobs.PURGE_BATCH_QUERY.format(column=column), (1, 1, jobs.JOB_BATCH_SIZE)))
+    return queries
+
+def check_query_plans(conn):
+    """
+    Runs EXPLAIN on hot_queries() and returns a list of problems (empty means all good).
+    A row with type 'ALL' is a full table scan. Run this against a database with
+    realistic data: on near-empty tables the optimizer may scan anyway.
+    """
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    problems = []
+    for name, sql, params in hot_queries():
+        cursor.execute("EXPLAIN " + sql, params)
+        for row in cursor.fetchall():
+            if row['type'] == 'ALL':
+                problems.append(f"{name}: full scan on '{row['table']}'")
+    cursor.close()
+    return problems
+
+if __name__ == '__main__':
+    from database import get_db_connection
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    conn = get_db_connection()
+    try:
+        if command == 'upgrade':
+            applied = run_migrations(conn)
+            print("\n".join(applied) if applied else "Schema is up to date.")
+        elif command == 'status':
+            cursor = conn.cursor(buffered=True)
+            print(f"Schema version: {get_schema_version(cursor)} (latest: {MIGRATIONS[-1][0]})")
+        elif command == 'check':
+            problems = check_query_plans(conn)
+            for problem in problems:
+                print(f"❌ {problem}")
+            if problems:
+                sys.exit(1)
+            print("✅ No full table scans in hot queries.")
+        else:
+            print(f"Unknown command: {command}")
+            sys.exit(2)
+    except mysql.connector.Error as err:
+        print(f"Migration Error: {err}")
+        sys.exit(1)
+    finally:
+        conn.close()
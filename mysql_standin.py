@@ -0,0 +1,244 @@
+#---SQLite Stand-in for MySQL (benchmarks and local runs without a server)---
+# Speaks the small part of mysql.connector the app uses (cursor(dictionary=True),
+# execute/executemany with %s, lastrowid, rowcount, commit/rollback/ping) and rewrites
+# the MySQL idioms in this codebase's SQL into SQLite:
+#   %s -> ?1, ?2, ...                   (numbered, so rewrites may reorder clauses)
+#   INSERT IGNORE                       -> INSERT OR IGNORE
+#   ON DUPLICATE KEY UPDATE x = VALUES(x) -> ON CONFLICT DO UPDATE SET x = excluded.x
+#   UPDATE a [LEFT] JOIN (...) d ON .. SET .. -> UPDATE a SET .. FROM (...) d WHERE ..
+#   DELETE r FROM t r                   -> DELETE FROM t AS r
+#   rollups.MONTH_OF, IF(), NOW(), TO_DAYS(), GET_LOCK() ... as SQL functions
+#   information_schema lookups          -> sqlite_master / pragma_table_info
+#   CREATE TABLE: AUTO_INCREMENT, inline INDEX/UNIQUE KEY, implicit foreign key indexes
+#   ALTER TABLE .. MODIFY               -> nothing (SQLite columns aren't sized)
+# The schema is built by running migrations.py against it (see create_schema()), so it
+# can't drift from what MySQL gets.
+# DATE/DECIMAL columns come back as datetime.date/Decimal like with MySQL; computed
+# expressions (SUM(...)) come back as SQLite numbers.
+#
+# It is not a general MySQL emulator: statements outside these patterns are passed
+# through unchanged and fail loudly if SQLite can't run them.
+import datetime
+import functools
+import re
+import sqlite3
+from decimal import Decimal
+
+import migrations
+import rollups
+
+# SQLite-only additions on top of the schema the migrations build
+COMPAT = """
+-- MySQL stores NOW() in a DATE column as just the date
+CREATE TRIGGER IF NOT EXISTS transactions_date_only AFTER INSERT ON transactions
+WHEN length(NEW.transaction_date) > 10
+BEGIN
+    UPDATE transactions SET transaction_date = substr(NEW.transaction_date, 1, 10)
+    WHERE transaction_id = NEW.transaction_id;
+END;
+"""
+
+#---Type conversion both ways---
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('DATE', lambda raw: datetime.date.fromisoformat(raw.decode()[:10]))
+sqlite3.register_converter('DECIMAL', lambda raw: Decimal(raw.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda raw: datetime.datetime.fromisoformat(raw.decode()))
+sqlite3.register_converter('DATETIME', lambda raw: datetime.datetime.fromisoformat(raw.decode()))
+
+def _to_date(value):
+    return datetime.date.fromisoformat(str(value)[:10])
+
+def _last_day(value):
+    day=_to_date(value)
+    following=(day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return (following - datetime.timedelta(days=1)).isoformat()
+
+FUNCTIONS = {
+    ('IF', 3): lambda condition, yes, no: yes if condition else no,
+    ('NOW', 0): lambda: datetime.datetime.now().isoformat(' ', timespec='seconds'),
+    ('TO_DAYS', 1): lambda value: _to_date(value).toordinal() + 365,  # MySQL counts from year 0
+    ('DAYOFMONTH', 1): lambda value: _to_date(value).day,
+    ('LAST_DAY', 1): _last_day,
+    ('GET_LOCK', 2): lambda name, timeout: 1,  # one process, nothing to coordinate
+    ('RELEASE_LOCK', 1): lambda name: 1,
+    ('GREATEST', 2): max,
+    ('CONCAT', 2): lambda a, b: f"{a}{b}",
+    ('CONCAT', 3): lambda a, b, c: f"{a}{b}{c}",
+}
+
+#---SQL rewriting---
+_PLACEHOLDER=re.compile(r"%s")
+_VALUES_REF=re.compile(r"VALUES\((\w+)\)")
+_UPDATE_JOIN=re.compile(
+    r"UPDATE\s+(\w+)\s+(\w+)\s+(?:LEFT\s+)?JOIN\s+\((.*)\)\s+(\w+)\s+ON\s+(.+?)\s+SET\s+(.+?)(?:\s+WHERE\s+(.+))?\s*$",
+    re.DOTALL)
+_DELETE_ALIAS=re.compile(r"DELETE\s+(\w+)\s+FROM\s+(\w+)\s+\1\b")
+_CAST_SIGNED=re.compile(r"AS SIGNED\)")
+_INFORMATION_SCHEMA = [
+    (re.compile(r"FROM information_schema\.tables\s+WHERE table_schema = DATABASE\(\) AND table_name = %s"),
+     "FROM sqlite_master WHERE type = 'table' AND name = %s"),
+    (re.compile(r"FROM information_schema\.columns\s+WHERE table_schema = DATABASE\(\) AND table_name = %s AND column_name = %s"),
+     "FROM pragma_table_info(%s) WHERE name = %s"),
+    (re.compile(r"FROM information_schema\.statistics\s+WHERE table_schema = DATABASE\(\) AND table_name = %s AND index_name = %s"),
+     "FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s"),
+]
+_ALTER_MODIFY=re.compile(r"^\s*ALTER TABLE \w+ MODIFY\b")
+_CREATE_TABLE=re.compile(r"^\s*CREATE TABLE IF NOT EXISTS (\w+)\s*\((.*)\)\s*;?\s*$", re.DOTALL)
+_COMMENT=re.compile(r"--[^\n]*")
+_INLINE_INDEX=re.compile(r"^INDEX (\w+) \((.+)\)$", re.DOTALL)
+_UNIQUE_KEY=re.compile(r"^UNIQUE KEY (\w+) \((.+)\)$", re.DOTALL)
+_FOREIGN_KEY=re.compile(r"^FOREIGN KEY \((\w+)\)")
+
+def _split_columns(body):
+    """Splits a CREATE TABLE body on its top-level commas."""
+    items, depth, current=[], 0, []
+    for char in body:
+        if char == ',' and depth == 0:
+            items.append(''.join(current).strip())
+            current=[]
+            continue
+        depth += (char == '(') - (char == ')')
+        current.append(char)
+    items.append(''.join(current).strip())
+    return [item for item in items if item]
+
+@functools.lru_cache(maxsize=128)
+def translate_ddl(sql):
+    """
+    Rewrites a MySQL CREATE TABLE into SQLite statements: the table, then the indexes
+    MySQL declares inline or creates on its own for foreign keys. Returns a tuple.
+    """
+    match=_CREATE_TABLE.match(sql)
+    table, body=match.groups()
+    columns, indexes=[], []
+    for item in _split_columns(_COMMENT.sub('', body)):
+        item=re.sub(r"\b(?:BIG)?INT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT", item)
+        inline=_INLINE_INDEX.match(item)
+        if inline:
+            indexes.append(f"CREATE INDEX IF NOT EXISTS {inline.group(1)} ON {table} ({inline.group(2)})")
+            continue
+        unique=_UNIQUE_KEY.match(item)
+        if unique:
+            item=f"CONSTRAINT {unique.group(1)} UNIQUE ({unique.group(2)})"
+        foreign=_FOREIGN_KEY.match(item)
+        if foreign:
+            column=foreign.group(1)
+            indexes.append(f"CREATE INDEX IF NOT EXISTS fk_{table}_{column} ON {table} ({column})")
+        columns.append(item)
+    return (f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(columns)})",) + tuple(indexes)
+
+@functools.lru_cache(maxsize=512)
+def translate(sql):
+    if _ALTER_MODIFY.match(sql):
+        return "SELECT NULL WHERE 0"
+    for pattern, replacement in _INFORMATION_SCHEMA:
+        sql=pattern.sub(replacement, sql)
+    counter=iter(range(1, 10000))
+    sql=_PLACEHOLDER.sub(lambda match: f"?{next(counter)}", sql)
+    sql=sql.replace(rollups.MONTH_OF, "date(t.transaction_date, 'start of month')")
+    sql=sql.replace("INSERT IGNORE", "INSERT OR IGNORE")
+    sql=sql.replace(" FOR UPDATE", "")
+    sql=_CAST_SIGNED.sub("AS INTEGER)", sql)
+    if "ON DUPLICATE KEY UPDATE" in sql:
+        head, tail=sql.split("ON DUPLICATE KEY UPDATE", 1)
+        if "SELECT" in head and "WHERE" not in head.rsplit("FROM", 1)[-1]:
+            # Without a WHERE, SQLite would read ON CONFLICT as a join constraint
+            head += "WHERE true "
+        sql=head + "ON CONFLICT DO UPDATE SET " + _VALUES_REF.sub(r"excluded.\1", tail)
+    match=_UPDATE_JOIN.search(sql)
+    if match:
+        table, alias, subquery, joined, on, assignments, where=match.groups()
+        # SQLite wants unqualified columns on the left of SET
+        assignments=re.sub(rf"\b{alias}\.(\w+)\s*=", r"\1 =", assignments)
+        condition=f"{on} AND ({where})" if where else on
+        sql=f"{sql[:match.start()]}UPDATE {table} AS {alias} SET {assignments} FROM ({subquery}) AS {joined} WHERE {condition}"
+    return _DELETE_ALIAS.sub(r"DELETE FROM \2 AS \1", sql)
+
+
+class Cursor:
+    def __init__(self, raw, dictionary=False):
+        self._raw=raw
+        self.dictionary=dictionary
+
+    def _row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return dict(zip((column[0] for column in self._raw.description), row))
+
+    def execute(self, operation, params=(), multi=False):
+        if _CREATE_TABLE.match(operation):
+            for statement in translate_ddl(operation):
+                self._raw.execute(statement)
+            return
+        self._raw.execute(translate(operation), tuple(params or ()))
+
+    def executemany(self, operation, seq_params):
+        self._raw.executemany(translate(operation), [tuple(params) for params in seq_params])
+
+    def fetchone(self):
+        return self._row(self._raw.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._raw.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._raw.fetchall()]
+
+    def __iter__(self):
+        return (self._row(row) for row in self._raw)
+
+    @property
+    def lastrowid(self):
+        return self._raw.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._raw.rowcount
+
+    @property
+    def description(self):
+        return self._raw.description
+
+    def close(self):
+        self._raw.close()
+
+
+class Connection:
+    def __init__(self, path):
+        self.raw=sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False, timeout=30)
+        for (name, arity), fn in FUNCTIONS.items():
+            self.raw.create_function(name, arity, fn, deterministic=name not in ('NOW', 'GET_LOCK'))
+        self.raw.execute("PRAGMA journal_mode=WAL")
+        self.raw.execute("PRAGMA synchronous=NORMAL")
+
+    def cursor(self, dictionary=False, buffered=None, **kwargs):
+        return Cursor(self.raw.cursor(), dictionary)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def ping(self, reconnect=False):
+        self.raw.execute("SELECT 1")
+
+    def close(self):
+        self.raw.close()
+
+
+def create_schema(path):
+    """Runs every migration against the database at 'path'. Returns what was applied."""
+    conn=Connection(path)
+    try:
+        applied=migrations.run_migrations(conn)
+        conn.raw.executescript(COMPAT)
+        return applied
+    finally:
+        conn.close()
+
+def connection_factory(path):
+    """A creator for database.ConnectionPool: every call opens a connection to the same file."""
+    return lambda: Connection(path)
@@ -0,0 +1,334 @@
+#---Request Profiling & Metrics---
+# Every request gets a RequestProfile that splits its wall time into:
+#   db_connect - checking out (or opening) a pooled connection
+#   db_query   - each execute()/commit, also recorded per normalized SQL statement
+#   http       - outbound HTTP calls (sessions passed to instrument_session()), and time a
+#                request spends waiting on a fetch running on another thread (see rates.py)
+#   render     - Jinja template rendering
+#   compute    - everything else, i.e. our own Python
+# The profile lives in a contextvar, so database.py and rates.py record into it without
+# knowing about Flask. Totals are served at /metrics in the Prometheus text format
+# (each gunicorn worker reports its own numbers).
+#
+# Slow request dumps (opt-in): PROFILE_SAMPLE_RATE of requests run under cProfile, and
+# the ones slower than PROFILE_SLOW_MS are written to PROFILE_DIR as a .prof file
+# (python -m pstats, snakeviz) next to a .json breakdown of phases and queries.
+import bisect
+import contextlib
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+PROFILE_SAMPLE_RATE=float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # 0 = profiler off, 1 = every request
+PROFILE_SLOW_MS=float(os.getenv("PROFILE_SLOW_MS", "1000"))
+PROFILE_DIR=os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "expense_tracker_profiles"))
+METRICS_MAX_QUERIES=int(os.getenv("METRICS_MAX_QUERIES", "500"))  # distinct statements tracked before 'other'
+
+PHASES = ('db_connect', 'db_query', 'http', 'render', 'compute')
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current=contextvars.ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    def __init__(self, endpoint, method):
+        self.endpoint=endpoint
+        self.method=method
+        self.start=time.perf_counter()
+        self.phases=defaultdict(float)
+        self.queries=[]  # (normalized SQL, seconds) in execution order
+        self.status=None
+        self.profiler=None
+        self.render_started=[]  # stack: templates can include/render others
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    def breakdown(self, total):
+        phases={phase: self.phases.get(phase, 0.0) for phase in PHASES}
+        phases['compute']=max(total - sum(phases.values()), 0.0)
+        return phases
+
+
+class Histogram:
+    def __init__(self):
+        self.counts=[0] * (len(BUCKETS) + 1)  # the last slot is +Inf
+        self.sum=0.0
+        self.count=0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+_lock=threading.Lock()
+_requests=defaultdict(Histogram)  # (endpoint, method, status) -> Histogram
+_phase_totals=defaultdict(float)  # (endpoint, phase) -> seconds
+_queries=defaultdict(Histogram)  # normalized SQL -> Histogram
+_http=defaultdict(Histogram)  # host -> Histogram
+_dumps={'written': 0, 'errors': 0}
+_listeners=[]  # called with (profile, total seconds, phase breakdown) after each request
+
+#---SQL normalization: one metric per statement shape, not per parameter value---
+_SPACE=re.compile(r"\s+")
+_STRING=re.compile(r"'(?:[^'\\]|\\.)*'")
+_PLACEHOLDER=re.compile(r"%s|%\(\w+\)s")
+_NUMBER=re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST=re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """'SELECT * FROM t WHERE id IN (%s, %s) AND x = 5' -> 'SELECT * FROM t WHERE id IN (...) AND x = ?'"""
+    sql=_SPACE.sub(' ', sql).strip()
+    sql=_STRING.sub('?', sql)
+    sql=_PLACEHOLDER.sub('?', sql)
+    sql=_NUMBER.sub('?', sql)
+    return _LIST.sub('(...)', sql)
+
+#---Recording (safe to call outside a request: only the global metrics are updated)---
+def record(phase, seconds):
+    profile=_current.get()
+    if profile is not None:
+        profile.add(phase, seconds)
+
+@contextlib.contextmanager
+def timed(phase):
+    start=time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+def record_query(sql, seconds):
+    statement=normalize_sql(sql) if isinstance(sql, str) else str(sql)
+    profile=_current.get()
+    if profile is not None:
+        profile.add('db_query', seconds)
+        profile.queries.append((statement, seconds))
+    with _lock:
+        if statement not in _queries and len(_queries) >= METRICS_MAX_QUERIES:
+            statement='other'
+        _queries[statement].observe(seconds)
+
+def record_http(host, seconds):
+    record('http', seconds)
+    with _lock:
+        _http[host or 'unknown'].observe(seconds)
+
+def instrument_session(session):
+    """
+    Times every response of a requests.Session (up to the response headers), per host for
+    /metrics. Calls made on a background thread count toward no request; the request that
+    waits for them times the wait itself.
+    """
+    def hook(response, *args, **kwargs):
+        record_http(urlparse(response.url).hostname, response.elapsed.total_seconds())
+    session.hooks['response'].append(hook)
+    return session
+
+#---DB-API proxies: time execute()/executemany()/commit() on any connection---
+class _ProfiledCursor:
+    def __init__(self, cursor):
+        self._cursor=cursor
+
+    def execute(self, operation, *args, **kwargs):
+        start=time.perf_counter()
+        try:
+            return self._cursor.execute(operation, *args, **kwargs)
+        finally:
+            record_query(operation, time.perf_counter() - start)
+
+    def executemany(self, operation, *args, **kwargs):
+        start=time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, *args, **kwargs)
+        finally:
+            record_query(operation, time.perf_counter() - start)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _ProfiledConnection:
+    def __init__(self, conn):
+        self.raw=conn
+
+    def cursor(self, *args, **kwargs):
+        return _ProfiledCursor(self.raw.cursor(*args, **kwargs))
+
+    def commit(self):
+        start=time.perf_counter()
+        try:
+            return self.raw.commit()
+        finally:
+            record_query('COMMIT', time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+def wrap_connection(conn):
+    return _ProfiledConnection(conn)
+
+def unwrap_connection(conn):
+    return getattr(conn, 'raw', conn)
+
+#---Flask integration---
+def _finish(profile):
+    total=time.perf_counter() - profile.start
+    breakdown=profile.breakdown(total)
+    status=str(profile.status or 500)
+    with _lock:
+        _requests[(profile.endpoint, profile.method, status)].observe(total)
+        for phase, seconds in breakdown.items():
+            _phase_totals[(profile.endpoint, phase)] += seconds
+
+    for listener in _listeners:
+        listener(profile, total, breakdown)
+
+    if profile.profiler is not None:
+        profile.profiler.disable()
+        if total * 1000 >= PROFILE_SLOW_MS:
+            _dump(profile, total, breakdown)
+
+def _dump(profile, total, breakdown):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name=f"{time.strftime('%Y%m%d-%H%M%S')}-{profile.endpoint}-{int(total * 1000)}ms-{threading.get_ident()}"
+        path=os.path.join(PROFILE_DIR, name)
+        profile.profiler.dump_stats(f"{path}.prof")
+        with open(f"{path}.json", 'w') as f:
+            json.dump({
+                'endpoint': profile.endpoint,
+                'method': profile.method,
+                'status': profile.status,
+                'total_seconds': round(total, 6),
+                'phases': {phase: round(seconds, 6) for phase, seconds in breakdown.items()},
+                'queries': [{'sql': sql, 'seconds': round(seconds, 6)} for sql, seconds in profile.queries],
+            }, f, indent=2)
+        with _lock:
+            _dumps['written'] += 1
+    except Exception as e:
+        print(f"Profile dump error: {e}")
+        with _lock:
+            _dumps['errors'] += 1
+
+def add_listener(fn):
+    """Registers fn(profile, total, breakdown) to run after every request (used by bench.py)."""
+    _listeners.append(fn)
+
+def remove_listener(fn):
+    _listeners.remove(fn)
+
+def init_app(app):
+    from flask import request, before_render_template, template_rendered
+
+    @app.before_request
+    def start_profile():
+        profile=RequestProfile(request.endpoint or 'unknown', request.method)
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            profiler=cProfile.Profile()
+            try:
+                profiler.enable()
+                profile.profiler=profiler
+            except ValueError:
+                pass  # another profiler is active in this process (Python 3.12+ allows one)
+        _current.set(profile)
+
+    @app.after_request
+    def remember_status(response):
+        profile=_current.get()
+        if profile is not None:
+            profile.status=response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc=None):
+        profile=_current.get()
+        if profile is not None:
+            _current.set(None)
+            _finish(profile)
+
+    def render_started(sender, template, context, **extra):
+        profile=_current.get()
+        if profile is not None:
+            profile.render_started.append(time.perf_counter())
+
+    def render_finished(sender, template, context, **extra):
+        profile=_current.get()
+        if profile is not None and profile.render_started:
+            profile.add('render', time.perf_counter() - profile.render_started.pop())
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+#---Prometheus text format---
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+def _histogram_lines(name, histograms):
+    lines=[]
+    for labels, histogram in histograms:
+        cumulative=0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{{{_labels(**labels, le=bound)}}} {cumulative}")
+        lines.append(f"{name}_sum{{{_labels(**labels)}}} {histogram.sum}")
+        lines.append(f"{name}_count{{{_labels(**labels)}}} {histogram.count}")
+    return lines
+
+def render_metrics(gauges=None):
+    """
+    All metrics as Prometheus text. 'gauges' adds {prefix: {name: number}} groups,
+    e.g. {'db_pool': get_pool_stats()}; non-numeric values are skipped.
+    """
+    with _lock:
+        requests_=[({'endpoint': e, 'method': m, 'status': s}, h) for (e, m, s), h in sorted(_requests.items())]
+        phases=sorted(_phase_totals.items())
+        queries=[({'query': q}, h) for q, h in sorted(_queries.items())]
+        http=[({'host': host}, h) for host, h in sorted(_http.items())]
+        dumps=dict(_dumps)
+
+    lines=['# HELP http_request_duration_seconds Wall time per request.',
+           '# TYPE http_request_duration_seconds histogram']
+    lines += _histogram_lines('http_request_duration_seconds', requests_)
+    lines += ['# HELP request_phase_seconds_total Request time by phase (db_connect, db_query, http, render, compute).',
+              '# TYPE request_phase_seconds_total counter']
+    lines += [f"request_phase_seconds_total{{{_labels(endpoint=e, phase=p)}}} {seconds}" for (e, p), seconds in phases]
+    lines += ['# HELP db_query_duration_seconds Time per SQL statement, by normalized statement.',
+              '# TYPE db_query_duration_seconds histogram']
+    lines += _histogram_lines('db_query_duration_seconds', queries)
+    lines += ['# HELP http_client_duration_seconds Outbound HTTP time by host.',
+              '# TYPE http_client_duration_seconds histogram']
+    lines += _histogram_lines('http_client_duration_seconds', http)
+    lines += ['# TYPE profile_dumps_total counter',
+              f"profile_dumps_total{{{_labels(result='written')}}} {dumps['written']}",
+              f"profile_dumps_total{{{_labels(result='error')}}} {dumps['errors']}"]
+    for prefix, values in (gauges or {}).items():
+        for name, value in sorted(values.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value}"]
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    """Clears all collected metrics, e.g. between benchmark runs."""
+    with _lock:
+        _requests.clear()
+        _phase_totals.clear()
+        _queries.clear()
+        _http.clear()
+        _dumps.update(written=0, errors=0)
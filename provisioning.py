@@ -0,0 +1,55 @@
+#---New User Provisioning---
+# Default accounts and categories are created once, when a user registers.
+# Usage:
+#   python provisioning.py   -> backfill defaults for existing users that have none (safe to re-run)
+DEFAULT_ACCOUNTS = [('Cash', 'Cash'), ('Bank', 'Bank')]
+DEFAULT_CATEGORIES = [('Food', 'Expense'), ('Rent', 'Expense'), ('Salary', 'Income'), ('Fun', 'Expense'), ('Initial Balance', 'Income')]
+
+def seed_user(cursor, user_id):
+    """Creates the default Accounts and Categories for a brand-new user. Does not commit."""
+    cursor.executemany("INSERT INTO accounts (user_id, account_name, account_type, current_balance) VALUES (%s, %s, %s, 0)",
+                       [(user_id, name, acc_type) for name, acc_type in DEFAULT_ACCOUNTS])
+    cursor.executemany("INSERT INTO categories (user_id, name, type) VALUES (%s, %s, %s)",
+                       [(user_id, name, cat_type) for name, cat_type in DEFAULT_CATEGORIES])
+
+def _defaults_as_rows(defaults):
+    """Turns [('Cash', 'Cash'), ...] into a derived table: SELECT %s, %s UNION ALL SELECT %s, %s ..."""
+    sql = " UNION ALL ".join(["SELECT %s AS name, %s AS kind"] * len(defaults))
+    params = tuple(value for pair in defaults for value in pair)
+    return sql, params
+
+def backfill(cursor):
+    """
+    Seeds every user that has no accounts (or no categories) yet, in two set-based INSERTs.
+    Users with existing data are left alone, so this is idempotent. Does not commit.
+    """
+    rows_sql, params = _defaults_as_rows(DEFAULT_ACCOUNTS)
+    cursor.execute(f"""
+        INSERT INTO accounts (user_id, account_name, account_type, current_balance)
+        SELECT u.user_id, d.name, d.kind, 0
+        FROM users u
+        CROSS JOIN ({rows_sql}) d
+        WHERE NOT EXISTS (SELECT 1 FROM accounts a WHERE a.user_id = u.user_id)
+    """, params)
+    accounts_added = cursor.rowcount
+
+    rows_sql, params = _defaults_as_rows(DEFAULT_CATEGORIES)
+    cursor.execute(f"""
+        INSERT INTO categories (user_id, name, type)
+        SELECT u.user_id, d.name, d.kind
+        FROM users u
+        CROSS JOIN ({rows_sql}) d
+        WHERE NOT EXISTS (SELECT 1 FROM categories c WHERE c.user_id = u.user_id)
+    """, params)
+    return accounts_added, cursor.rowcount
+
+if __name__ == '__main__':
+    from database import get_db_connection
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        accounts_added, categories_added = backfill(cursor)
+        conn.commit()
+        print(f"Created {accounts_added} accounts and {categories_added} categories.")
+    finally:
+        conn.close()
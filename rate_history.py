@@ -0,0 +1,280 @@
+#---Exchange Rate History---
+# Daily rates against FX_BASE are stored in the exchange_rates table and, in each process,
+# in a sorted in-memory index: "rate as of a date" is one bisect, so reports convert years
+# of transactions at the rates of their own dates with no network calls. Weekends and
+# holidays use the last rate published before them.
+#
+# Usage:
+#   python rate_history.py warm-up [user_id]        -> fetch the days users' transactions need (run daily)
+#   python rate_history.py load eurofxref-hist.csv  -> bulk-load the ECB history dump (EUR base)
+#   python rate_history.py status
+import bisect
+import csv
+import datetime
+import os
+import sys
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+
+import fx
+import rates
+
+RATE_HISTORY_RELOAD=float(os.getenv("RATE_HISTORY_RELOAD", "3600"))  # seconds between checks for newly stored days
+INSERT_BATCH=1000
+FETCH_DAYS=366  # days per provider request during warm-up
+EPOCH_ORDINAL=datetime.date(1970, 1, 1).toordinal()
+
+
+class RateHistory:
+    """
+    An immutable snapshot of the stored history. Lookups never lock: a reload builds
+    a new RateHistory and swaps it in (see get_history()).
+    """
+    def __init__(self, base, days, tables):
+        self.base=base
+        self.days=days  # sorted date ordinals
+        self.tables=tables  # parallel to days: {currency: Decimal units per 1 base}
+        self.rows=sum(len(table) for table in tables)  # stored rows it was built from
+        self._matrices={}  # position -> RateMatrix, built on first use
+        self._columns={}  # currency -> float array parallel to days (NaN where not published)
+        self._lock=threading.Lock()
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def first_day(self):
+        return datetime.date.fromordinal(self.days[0]) if self.days else None
+
+    @property
+    def last_day(self):
+        return datetime.date.fromordinal(self.days[-1]) if self.days else None
+
+    def _position(self, on_date):
+        return bisect.bisect_right(self.days, on_date.toordinal()) - 1
+
+    def as_of(self, on_date):
+        """(publication date, rate table) in effect on on_date, or None before the history starts."""
+        position=self._position(on_date)
+        if position < 0:
+            return None
+        return datetime.date.fromordinal(self.days[position]), self.tables[position]
+
+    def matrix_for(self, on_date):
+        """The cross rates in effect on on_date (see fx.RateMatrix), or None before the history starts."""
+        position=self._position(on_date)
+        if position < 0:
+            return None
+        matrix=self._matrices.get(position)
+        if matrix is None:
+            matrix=fx.RateMatrix(self.base, self.tables[position])
+            with self._lock:
+                self._matrices[position]=matrix
+        return matrix
+
+    def _column(self, currency):
+        column=self._columns.get(currency)
+        if column is None:
+            if currency == self.base:
+                column=np.ones(len(self.days))
+            else:
+                column=np.array([float(table.get(currency, 'nan')) for table in self.tables])
+            with self._lock:
+                self._columns[currency]=column
+        return column
+
+    def factors(self, days, source, target):
+        """
+        Vectorized lookups for analytics: for an array of days since 1970-01-01, how many
+        'target' one 'source' bought on each day. NaN before the history starts or where
+        a currency was not published.
+        """
+        days=np.asarray(days, dtype=np.int64)
+        if not self.days:
+            return np.full(len(days), np.nan)
+        positions=np.searchsorted(np.asarray(self.days), days + EPOCH_ORDINAL, side='right') - 1
+        known=positions >= 0
+        clipped=np.where(known, positions, 0)
+        factors=self._column(target)[clipped] / self._column(source)[clipped]
+        return np.where(known, factors, np.nan)
+
+
+#---Storage---
+def load(conn, base=fx.FX_BASE, since=None, previous=None):
+    """
+    Reads the stored history into a RateHistory. With 'previous', only days after its
+    last day are read and appended (the hourly reload), unless the rows up to that day
+    changed since (a warm-up or bulk load filling in older days): then all are read again.
+    """
+    cursor=conn.cursor()
+    if previous is not None and previous.days:
+        query="SELECT MIN(rate_date), COUNT(*) FROM exchange_rates WHERE base = %s AND rate_date <= %s"
+        params=[base, previous.last_day]
+        if since is not None:
+            query += " AND rate_date >= %s"
+            params.append(since)
+        cursor.execute(query, tuple(params))
+        first, count=cursor.fetchone()
+        if first != previous.first_day or count != previous.rows:
+            previous=None
+    days=list(previous.days) if previous else []
+    tables=list(previous.tables) if previous else []
+    query="SELECT rate_date, currency, rate FROM exchange_rates WHERE base = %s"
+    params=[base]
+    if previous is not None and previous.days:
+        query += " AND rate_date > %s"
+        params.append(previous.last_day)
+    elif since is not None:
+        query += " AND rate_date >= %s"
+        params.append(since)
+    query += " ORDER BY rate_date"
+    cursor.execute(query, tuple(params))
+    for rate_date, currency, rate in cursor.fetchall():
+        ordinal=rate_date.toordinal()
+        if not days or days[-1] != ordinal:
+            days.append(ordinal)
+            tables.append({})
+        tables[-1][currency]=rate
+    cursor.close()
+    return RateHistory(base, days, tables)
+
+def store(cursor, base, tables_by_date):
+    """Saves {'2024-01-02': {'USD': 1.09, ...}, ...}; days already stored are kept. Returns rows written."""
+    rows=[
+        (base, currency, day, Decimal(str(rate)))
+        for day, table in tables_by_date.items()
+        for currency, rate in table.items()
+        if currency != base
+    ]
+    written=0
+    for start in range(0, len(rows), INSERT_BATCH):
+        cursor.executemany("""
+            INSERT IGNORE INTO exchange_rates (base, currency, rate_date, rate)
+            VALUES (%s, %s, %s, %s)
+        """, rows[start:start + INSERT_BATCH])
+        written += cursor.rowcount
+    return written
+
+def read_ecb_csv(stream):
+    """The ECB's eurofxref-hist.csv: 'Date,USD,JPY,...' with one row per day and 'N/A' gaps."""
+    tables={}
+    for row in csv.DictReader(stream):
+        day=row.pop('Date', '').strip()
+        table={}
+        for currency, value in row.items():
+            try:
+                if currency and currency.strip():
+                    table[currency.strip()]=Decimal(value.strip())
+            except (InvalidOperation, AttributeError):
+                continue
+        if day and table:
+            tables[day]=table
+    return tables
+
+def _stored_range(cursor, base):
+    cursor.execute("SELECT MIN(rate_date), MAX(rate_date) FROM exchange_rates WHERE base = %s", (base,))
+    return cursor.fetchone()
+
+def missing_ranges(cursor, base, start, end):
+    """
+    Date ranges in [start, end] outside what is stored. Stored history is filled in
+    contiguous spans (warm-up or bulk load), so only the two ends can be missing.
+    """
+    first, last=_stored_range(cursor, base)
+    if first is None:
+        return [(start, end)]
+    ranges=[]
+    if start < first:
+        ranges.append((start, first - datetime.timedelta(days=1)))
+    if last < end:
+        ranges.append((max(start, last + datetime.timedelta(days=1)), end))
+    return ranges
+
+def warm_up(conn, provider, user_id=None, base=fx.FX_BASE, today=None):
+    """
+    Fetches and stores every missing day between the oldest transaction (of one user,
+    or of anyone) and today, FETCH_DAYS per request. Returns the number of rows written.
+    """
+    today=today or datetime.date.today()
+    cursor=conn.cursor(buffered=True)
+    query="SELECT MIN(transaction_date) FROM transactions"
+    params=()
+    if user_id is not None:
+        query += " WHERE user_id = %s"
+        params=(user_id,)
+    cursor.execute(query, params)
+    oldest=cursor.fetchone()[0]
+    if oldest is None:
+        return 0
+
+    written=0
+    for start, end in missing_ranges(cursor, base, oldest, today):
+        while start <= end:
+            chunk_end=min(start + datetime.timedelta(days=FETCH_DAYS - 1), end)
+            written += store(cursor, base, provider.fetch_range(base, start, chunk_end))
+            conn.commit()
+            start=chunk_end + datetime.timedelta(days=1)
+    cursor.close()
+    return written
+
+
+#---Per-process index---
+_history=None
+_loaded_at=0.0
+_history_lock=threading.Lock()
+
+def get_history(conn):
+    """
+    This process's RateHistory, loaded with 'conn' on first use and topped up with newly
+    stored days (or reloaded after a backfill) every RATE_HISTORY_RELOAD seconds. Returns
+    an empty history on DB errors. 'conn' may be a function returning the connection (e.g.
+    get_read_db), so requests only check one out when a load is due.
+    """
+    global _history, _loaded_at
+    if _history is not None and time.monotonic() - _loaded_at < RATE_HISTORY_RELOAD:
+        return _history
+    with _history_lock:
+        if _history is None or time.monotonic() - _loaded_at >= RATE_HISTORY_RELOAD:
+            try:
+                _history=load(conn() if callable(conn) else conn, previous=_history)
+            except Exception as e:
+                print(f"Rate history load error: {e}")
+                _history=_history or RateHistory(fx.FX_BASE, [], [])
+            _loaded_at=time.monotonic()
+    return _history
+
+def set_history(history):
+    """Swaps the in-memory index, e.g. a hand-built RateHistory in tests."""
+    global _history, _loaded_at
+    _history=history
+    _loaded_at=time.monotonic()
+
+if __name__ == '__main__':
+    from database import get_db_connection
+    command=sys.argv[1] if len(sys.argv) > 1 else 'status'
+    conn=get_db_connection()
+    try:
+        if command == 'warm-up':
+            user_id=int(sys.argv[2]) if len(sys.argv) > 2 else None
+            print(f"Stored {warm_up(conn, rates.FrankfurterProvider(), user_id)} rates.")
+        elif command == 'load':
+            if fx.FX_BASE != 'EUR':
+                print("The ECB dump is EUR based; set FX_BASE=EUR to load it.")
+                sys.exit(2)
+            with open(sys.argv[2], newline='') as f:
+                tables=read_ecb_csv(f)
+            cursor=conn.cursor()
+            written=store(cursor, 'EUR', tables)
+            conn.commit()
+            print(f"Stored {written} rates for {len(tables)} days.")
+        elif command == 'status':
+            history=load(conn)
+            print(f"{len(history)} days of {history.base} rates: {history.first_day} .. {history.last_day}")
+        else:
+            print(f"Unknown command: {command}")
+            sys.exit(2)
+    finally:
+        conn.close()
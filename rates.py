@@ -0,0 +1,236 @@
+#---Exchange Rate Service: cached, shared and off the request path---
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import profiling
+
+RATES_TTL=float(os.getenv("RATES_TTL", "3600"))  # Frankfurter only publishes once per working day
+RATES_MAX_STALE=float(os.getenv("RATES_MAX_STALE", "604800"))  # serve stale rates up to a week while refreshing
+RATES_TIMEOUT=(3.05, 5)  # (connect, read) seconds
+RATES_RETRY_MIN=float(os.getenv("RATES_RETRY_MIN", "30"))  # after a failed fetch, wait this long before trying again...
+RATES_RETRY_MAX=float(os.getenv("RATES_RETRY_MAX", "900"))  # ...doubling per failure up to this
+RATES_SNAPSHOT_PATH=os.getenv("RATES_SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "expense_tracker_rates.json"))
+
+
+class FrankfurterProvider:
+    """Fetches rates from api.frankfurter.app over a shared keep-alive session."""
+    def __init__(self, base_url="https://api.frankfurter.app", timeout=RATES_TIMEOUT):
+        self.base_url=base_url
+        self.timeout=timeout
+        self.session=requests.Session()
+        adapter=HTTPAdapter(pool_connections=2, pool_maxsize=10)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        profiling.instrument_session(self.session)
+
+    def fetch(self, base_currency):
+        """Returns {'USD': 0.03, 'EUR': 0.028, ...} relative to base_currency."""
+        response=self.session.get(f"{self.base_url}/latest", params={'from': base_currency}, timeout=self.timeout)
+        response.raise_for_status()
+        rates=response.json().get('rates', {})
+        # Add the base currency itself (1 to 1) so lookups don't fail
+        rates[base_currency]=1.0
+        return rates
+
+    def fetch_range(self, base_currency, start, end):
+        """Daily rates for every published day in [start, end]: {'2024-01-02': {'USD': 1.09, ...}, ...}"""
+        response=self.session.get(f"{self.base_url}/{start.isoformat()}..{end.isoformat()}",
+                                  params={'from': base_currency}, timeout=(self.timeout[0], 30))
+        response.raise_for_status()
+        return response.json().get('rates', {})
+
+
+class StaticRateProvider:
+    """Local stand-in for tests and offline development. Never touches the network."""
+    def __init__(self, rates_by_base):
+        self.rates_by_base=rates_by_base
+        self.calls=0
+
+    def fetch(self, base_currency):
+        self.calls += 1
+        rates=dict(self.rates_by_base[base_currency])
+        rates[base_currency]=1.0
+        return rates
+
+    def fetch_range(self, base_currency, start, end):
+        """The same table for every weekday in [start, end], like a source that skips weekends."""
+        self.calls += 1
+        days=(start + datetime.timedelta(days=offset) for offset in range((end - start).days + 1))
+        return {day.isoformat(): dict(self.rates_by_base[base_currency]) for day in days if day.weekday() < 5}
+
+
+class RateCache:
+    """
+    TTL cache of rate tables keyed by base currency.
+    - Fresh entries are served directly (no HTTP).
+    - Stale entries are served immediately while one background thread refreshes them.
+    - Concurrent misses for the same base share a single fetch (single-flight).
+    - Every successful fetch is persisted to a local snapshot that seeds the cache on startup.
+    - A failed fetch is remembered (negative cache): until its backoff runs out nobody waits
+      on the provider again; requests get whatever is cached, however old, or LookupError.
+    """
+    def __init__(self, provider, ttl=RATES_TTL, max_stale=RATES_MAX_STALE, snapshot_path=RATES_SNAPSHOT_PATH,
+                 retry_min=RATES_RETRY_MIN, retry_max=RATES_RETRY_MAX):
+        self.provider=provider
+        self.ttl=ttl
+        self.max_stale=max_stale
+        self.snapshot_path=snapshot_path
+        self.retry_min=retry_min
+        self.retry_max=retry_max
+        self._entries={}  # base -> (rates, fetched_at as wall-clock time)
+        self._inflight={}  # base -> threading.Event
+        self._failures={}  # base -> (retry_at as wall-clock time, backoff seconds)
+        self._lock=threading.Lock()
+        self.stats={'hits': 0, 'stale_hits': 0, 'misses': 0, 'fetches': 0, 'fetch_errors': 0, 'backoff_skips': 0}
+        self._load_snapshot()
+
+    def _cached(self, base_currency):
+        """Must be called with self._lock held. Returns servable rates (refreshing stale ones) or None."""
+        entry=self._entries.get(base_currency)
+        if entry:
+            age=time.time() - entry[1]
+            if age < self.ttl:
+                self.stats['hits'] += 1
+                return entry[0]
+            if age < self.ttl + self.max_stale:
+                self.stats['stale_hits'] += 1
+                self._start_refresh(base_currency, background=True)
+                return entry[0]
+        return None
+
+    def peek(self, base_currency):
+        """Like get(), but returns None instead of waiting when nothing usable is cached."""
+        with self._lock:
+            return self._cached(base_currency)
+
+    def get(self, base_currency):
+        with self._lock:
+            rates=self._cached(base_currency)
+            if rates is not None:
+                return rates
+            self.stats['misses'] += 1
+            event=self._start_refresh(base_currency, background=False)
+            if event is None:
+                # The provider failed moments ago: answer now rather than wait for it again
+                entry=self._entries.get(base_currency)
+                if entry is None:
+                    raise LookupError(f"No exchange rates available for {base_currency} (provider failing)")
+                return entry[0]
+
+        # Nothing usable cached: wait for whoever is fetching (possibly us). The fetch itself
+        # runs on the refresh thread, so this wait is what the request spends on HTTP.
+        with profiling.timed('http'):
+            event.wait(self.provider_timeout())
+        with self._lock:
+            entry=self._entries.get(base_currency)
+        if entry is None:
+            raise LookupError(f"No exchange rates available for {base_currency}")
+        return entry[0]
+
+    def provider_timeout(self):
+        timeout=getattr(self.provider, 'timeout', None)
+        if isinstance(timeout, tuple):
+            return sum(timeout) + 1
+        return (timeout or 10) + 1
+
+    def _start_refresh(self, base_currency, background):
+        """
+        Must be called with self._lock held. Returns the Event for the in-flight fetch, or
+        None while a failed fetch is backing off.
+        """
+        event=self._inflight.get(base_currency)
+        if event is not None:
+            return event
+        failure=self._failures.get(base_currency)
+        if failure is not None and time.time() < failure[0]:
+            self.stats['backoff_skips'] += 1
+            return None
+        event=threading.Event()
+        self._inflight[base_currency]=event
+        worker=threading.Thread(target=self._refresh, args=(base_currency, event), daemon=True)
+        worker.start()
+        return event
+
+    def _refresh(self, base_currency, event):
+        try:
+            rates=self.provider.fetch(base_currency)
+            with self._lock:
+                self.stats['fetches'] += 1
+                self._entries[base_currency]=(rates, time.time())
+                self._failures.pop(base_currency, None)
+            self._save_snapshot()
+        except Exception as e:
+            print(f"API Error: {e}")
+            with self._lock:
+                self.stats['fetch_errors'] += 1
+                previous=self._failures.get(base_currency)
+                backoff=min(previous[1] * 2, self.retry_max) if previous else self.retry_min
+                self._failures[base_currency]=(time.time() + backoff, backoff)
+        finally:
+            with self._lock:
+                self._inflight.pop(base_currency, None)
+            event.set()
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                data=json.load(f)
+            for base, item in data.items():
+                self._entries[base]=(item['rates'], item['fetched_at'])
+        except Exception as e:
+            print(f"Rate snapshot load error: {e}")
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            data={base: {'rates': rates, 'fetched_at': fetched_at} for base, (rates, fetched_at) in self._entries.items()}
+        try:
+            # Write then rename so readers never see a half-written file
+            tmp_path=f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            print(f"Rate snapshot save error: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache=RateCache(FrankfurterProvider())
+
+def get_rates(base_currency):
+    """Returns the rate table for base_currency, usually without any network call."""
+    return _cache.get(base_currency)
+
+async def get_rates_async(base_currency):
+    """
+    get_rates() for asyncio code (the Telegram bot). Cached tables are returned without
+    leaving the event loop; only a cold miss waits for the fetch, in a worker thread.
+    """
+    rates=_cache.peek(base_currency)
+    if rates is not None:
+        return rates
+    return await asyncio.to_thread(_cache.get, base_currency)
+
+def set_provider(provider, snapshot_path=None):
+    """Swaps the rate source, e.g. set_provider(StaticRateProvider({...})) in tests."""
+    global _cache
+    _cache=RateCache(provider, snapshot_path=snapshot_path)
+    return _cache
+
+def get_rate_stats():
+    with _cache._lock:
+        return dict(_cache.stats)
@@ -0,0 +1,195 @@
+#---Time-Bucket Rollups---
+# rollup_daily and rollup_monthly hold SUM(amount) and COUNT(*) per
+# (user_id, account_id, category_id, bucket). Reports and the dashboard read these
+# instead of the transactions table, so their cost depends on the number of buckets.
+#
+# Two ways to keep them current:
+#   - incrementally, from the write paths through ledger.apply_where() (same DB transaction)
+#   - a watermark-based catch-up job for rows written any other way (manual SQL, old code):
+#       python rollups.py catch-up            -> recompute buckets touched by rows past the watermark
+#       python rollups.py verify [user_id]    -> list daily buckets that disagree with transactions
+#       python rollups.py rebuild [user_id]   -> recompute everything from scratch
+import sys
+
+# First day of the transaction's month (avoids DATE_FORMAT, whose % clashes with query params)
+MONTH_OF = "DATE_SUB(t.transaction_date, INTERVAL DAYOFMONTH(t.transaction_date) - 1 DAY)"
+
+# Transactions of a soft-deleted account or category are waiting to be purged (see jobs.py)
+# and no longer count anywhere. Few parents are ever soft-deleted at once, so these
+# subqueries are a short index scan on deleted_at.
+LIVE = ("t.account_id NOT IN (SELECT account_id FROM accounts WHERE deleted_at IS NOT NULL)"
+        " AND t.category_id NOT IN (SELECT category_id FROM categories WHERE deleted_at IS NOT NULL)")
+
+CATCH_UP_BATCH = 5000
+# Rows whose ids were taken before the last run but committed after it: re-scan this many
+# ids behind the watermark each run. Recomputing a bucket is idempotent, so overlap is harmless.
+CATCH_UP_OVERLAP = 1000
+
+def apply_where(cursor, where, params, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) the transactions matching 'where' to/from both
+    rollups. 'where' may only reference the transactions alias 't'. Does not commit.
+    """
+    for table, bucket in (('rollup_daily', 't.transaction_date'), ('rollup_monthly', MONTH_OF)):
+        cursor.execute(f"""
+            INSERT INTO {table} (user_id, account_id, category_id, bucket, total, tx_count)
+            SELECT t.user_id, t.account_id, t.category_id, {bucket} AS b, %s * SUM(t.amount), %s * COUNT(*)
+            FROM transactions t
+            WHERE {where}
+            GROUP BY t.user_id, t.account_id, t.category_id, b
+            ON DUPLICATE KEY UPDATE total = total + VALUES(total), tx_count = tx_count + VALUES(tx_count)
+        """, (sign, sign) + tuple(params))
+
+def remove_account(cursor, user_id, account_id):
+    for table in ('rollup_daily', 'rollup_monthly'):
+        cursor.execute(f"DELETE FROM {table} WHERE user_id = %s AND account_id = %s", (user_id, account_id))
+
+def remove_category(cursor, user_id, category_id):
+    for table in ('rollup_daily', 'rollup_monthly'):
+        cursor.execute(f"DELETE FROM {table} WHERE user_id = %s AND category_id = %s", (user_id, category_id))
+
+def _scope(user_id, alias):
+    if user_id is None:
+        return "", ()
+    return f" AND {alias}.user_id = %s", (user_id,)
+
+def rebuild(cursor, user_id=None):
+    """Recomputes both rollups from the transactions table (all users if user_id is None). Does not commit."""
+    for table, bucket in (('rollup_daily', 't.transaction_date'), ('rollup_monthly', MONTH_OF)):
+        where, params = _scope(user_id, 'r')
+        cursor.execute(f"DELETE r FROM {table} r WHERE 1 = 1{where}", params)
+        where, params = _scope(user_id, 't')
+        cursor.execute(f"""
+            INSERT INTO {table} (user_id, account_id, category_id, bucket, total, tx_count)
+            SELECT t.user_id, t.account_id, t.category_id, {bucket} AS b, SUM(t.amount), COUNT(*)
+            FROM transactions t
+            WHERE {LIVE}{where}
+            GROUP BY t.user_id, t.account_id, t.category_id, b
+        """, params)
+
+def verify(conn, user_id=None):
+    """Returns daily buckets whose stored totals disagree with the transactions table."""
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    where, params = _scope(user_id, 't')
+    cursor.execute(f"""
+        SELECT d.user_id, d.account_id, d.category_id, d.bucket
+        FROM (
+            SELECT t.user_id, t.account_id, t.category_id, t.transaction_date AS bucket,
+                   SUM(t.amount) AS total, COUNT(*) AS tx_count
+            FROM transactions t
+            WHERE {LIVE}{where}
+            GROUP BY t.user_id, t.account_id, t.category_id, t.transaction_date
+        ) d
+        LEFT JOIN rollup_daily r ON r.user_id = d.user_id AND r.account_id = d.account_id
+             AND r.category_id = d.category_id AND r.bucket = d.bucket
+        WHERE r.user_id IS NULL OR r.total <> d.total OR r.tx_count <> d.tx_count
+    """, params)
+    drifted = cursor.fetchall()
+    cursor.close()
+    return drifted
+
+#---Watermark catch-up---
+def _get_watermark(cursor):
+    cursor.execute("SELECT watermark FROM rollup_state WHERE name = 'transactions'")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def catch_up(conn, batch_size=CATCH_UP_BATCH):
+    """
+    Recomputes every bucket touched by transactions with ids past the watermark,
+    one batch of ids per DB transaction. Returns the number of transactions scanned.
+    """
+    cursor = conn.cursor(buffered=True)
+    cursor.execute("SELECT GET_LOCK('expense_tracker_rollups', 0)")
+    if cursor.fetchone()[0] != 1:
+        print("Another catch-up job is running.")
+        return 0
+    scanned = 0
+    try:
+        watermark = _get_watermark(cursor)
+        start = max(watermark - CATCH_UP_OVERLAP, 0)
+        while True:
+            cursor.execute("""
+                SELECT MAX(transaction_id), COUNT(*) FROM (
+                    SELECT transaction_id FROM transactions
+                    WHERE transaction_id > %s ORDER BY transaction_id LIMIT %s
+                ) ids
+            """, (start, batch_size))
+            end, count = cursor.fetchone()
+            if not count:
+                break
+
+            # 1. Which buckets did these rows touch?
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS rollup_touched")
+            cursor.execute(f"""
+                CREATE TEMPORARY TABLE rollup_touched AS
+                SELECT DISTINCT t.user_id, t.account_id, t.category_id, t.transaction_date AS day
+                FROM transactions t
+                WHERE t.transaction_id > %s AND t.transaction_id <= %s AND {LIVE}
+            """, (start, end))
+
+            # 2. Recompute just those buckets from the source rows (idempotent, unlike adding deltas)
+            cursor.execute("""
+                REPLACE INTO rollup_daily (user_id, account_id, category_id, bucket, total, tx_count)
+                SELECT t.user_id, t.account_id, t.category_id, t.transaction_date, SUM(t.amount), COUNT(*)
+                FROM rollup_touched k
+                JOIN transactions t ON t.user_id = k.user_id AND t.account_id = k.account_id
+                     AND t.category_id = k.category_id AND t.transaction_date = k.day
+                GROUP BY t.user_id, t.account_id, t.category_id, t.transaction_date
+            """)
+            cursor.execute(f"""
+                REPLACE INTO rollup_monthly (user_id, account_id, category_id, bucket, total, tx_count)
+                SELECT t.user_id, t.account_id, t.category_id, {MONTH_OF} AS b, SUM(t.amount), COUNT(*)
+                FROM (
+                    SELECT DISTINCT user_id, account_id, category_id,
+                           DATE_SUB(day, INTERVAL DAYOFMONTH(day) - 1 DAY) AS month
+                    FROM rollup_touched
+                ) k
+                JOIN transactions t ON t.user_id = k.user_id AND t.account_id = k.account_id
+                     AND t.category_id = k.category_id
+                     AND t.transaction_date BETWEEN k.month AND LAST_DAY(k.month)
+                GROUP BY t.user_id, t.account_id, t.category_id, b
+            """)
+
+            # 3. Move the watermark forward in the same DB transaction
+            cursor.execute("""
+                INSERT INTO rollup_state (name, watermark) VALUES ('transactions', %s)
+                ON DUPLICATE KEY UPDATE watermark = GREATEST(watermark, VALUES(watermark))
+            """, (end,))
+            conn.commit()
+            scanned += count
+            start = end
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("DROP TEMPORARY TABLE IF EXISTS rollup_touched")
+        cursor.execute("SELECT RELEASE_LOCK('expense_tracker_rollups')")
+        cursor.close()
+    return scanned
+
+if __name__ == '__main__':
+    from database import get_db_connection
+    command = sys.argv[1] if len(sys.argv) > 1 else 'catch-up'
+    user_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    conn = get_db_connection()
+    try:
+        if command == 'catch-up':
+            print(f"Scanned {catch_up(conn)} transactions.")
+        elif command == 'verify':
+            drifted = verify(conn, user_id)
+            for row in drifted:
+                print(f"User {row['user_id']} account {row['account_id']} category {row['category_id']}: {row['bucket']} out of date")
+            if drifted:
+                sys.exit(1)
+            print("✅ Rollups match the transaction history.")
+        elif command == 'rebuild':
+            cursor = conn.cursor()
+            rebuild(cursor, user_id)
+            conn.commit()
+            print("Rollups rebuilt.")
+        else:
+            print(f"Unknown command: {command}")
+            sys.exit(2)
+    finally:
+        conn.close()